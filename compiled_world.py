@@ -0,0 +1,642 @@
+"""
+A World compiled into flat tables indexed by integer line ids, and an interpreter that steps
+through them. The simulation uses CompiledWorld in place of World, whose Phase objects walk
+label-keyed dicts, reparse the actions and recurse through help lines in every step. The
+conditions, actions and intensities are compiled into CompiledExpression objects, instead of
+being rewritten and evaluated as strings by ParseUtil.evaluate in every step, and the events are
+counted in a CompiledEventCounter, only for the counters that the conditions read. The stop
+condition is only evaluated when a counter or variable that it reads has changed. The stimuli,
+help lines and counters produced are the same as with World, including the calls to the random
+generator, unless a generator for the subject is set with set_random().
+"""
+import ast
+import copy
+import operator
+import random
+from bisect import bisect_right
+
+import keywords as kw
+from exceptions import ParseException
+from randomstreams import derive_random
+from util import ParseUtil, random_functions
+from variables import Variables
+
+# Action kinds
+ACTION_NONE = 0
+ACTION_SET_VARIABLE = 1
+ACTION_COUNT_RESET = 2
+ACTION_OMIT_LEARN = 3
+ACTION_INVALID = 4
+
+# Condition kinds
+CONDITION_NONE = 0
+CONDITION_BEHAVIOR = 1
+CONDITION_EXPRESSION = 2
+
+# How a name in a CompiledExpression is looked up
+NAME_VARIABLE = 0  # A variable (local before global), rand or choice
+NAME_COUNT = 1  # The count of an event (in a stop condition, or count() in a phase line condition)
+NAME_LINE_COUNT = 2  # The count_line of an event (a line label or count_line() in a phase line condition)
+NAME_BEHAVIOR = 3  # If the behavior is the last response (in a phase line condition)
+
+# The names that count() and count_line() calls are replaced with in phase line conditions,
+# followed by the event id
+COUNT_NAME = '_count_'
+COUNT_LINE_NAME = '_count_line_'
+
+EVAL_GLOBALS = {"__builtins__": None}
+
+# The comparison operators of a count comparison, see CompiledExpression
+COMPARE_OPERATORS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+                     ast.Gt: operator.gt, ast.GtE: operator.ge}
+
+
+class CompiledEventCounter():
+    """
+    The counters of a PhaseEventCounter in lists indexed by event id. The count_line of an event
+    is only valid if its generation stamp is the current generation, so reset_count_line() only
+    increments the generation.
+    """
+
+    def __init__(self, n_events):
+        self.count = [0] * n_events
+        self.count_line = [0] * n_events
+        self.count_line_generation = [0] * n_events
+        self.generation = 0
+        self.last_response = None
+
+    def increment_count(self, event_id):
+        self.count[event_id] += 1
+
+    def increment_count_line(self, event_id):
+        if self.count_line_generation[event_id] == self.generation:
+            self.count_line[event_id] += 1
+        else:
+            self.count_line[event_id] = 1
+            self.count_line_generation[event_id] = self.generation
+
+    def reset_count_line(self):
+        self.generation += 1
+
+    def reset_count(self, event_id):
+        self.count[event_id] = 0
+
+    def get_count_line(self, event_id):
+        if self.count_line_generation[event_id] == self.generation:
+            return self.count_line[event_id]
+        else:
+            return 0
+
+
+class CompiledExpression():
+    """
+    An expression compiled into a code object, which evaluate() evaluates with the same result and
+    errors as ParseUtil.evaluate. The count() and count_line() calls in a phase line condition are
+    replaced (once) with names looked up in the counters, and only the names used in the expression
+    are looked up in each evaluation.
+    """
+
+    def __init__(self, expr, event_counter_type=None, event_ids=None, linelabels=(), behaviors=(),
+                 line_label=None):
+        """
+        event_counter_type is ParseUtil.STOP_COND, ParseUtil.PHASE_LINE or None (for an
+        expression without counters), and event_ids is a dict with the id of each event name.
+        line_label is the label of the line of a phase line condition, which count_line() refers
+        to.
+        """
+        self.expr = expr
+        self.err = None
+
+        # The ids of the events whose count and count_line the expression reads, and the names of
+        # the variables and functions it reads
+        self.count_events = set()
+        self.count_line_events = set()
+        self.variable_names = set()
+
+        # For a stop condition "event op number", a tuple (event id, operator function, number)
+        self.count_comparison = None
+
+        if event_counter_type is None:
+            event_ids = dict()
+
+        expr = ParseUtil._single2double_eq(expr)
+        _, self.err = ParseUtil.ast_parse(expr)
+        if self.err is not None:
+            return
+
+        # As PhaseEventCounter.replace_count_functions
+        count_names = dict()  # The name kind and event id of each replaced call
+        if event_counter_type == ParseUtil.PHASE_LINE:
+            for event, event_id in event_ids.items():
+                call_name = f"{COUNT_NAME}{event_id}"
+                if f"count({event})" in expr:
+                    expr = expr.replace(f"count({event})", call_name)
+                    count_names[call_name] = (NAME_COUNT, event_id)
+            for event, event_id in event_ids.items():
+                call_name = f"{COUNT_LINE_NAME}{event_id}"
+                if f"count_line({event})" in expr:
+                    expr = expr.replace(f"count_line({event})", call_name)
+                    count_names[call_name] = (NAME_LINE_COUNT, event_id)
+            if line_label is not None and "count_line()" in expr:
+                call_name = f"{COUNT_LINE_NAME}{event_ids[line_label]}"
+                expr = expr.replace("count_line()", call_name)
+                count_names[call_name] = (NAME_LINE_COUNT, event_ids[line_label])
+        tree, self.err = ParseUtil.ast_parse(expr)
+        if self.err is not None:
+            return
+
+        self.has_boolean_operator = False
+
+        # Tuples (name, name kind, event id), in the order they are checked. The event id of a
+        # variable is not None if it is an event name, which is not an unknown variable.
+        self.names = list()
+        names = set()
+        for node in ast.walk(tree):
+            if type(node) is ast.Name:
+                name = node.id
+                if name in names:
+                    continue
+                names.add(name)
+                event_id = event_ids.get(name)
+                if name in count_names:
+                    name_kind, event_id = count_names[name]
+                elif event_counter_type == ParseUtil.STOP_COND and event_id is not None:
+                    name_kind = NAME_COUNT
+                elif event_counter_type == ParseUtil.PHASE_LINE and name in linelabels:
+                    name_kind = NAME_LINE_COUNT
+                elif event_counter_type == ParseUtil.PHASE_LINE and name in behaviors:
+                    name_kind = NAME_BEHAVIOR
+                else:
+                    name_kind = NAME_VARIABLE
+                if name_kind == NAME_COUNT:
+                    self.count_events.add(event_id)
+                elif name_kind == NAME_LINE_COUNT:
+                    self.count_line_events.add(event_id)
+                else:
+                    self.variable_names.add(name)
+                self.names.append((name, name_kind, event_id))
+            elif type(node) is ast.BoolOp:
+                self.has_boolean_operator = True
+
+        if event_counter_type == ParseUtil.STOP_COND:
+            self.count_comparison = CompiledExpression._count_comparison(tree.body, event_ids)
+        self.code = compile(tree, '<expression>', 'eval')
+
+    @staticmethod
+    def _count_comparison(node, event_ids):
+        """The count comparison (see self.count_comparison) that node is, or None."""
+        if type(node) is not ast.Compare or len(node.ops) != 1:
+            return None
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if type(left) is not ast.Name or left.id not in event_ids or type(op) not in COMPARE_OPERATORS:
+            return None
+        if type(right) is not ast.Constant or type(right.value) not in (int, float):
+            return None
+        return event_ids[left.id], COMPARE_OPERATORS[type(op)], right.value
+
+    def evaluate(self, local_values, global_values, functions, event_counter=None):
+        """
+        Evaluate the expression with the specified dicts of local and global variable values, the
+        dict of functions (see util.random_functions) and CompiledEventCounter.
+
+        Returns evaluated_value, error
+        """
+        if self.err is not None:
+            return None, self.err
+
+        namespace = dict()
+        for name, name_kind, event_id in self.names:
+            if name_kind == NAME_COUNT:
+                namespace[name] = event_counter.count[event_id]
+            elif name_kind == NAME_LINE_COUNT:
+                namespace[name] = event_counter.get_count_line(event_id)
+            elif name_kind == NAME_BEHAVIOR and event_counter.last_response is not None:
+                namespace[name] = (name == event_counter.last_response)
+            elif name in local_values:
+                namespace[name] = local_values[name]
+            elif name in global_values:
+                namespace[name] = global_values[name]
+            elif name in functions:
+                namespace[name] = functions[name]
+            elif event_id is None:
+                return None, f"Unknown variable '{name}'."
+
+        try:
+            out = eval(self.code, EVAL_GLOBALS, namespace)
+        except Exception as ex:
+            err = f"Cannot evaluate expression '{self.expr}': {ex}"
+            if not err.endswith("."):  # Some errors {ex} ends with period, some don't
+                err = err + "."
+            return None, err
+
+        # Due to short-circuiting, "0 and False" is 0 (int), but "1 and False" is False (bool)
+        if self.has_boolean_operator:
+            out = bool(out)
+
+        type_out = type(out)
+        if type_out is not int and type_out is not float and type_out is not bool:
+            return None, f"Error in expression '{self.expr}'."
+        else:
+            return out, None
+
+
+def compile_action(action):
+    """
+    Return the action (as in Phase._perform_action) as a tuple (kind, arg1, arg2). For setting a
+    variable, arg2 is the value as a CompiledExpression.
+    """
+    if len(action) == 0:
+        return (ACTION_NONE, None, None)
+    elif action.count(':') == 1 or action.count('=') == 1:
+        if action.count('=') == 1:
+            sep = '='
+        else:
+            sep = ':'
+        var_name, value_str = ParseUtil.split1_strip(action, sep=sep)
+        return (ACTION_SET_VARIABLE, var_name, CompiledExpression(value_str))
+    elif action.startswith("count_reset(") and action.endswith(")"):
+        return (ACTION_COUNT_RESET, action[12:-1], None)
+    elif action == kw.OMIT_LEARN:
+        return (ACTION_OMIT_LEARN, None, None)
+    else:
+        return (ACTION_INVALID, None, None)
+
+
+class CompiledCondition():
+    """
+    A PhaseLineCondition with the goto labels replaced by line ids and the expressions compiled.
+    """
+
+    def __init__(self, condition_obj, line_ids, line_label, event_ids, linelabels, behaviors):
+        self.unconditional_actions = [compile_action(a) for a in condition_obj.unconditional_actions]
+        self.conditional_actions = [compile_action(a) for a in condition_obj.conditional_actions]
+        self.condition = condition_obj.condition
+        self.condition_expr = None
+        if condition_obj.condition is None:
+            self.kind = CONDITION_NONE
+        elif condition_obj.condition_is_behavior:
+            self.kind = CONDITION_BEHAVIOR
+        else:
+            self.kind = CONDITION_EXPRESSION
+            self.condition_expr = CompiledExpression(condition_obj.condition, ParseUtil.PHASE_LINE,
+                                                     event_ids, linelabels, behaviors, line_label)
+
+        # The probabilities (numbers, or expressions evaluated when first used) and line ids to
+        # go to
+        self.goto_probs = [prob if type(prob) is not str else CompiledExpression(prob)
+                           for prob, _ in condition_obj.goto]
+        self.goto_lines = [line_ids[label] for _, label in condition_obj.goto]
+
+        # The cumulative sum of goto_probs, set when first used
+        self.goto_cumsum = None
+
+
+class CompiledPhase():
+    """
+    The lines of a Phase in lists indexed by line id, and the state of a subject in the phase.
+    The lists are shared between copies made with copy().
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.label = phase.label
+        self.lineno = phase.lineno
+        self.parameters = phase.parameters
+        self.global_variables = phase.global_variables
+        self.linelabels = phase.linelabels
+        self.stop_condition_str = phase.stop_condition_str
+
+        line_ids = {label: i for i, label in enumerate(phase.phase_lines)}
+        self.first_line = line_ids[phase.first_label]
+
+        behaviors = phase.parameters.get(kw.BEHAVIORS)
+        event_names = list(phase.parameters.get(kw.STIMULUS_ELEMENTS)) + list(behaviors) + phase.linelabels
+        self.event_ids = dict()
+        for event in event_names:
+            self.event_ids.setdefault(event, len(self.event_ids))
+
+        self.labels = list()
+        self.linenos = list()
+        self.stimuli = list()  # A dict for each line, None for help lines
+        self.stimulus_elements = list()  # The elements in each stimulus, as a tuple
+        self.stimulus_has_expr = list()  # If the intensity of any element is a CompiledExpression
+        self.help_actions = list()
+        self.conditions = list()  # A list of CompiledCondition for each line
+        self.logic_strs = list()
+        for label, phase_line in phase.phase_lines.items():
+            self.labels.append(label)
+            self.linenos.append(phase_line.lineno)
+            if phase_line.is_help_line:
+                self.stimuli.append(None)
+                self.stimulus_elements.append(None)
+                self.stimulus_has_expr.append(False)
+                self.help_actions.append(compile_action(phase_line.action))
+            else:
+                stimulus = {element: intensity if type(intensity) is not str else CompiledExpression(intensity)
+                            for element, intensity in phase_line.stimulus.items()}
+                self.stimuli.append(stimulus)
+                self.stimulus_elements.append(tuple(stimulus))
+                self.stimulus_has_expr.append(any(type(i) is CompiledExpression for i in stimulus.values()))
+                self.help_actions.append(None)
+            self.conditions.append([CompiledCondition(c, line_ids, label, self.event_ids, phase.linelabels, behaviors)
+                                    for c in phase_line.conditions.conditions])
+            self.logic_strs.append(phase_line.conditions.logic_str)
+
+        # The random generator of the subject (None for the global generator), and the key
+        # (random_seed, run label, phase index) of the generators used for evaluating the
+        # intensities and goto probabilities of a line (which are evaluated once, when first
+        # used). Set with CompiledWorld.set_random().
+        self.rng = None
+        self.seed_key = None
+        self.functions = random_functions()
+
+        # The line number in errors from the stop condition is the one of the stop condition of
+        # the Phase object until the first reset, as in Phase
+        self.stop_condition_expr = None
+        self.stop_condition_lineno = None
+        if self.stop_condition_str is not None:
+            self.stop_condition_expr = CompiledExpression(self.stop_condition_str, ParseUtil.STOP_COND,
+                                                          self.event_ids)
+        if phase.stop_condition is not None:
+            self.stop_condition_lineno = phase.stop_condition.lineno
+
+        # The stop condition is evaluated again only if a counter or local variable that it reads
+        # has changed, or always if it uses a random function (or does not parse, which raises)
+        self.stop_condition_events = set()
+        self.stop_condition_variables = set()
+        self.stop_condition_always = True
+        if self.stop_condition_expr is not None:
+            self.stop_condition_events = self.stop_condition_expr.count_events
+            self.stop_condition_variables = self.stop_condition_expr.variable_names
+            self.stop_condition_always = (self.stop_condition_expr.err is not None or
+                                          not self.stop_condition_variables.isdisjoint(self.functions))
+
+        # Only the counters that some condition reads are incremented: the ids of the events in
+        # each line (the label and the stimulus elements), and the id of each response
+        count_events = set()
+        count_line_events = set()
+        exprs = [c.condition_expr for conditions in self.conditions for c in conditions]
+        exprs.append(self.stop_condition_expr)
+        for expr in exprs:
+            if expr is not None:
+                count_events.update(expr.count_events)
+                count_line_events.update(expr.count_line_events)
+        self.line_count_events = list()
+        self.line_count_line_events = list()
+        for label, elements in zip(self.labels, self.stimulus_elements):
+            line_event_ids = [self.event_ids[label]] + [self.event_ids[e] for e in elements or ()]
+            self.line_count_events.append(tuple(i for i in line_event_ids if i in count_events))
+            self.line_count_line_events.append(tuple(i for i in line_event_ids if i in count_line_events))
+        self.response_count_event = {b: self.event_ids[b] for b in behaviors if self.event_ids[b] in count_events}
+        self.response_count_line_event = {b: self.event_ids[b] for b in behaviors
+                                          if self.event_ids[b] in count_line_events}
+        self.line_changes_stop_condition = [not self.stop_condition_events.isdisjoint(event_ids)
+                                            for event_ids in self.line_count_events]
+        self.response_changes_stop_condition = {b for b in behaviors
+                                                if self.event_ids[b] in self.stop_condition_events}
+
+        # State, set in subject_reset()
+        self._reset_state()
+
+    def copy(self):
+        """Return a copy sharing the compiled lines, with the state of a new subject."""
+        cpy = copy.copy(self)
+        cpy.subject_reset()
+        return cpy
+
+    def subject_reset(self):
+        self.stop_condition_lineno = self.lineno
+        self._reset_state()
+
+    def _reset_state(self):
+        self.event_counter = CompiledEventCounter(len(self.event_ids))
+        self.local_variables = Variables()
+        self.curr_line = self.first_line
+        self.prev_linelabel = None
+        self.is_first_line = True
+        self.first_stimulus_presented = False
+        self.stop_condition_changed = True
+
+    def next_stimulus(self, response):
+        """
+        Same as Phase.next_stimulus(response), iterating over help lines instead of recursing.
+        """
+        event_counter = self.event_counter
+
+        if response is not None:
+            if response in self.response_count_event:
+                event_counter.increment_count(self.response_count_event[response])
+            if response in self.response_count_line_event:
+                event_counter.increment_count_line(self.response_count_line_event[response])
+            event_counter.last_response = response
+            if response in self.response_changes_stop_condition:
+                self.stop_condition_changed = True
+
+        preceeding_help_lines = ()
+        omit_learn = False
+        while True:
+            if self.first_stimulus_presented and self._stop_condition_is_met():
+                return None, None, preceeding_help_lines, None
+
+            if self.is_first_line:
+                line = self.first_line
+                self.is_first_line = False
+                omit_learn = True  # Since response is None, there is no learning to do
+            else:
+                line, line_omit_learn = self._next_line(response)
+                omit_learn = (omit_learn or line_omit_learn)
+                self.prev_linelabel = self.labels[self.curr_line]
+                self.curr_line = line
+
+            label = self.labels[line]
+            stimulus = self.stimuli[line]
+            if self.stimulus_has_expr[line]:
+                self._evaluate_intensities(line)
+
+            if label != self.prev_linelabel:
+                event_counter.reset_count_line()
+
+            for event_id in self.line_count_events[line]:
+                event_counter.increment_count(event_id)
+            for event_id in self.line_count_line_events[line]:
+                event_counter.increment_count_line(event_id)
+            if self.line_changes_stop_condition[line]:
+                self.stop_condition_changed = True
+
+            if stimulus is None:  # Help line
+                self._perform_action(self.linenos[line], self.help_actions[line])
+                if not preceeding_help_lines:
+                    preceeding_help_lines = list()
+                preceeding_help_lines.append(label)
+            else:
+                self.first_stimulus_presented = True
+                return stimulus, label, preceeding_help_lines, omit_learn
+
+    def _stop_condition_is_met(self):
+        """
+        Same as EndPhaseCondition.is_met, if a counter or variable that the stop condition reads
+        has changed since it was last evaluated (to False). Otherwise False.
+        """
+        if not self.stop_condition_changed:
+            return False
+
+        count_comparison = self.stop_condition_expr.count_comparison
+        if count_comparison is not None:
+            event_id, compare, value = count_comparison
+            ismet = compare(self.event_counter.count[event_id], value)
+        else:
+            ismet, err = self.stop_condition_expr.evaluate(self.local_variables.values,
+                                                           self.global_variables.values, self.functions,
+                                                           self.event_counter)
+            if err:
+                raise ParseException(self.stop_condition_lineno, err)
+            if type(ismet) is not bool:
+                raise ParseException(self.stop_condition_lineno,
+                                     f"Condition '{self.stop_condition_str}' is not a boolean expression.")
+        self.stop_condition_changed = ismet or self.stop_condition_always
+        return ismet
+
+    def _evaluate_intensities(self, line):
+        # As in Phase.next_stimulus, the expression is replaced by its value when first used
+        stimulus = self.stimuli[line]
+        functions = random_functions(self._line_random(line))
+        for element, intensity in stimulus.items():
+            if type(intensity) is CompiledExpression:
+                stimulus[element], err = intensity.evaluate(self.local_variables.values,
+                                                            self.global_variables.values, functions)
+                if err:
+                    raise ParseException(self.linenos[line], err)
+        self.stimulus_has_expr[line] = False
+
+    def _next_line(self, response):
+        """Same as PhaseLineConditions.next_line for the current line."""
+        lineno = self.linenos[self.curr_line]
+        for condition in self.conditions[self.curr_line]:
+            omit_learn1 = False
+            for action in condition.unconditional_actions:
+                omit_learn1 = self._perform_action(lineno, action) or omit_learn1
+
+            if condition.kind == CONDITION_NONE:
+                ismet = True
+            elif condition.kind == CONDITION_BEHAVIOR:
+                ismet = (condition.condition == response)
+            else:
+                ismet, err = condition.condition_expr.evaluate(self.local_variables.values,
+                                                               self.global_variables.values, self.functions,
+                                                               self.event_counter)
+                if err:
+                    raise ParseException(lineno, err)
+                if type(ismet) is not bool:
+                    raise ParseException(lineno, f"Condition '{condition.condition}' is not a boolean expression.")
+
+            if ismet:
+                line = self._goto(condition, lineno, self.curr_line)
+                if line is not None:  # In "ROW1(0.1),ROW2(0.3)", None is returned with prob. 0.6
+                    omit_learn2 = False
+                    for action in condition.conditional_actions:
+                        omit_learn2 = self._perform_action(lineno, action) or omit_learn2
+                    return line, (omit_learn1 or omit_learn2)
+
+        raise ParseException(lineno, f"No condition in '{self.logic_strs[self.curr_line]}' was met for response '{response}'.")
+
+    def _line_random(self, line):
+        """The random generator for the one-time evaluations in the specified line."""
+        if self.seed_key is None:
+            return self.rng
+        return derive_random(*self.seed_key, line)
+
+    def _goto(self, condition, lineno, line):
+        """Same as PhaseLineCondition._goto_if_met."""
+        if condition.goto_cumsum is None:
+            functions = random_functions(self._line_random(line))
+            goto_cumsum = list()
+            cumsum = 0
+            for i, prob in enumerate(condition.goto_probs):
+                if type(prob) is CompiledExpression:
+                    condition.goto_probs[i], err = prob.evaluate(self.local_variables.values,
+                                                                 self.global_variables.values, functions)
+                    if err:
+                        raise ParseException(lineno, err)
+                cumsum += condition.goto_probs[i]
+                goto_cumsum.append(cumsum)
+            if cumsum > 1:
+                raise ParseException(lineno, f"Sum of probabilities is {cumsum}>1.")
+            condition.goto_cumsum = goto_cumsum
+
+        # As ParseUtil.weighted_choice
+        rng = random if self.rng is None else self.rng
+        ind = bisect_right(condition.goto_cumsum, rng.random())
+        if ind == len(condition.goto_cumsum):
+            return None
+        return condition.goto_lines[ind]
+
+    def _perform_action(self, lineno, action):
+        """Same as Phase._perform_action. Returns True for @omit_learn."""
+        kind, arg1, arg2 = action
+        if kind == ACTION_NONE:
+            return False
+        elif kind == ACTION_SET_VARIABLE:
+            value, err = arg2.evaluate(self.local_variables.values, self.global_variables.values, self.functions)
+            if err:
+                raise ParseException(lineno, err)
+            err = self.local_variables.set(arg1, value, self.parameters)
+            if err:
+                raise ParseException(lineno, err)
+            if arg1 in self.stop_condition_variables:
+                self.stop_condition_changed = True
+            return False
+        elif kind == ACTION_COUNT_RESET:
+            event_id = self.event_ids[arg1]
+            self.event_counter.reset_count(event_id)
+            if event_id in self.stop_condition_events:
+                self.stop_condition_changed = True
+            return False
+        elif kind == ACTION_OMIT_LEARN:
+            return True
+        else:
+            raise ParseException(lineno, "Internal error.")  # Should have been caught during Pase.parse()
+
+
+class CompiledWorld():
+    """A World compiled into CompiledPhase objects, with the same interface as World."""
+
+    def __init__(self, world):
+        self.phases = [CompiledPhase(phase) for phase in world.phases]
+        self.nphases = len(self.phases)
+        self.curr_phaseind = 0
+
+    def copy(self):
+        """Return a copy sharing the compiled phases, with the state of a new subject."""
+        cpy = copy.copy(self)
+        cpy.phases = [phase.copy() for phase in self.phases]
+        cpy.curr_phaseind = 0
+        return cpy
+
+    def next_stimulus(self, response):
+        """Returns a stimulus-tuple and current phase label."""
+        while True:
+            curr_phase = self.phases[self.curr_phaseind]
+            stimulus, row_lbl, preceeding_help_lines, omit_learn = curr_phase.next_stimulus(response)
+            if stimulus is not None:
+                return stimulus, curr_phase.label, row_lbl, preceeding_help_lines, omit_learn
+            if self.curr_phaseind + 1 >= self.nphases:  # No more phases
+                return None, curr_phase.label, row_lbl, preceeding_help_lines, None
+            self.curr_phaseind += 1  # Go to next phase
+
+    def subject_reset(self):
+        self.curr_phaseind = 0
+        for phase in self.phases:
+            phase.subject_reset()
+
+    def set_random(self, rng, seed_key):
+        """
+        Use the random generator rng for the subject. The intensities and goto probabilities that
+        are expressions are evaluated (once) with generators derived from seed_key (random_seed,
+        run label), the phase index and the line, so that their values do not depend on which
+        subject first uses them.
+        """
+        functions = random_functions(rng)
+        for phase_ind, phase in enumerate(self.phases):
+            phase.rng = rng
+            phase.seed_key = tuple(seed_key) + (phase_ind,)
+            phase.functions = functions
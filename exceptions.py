@@ -5,6 +5,11 @@ class ParseException(Exception):
         else:
             super().__init__("Error: " + msg)
         self.lineno = lineno
+        self.msg = msg
+
+    def __reduce__(self):
+        # To be able to pass the exception from a worker process
+        return (ParseException, (self.lineno, self.msg))
 
 
 class EvalException(Exception):
@@ -13,6 +18,12 @@ class EvalException(Exception):
             super().__init__(msg)
         else:
             super().__init__("Error on line {}".format(lineno) + ": " + msg)
+        self.msg = msg
+        self.lineno = lineno
+
+    def __reduce__(self):
+        # To be able to pass the exception from a worker process
+        return (EvalException, (self.msg, self.lineno))
 
 
 class InterruptedSimulation(Exception):
@@ -296,7 +296,9 @@ class Gui():
         self.add_msg("Starting simulation.")
         t = time.time()
         try:
-            self.simulation_data = self.script_obj.run(self.progress)
+            # Write everything to the output, since "Plot" post-processes it with the (possibly
+            # edited) script
+            self.simulation_data = self.script_obj.run(self.progress, record_all=True)
             elapsed = time.time() - t
             elapsed_rounded = round(elapsed, ndigits=4)
             self.add_msg(f"Simulation completed in {elapsed_rounded} s.")
@@ -29,6 +29,8 @@ CUMULATIVE = 'cumulative'
 MATCH = 'match'
 FILENAME = 'filename'
 RANDOM_SEED = 'random_seed'
+JOBS = 'jobs'
+ENGINE = 'engine'
 
 # Commands
 RUN = '@run'
@@ -91,6 +93,8 @@ KEYWORDS = (BEHAVIORS,
             MATCH,
             FILENAME,
             RANDOM_SEED,
+            JOBS,
+            ENGINE,
             VARIABLES,
             PHASE,
             RUN,
@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 
 import gui
 import parsing
@@ -18,14 +19,38 @@ def get_man_page():
     python lesim.py gui
         Starts the Learning Simulator gui
 
-    python lesim.py run file1 [file2, file3, ...]
+    python lesim.py run [--jobs n] file1 [file2, file3, ...]
         Run the script files file1, file2, ...
+        With --jobs n, the subjects of each run are simulated in n parallel
+        processes (overrides the parameter jobs in the scripts)
 
     python lesim.py help
         Display this help and exit"""
 
 
+def parse_jobs_option(args):
+    """
+    Remove the option --jobs n (or --jobs=n) from the list args and return n (or None if the
+    option is not given).
+    """
+    for i, arg in enumerate(args):
+        if arg == "--jobs" or arg.startswith("--jobs="):
+            if arg == "--jobs":
+                if i + 1 == len(args):
+                    raise ValueError("Option --jobs requires a value.")
+                value = args[i + 1]
+                del args[i: i + 2]
+            else:
+                value = arg[len("--jobs="):]
+                del args[i]
+            if not value.isdigit() or int(value) == 0:
+                raise ValueError("Option --jobs must be a positive integer.")
+            return int(value)
+    return None
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     args = sys.argv
     nargs = len(args)
     assert(nargs >= 1)
@@ -42,6 +67,11 @@ if __name__ == "__main__":
             guiObj = gui.Gui()
         elif arg1 == RUN:
             files = args[2:len(args)]
+            try:
+                jobs = parse_jobs_option(files)
+            except ValueError as ex:
+                print(ex)
+                sys.exit(1)
             if len(files) == 0:
                 print("No script file given to lesim run. Type 'lesim.py help' for the available options.")
             nfiles = len(files)
@@ -55,7 +85,8 @@ if __name__ == "__main__":
                 if msg is not None:
                     print(msg)
 
-                simulation_data = script_obj.run()
+                # The output is only post-processed with this script
+                simulation_data = script_obj.run(jobs=jobs, record_all=False)
                 script_obj.postproc(simulation_data)
                 block = (i == nfiles - 1)
                 script_obj.plot(block)
@@ -1,96 +1,209 @@
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from itertools import accumulate
 from math import exp
-from random import seed, random
+import random
+
+import numpy as np
 
 import keywords as kw
 from util import dict_inv, ParseUtil
 
-seed()
+# With trace, an element whose internal intensity decays below this is removed from the active
+# set, see Mechanism._decay_stimulus_intensities
+TRACE_CUTOFF = 1e-12
 
 
 class Mechanism():
-    '''Base class for mechanisms'''
+    '''
+    Base class for mechanisms.
+
+    The state (v and w) and the parameters are held in lists indexed by element and behavior
+    ids, which are the indices in the parameters stimulus_elements and behaviors. The attributes
+    v and w are dict views of the state, keyed by (element, behavior) and element as in the
+    parameters start_v and start_w.
+
+    The feasible behaviors of each combination of elements, and the exponents of the support
+    vector of each stimulus (see ExponentTable), are cached.
+
+    With trace, the internal intensities are held in dicts keyed by element id, with only the
+    active elements, whose intensity has not decayed below TRACE_CUTOFF.
+    '''
 
     def __init__(self, parameters):
         self.parameters = parameters
         self.trace = self.parameters.get(kw.TRACE)
         self.use_trace = (self.trace != 0)
 
+        self.elements = list(parameters.get(kw.STIMULUS_ELEMENTS))
+        self.behaviors = list(parameters.get(kw.BEHAVIORS))
+        self.element_ind = {e: i for i, e in enumerate(self.elements)}
+        self.behavior_ind = {b: i for i, b in enumerate(self.behaviors)}
+
+        # Parameters, resolved once. None if not specified.
+        self.alpha_v = self._element_behavior_list(parameters.get(kw.ALPHA_V))
+        self.beta = self._element_behavior_list(parameters.get(kw.BETA))
+        self.mu = self._element_behavior_list(parameters.get(kw.MU))
+        self.alpha_w = self._element_list(parameters.get(kw.ALPHA_W))
+        self.u = self._element_list(parameters.get(kw.U))
+        self.c = [parameters.get(kw.BEHAVIOR_COST)[b] for b in self.behaviors]
+        self.discount = parameters.get(kw.DISCOUNT)
+
         if self.use_trace:
-            self.stimulus_intensities = {s: 0 for s in parameters.get(kw.STIMULUS_ELEMENTS)}
-            self.prev_stimulus_intensities = dict(self.stimulus_intensities)
+            self.stimulus_intensities = dict()
+            self.prev_stimulus_intensities = dict()
+
+            # The elements whose v for the previous response may have changed in the last
+            # learn_and_respond (those with an intensity in the previous internal intensities)
+            self.trace_v_elements = list()
+
+            # The ids of the responses for which learn_i has made v (and w) floats, and whether
+            # it did in the last learn_and_respond, see _trace_floats
+            self.trace_float_responses = set()
+            self.trace_floats_made = False
+
+            # The sum of mu over all elements, for each behavior
+            self.mu_sum = [sum(self.mu[i][b] for i in range(len(self.elements)))
+                           for b in range(len(self.behaviors))]
         else:
             self.stimulus_intensities = None
             self.prev_stimulus_intensities = None
+            self.trace_v_elements = None
+            self.trace_float_responses = None
 
         self.v = None
         self.w = None
         self.prev_stimulus = None
         self.response = None
 
+        # The random generator for the responses, set for each subject by the simulation. None
+        # for the global generator.
+        self.rng = None
+
+        # The previous stimulus as a list of (element id, intensity) tuples, and the id of
+        # self.response
+        self.prev_stimulus_ids = None
+        self.response_ind = None
+
         # Make self.stimulus_req
         self.stimulus_req = dict_inv(parameters.get(kw.RESPONSE_REQUIREMENTS))
 
+        # The ids of the possible responses to each element (keys are element ids). None if all
+        # behaviors are possible responses to all elements.
+        if self.stimulus_req:
+            self.stimulus_req_ind = dict()
+            for element, element_behaviors in self.stimulus_req.items():
+                self.stimulus_req_ind[self.element_ind[element]] = [self.behavior_ind[b] for b in element_behaviors]
+        else:
+            self.stimulus_req_ind = None
+
+        # The lists of the ids of the feasible behaviors, keyed by the tuple of the element ids
+        # of the stimulus
+        self.feasible_behaviors_cache = dict()
+
+        self.exponent_table = None
         self.subject_reset()
 
+    def _element_behavior_list(self, d):
+        if d is None:
+            return None
+        return [[d[(e, b)] for b in self.behaviors] for e in self.elements]
+
+    def _element_list(self, d):
+        if d is None:
+            return None
+        return [d[e] for e in self.elements]
+
     def subject_reset(self):
-        self.v = dict(self.parameters.get(kw.START_V))
-        self.w = dict(self.parameters.get(kw.START_W))
+        self.v_list = self._element_behavior_list(self.parameters.get(kw.START_V))
+        self.w_list = self._element_list(self.parameters.get(kw.START_W))
+        self.exponent_table = ExponentTable(self)
+        self.v = MatrixView(self.v_list, self.element_ind, self.behavior_ind, self.exponent_table.invalidate)
+        self.w = VectorView(self.w_list, self.element_ind)
         self.prev_stimulus = None
         self.response = None
+        self.prev_stimulus_ids = None
+        self.response_ind = None
 
         if self.use_trace:
             self._reset_trace()
 
-    def foo_reset_trace(self, stimulus=None):
-        for s in self.stimulus_intensities:
-            if (stimulus is not None) and (s in stimulus):  # Keep intensities for the elements in stimulus
-                self.stimulus_intensities[s] = stimulus[s]
-            else:
-                self.stimulus_intensities[s] = 0
-        for s in self.prev_stimulus_intensities:
-            self.prev_stimulus_intensities[s] = 0
-
     def _reset_trace(self, stimulus=None):
-        for s in self.stimulus_intensities:
-            self.stimulus_intensities[s] = 0
-        for s in self.prev_stimulus_intensities:
-            self.prev_stimulus_intensities[s] = 0
+        self.stimulus_intensities.clear()
+        self.prev_stimulus_intensities.clear()
+        self.trace_v_elements = list()
+        self.trace_float_responses = set()
+        self.trace_floats_made = False
+
+    def _trace_floats(self, r, include_w=False):
+        '''
+        Make v[i][r] (and w[i] if include_w) floats for all elements i, the first time learn_i
+        learns for the response r, and write v for all elements in that step (see
+        trace_v_elements). This is what learn_i did when it also updated (by zero) and wrote the
+        elements that are not in the internal intensities, and it makes integer start values be
+        written (and exported) as floats, as then.
+        '''
+        if r in self.trace_float_responses:
+            return
+        for v_i in self.v_list:
+            v_i[r] = float(v_i[r])
+        if include_w:
+            w = self.w_list
+            for i in range(len(w)):
+                w[i] = float(w[i])
+        self.trace_float_responses.add(r)
+        self.trace_floats_made = True
 
     def _decay_stimulus_intensities(self, stimulus):
-        '''stimulus is a dict.'''
-        for e in self.stimulus_intensities:
-            self.stimulus_intensities[e] *= self.trace
-        for e in stimulus:
-            self.stimulus_intensities[e] += stimulus[e]
+        '''stimulus is a list of (element id, intensity) tuples.'''
+        trace = self.trace
+        intensities = dict()
+        for i, intensity in self.stimulus_intensities.items():
+            intensity *= trace
+            if abs(intensity) >= TRACE_CUTOFF:
+                intensities[i] = intensity
+        for i, intensity in stimulus:
+            intensities[i] = intensities.get(i, 0) + intensity
+        self.stimulus_intensities = intensities
 
     def learn_and_respond(self, stimulus, omit=False):
         '''stimulus is a dict.'''
+        element_ind = self.element_ind
+        stimulus_ids = [(element_ind[e], intensity) for e, intensity in stimulus.items()]
+
         if self.use_trace:
-            self._decay_stimulus_intensities(stimulus)
+            self._decay_stimulus_intensities(stimulus_ids)
 
         if (self.prev_stimulus is None) or omit:  # Do not update if first time or if omit
             pass
         else:
             if self.use_trace:
-                self.learn_i(stimulus)
+                self.learn_i(stimulus_ids)
             else:
-                self.learn(stimulus)
-
-        self.response = self._get_response(stimulus)
+                self.learn(stimulus_ids)
+                for i, _ in self.prev_stimulus_ids:
+                    self.exponent_table.invalidate(i, self.response_ind)
 
-        # if self.use_trace and omit:
-        #     # XXX Should be a separate @cleartrace or something that triggers
-        #     # this reset (separate from "omit learning")
-        #     self._reset_trace(stimulus)
+        self.response_ind = self._get_response(stimulus_ids)
+        self.response = self.behaviors[self.response_ind]
 
         self.prev_stimulus = dict(stimulus)  # dict ok?
+        self.prev_stimulus_ids = stimulus_ids
         if self.use_trace:
-            for s in self.parameters.get(kw.STIMULUS_ELEMENTS):
-                self.prev_stimulus_intensities[s] = self.stimulus_intensities[s]
+            if self.trace_floats_made:
+                self.trace_v_elements = list(self.elements)
+                self.trace_floats_made = False
+            else:
+                self.trace_v_elements = [self.elements[i] for i in self.prev_stimulus_intensities]
+            self.prev_stimulus_intensities = self.stimulus_intensities
 
         return self.response
 
     def learn(self, stimulus):
+        '''
+        stimulus is a list of (element id, intensity) tuples. Only v[i][r] for the elements i in
+        self.prev_stimulus_ids and the response r may be changed, see ExponentTable.
+        '''
         # Must be overridden
         raise NotImplementedError
 
@@ -99,19 +212,65 @@ class Mechanism():
         raise NotImplementedError(f"Trace not implemented in mechanism '{mechanism_name}'.")
 
     def _get_response(self, stimulus):
+        '''Returns the id of the response.'''
         x, feasible_behaviors = self._support_vector(stimulus)
-        q = random() * sum(x)
-        index = 0
-        while q > sum(x[0:index + 1]):
-            index += 1
-        return feasible_behaviors[index]
+        x_cumsum = list(accumulate(x))
+        rng = random if self.rng is None else self.rng
+        q = rng.random() * x_cumsum[-1]
+        # The first index for which q <= x_cumsum[index]
+        return feasible_behaviors[bisect_left(x_cumsum, q)]
+
+    def _feasible_behaviors(self, stimulus):
+        '''Same as get_feasible_behaviors, with ids. stimulus is a list of (element id, intensity)
+        tuples. The returned list is cached and must not be modified.'''
+        key = tuple(i for i, _ in stimulus)
+        feasible_behaviors = self.feasible_behaviors_cache.get(key)
+        if feasible_behaviors is None:
+            if self.stimulus_req_ind is None:
+                feasible_behaviors = list(range(len(self.behaviors)))
+            else:
+                feasible_behaviors = list()
+                for i in key:
+                    for b in self.stimulus_req_ind[i]:
+                        if b not in feasible_behaviors:
+                            feasible_behaviors.append(b)
+            self.feasible_behaviors_cache[key] = feasible_behaviors
+        return feasible_behaviors
+
+    def _exponent(self, internal_intensities, b):
+        '''The exponent of behavior b in the support vector.'''
+        beta, mu, v = self.beta, self.mu, self.v_list
+        exponent = 0
+        for i, intensity in internal_intensities:
+            exponent += beta[i][b] * v[i][b] * intensity + mu[i][b]
+        return exponent
 
     def _support_vector(self, stimulus):
-        behaviors = self.parameters.get(kw.BEHAVIORS)
-        beta = self.parameters.get(kw.BETA)
-        mu = self.parameters.get(kw.MU)
-        return support_vector_static(stimulus, self.stimulus_intensities, behaviors,
-                                     self.stimulus_req, beta, mu, self.v)
+        '''
+        Same as support_vector_static, with ids. stimulus is a list of (element id, intensity)
+        tuples. Returns the support vector and the list of the ids of the feasible behaviors
+        (which must not be modified).
+        '''
+        if self.use_trace:
+            # The internal intensities change in every step, so the exponents are not cached. mu
+            # is added for all elements, also the inactive ones.
+            feasible_behaviors = self._feasible_behaviors(stimulus)
+            beta, v = self.beta, self.v_list
+            exponents = list()
+            for b in feasible_behaviors:
+                exponent = self.mu_sum[b]
+                for i, intensity in self.stimulus_intensities.items():
+                    exponent += beta[i][b] * v[i][b] * intensity
+                exponents.append(exponent)
+        else:
+            feasible_behaviors, exponents = self.exponent_table.get(stimulus)
+        max_exponent = max(exponents)
+        if max_exponent > 500:
+            shifted_exponents = [x - max_exponent for x in exponents]
+            vector = [exp(x) for x in shifted_exponents]
+        else:
+            vector = [exp(x) for x in exponents]
+        return vector, feasible_behaviors
 
     def check_compatibility_with_world(self, world):
         if self.has_v():
@@ -135,6 +294,108 @@ class Mechanism():
         return False
 
 
+class ExponentTable():
+    '''
+    The exponents of the support vector (without trace) of each stimulus that a Mechanism has
+    responded to, in the order of its feasible behaviors. When v[i][b] changes, the exponent of
+    behavior b for the stimuli with element i is marked as stale, and is computed again (in the
+    same way, with the same result) when the stimulus is next used.
+    '''
+
+    def __init__(self, mechanism):
+        self.mechanism = mechanism
+
+        # Keys are tuples of (element id, intensity) tuples, values are tuples (feasible
+        # behaviors, exponents, position of each behavior in feasible behaviors, stale behaviors)
+        self.entries = dict()
+
+        # The entries of the stimuli with each element (keys are element ids)
+        self.element_entries = [list() for _ in mechanism.elements]
+
+    def get(self, stimulus):
+        '''Returns the feasible behaviors and their exponents. stimulus is a list of (element id,
+        intensity) tuples.'''
+        key = tuple(stimulus)
+        entry = self.entries.get(key)
+        if entry is None:
+            feasible_behaviors = self.mechanism._feasible_behaviors(stimulus)
+            exponents = [self.mechanism._exponent(stimulus, b) for b in feasible_behaviors]
+            position = {b: k for k, b in enumerate(feasible_behaviors)}
+            entry = (feasible_behaviors, exponents, position, set())
+            self.entries[key] = entry
+            for i, _ in stimulus:
+                self.element_entries[i].append(entry)
+            return feasible_behaviors, exponents
+
+        feasible_behaviors, exponents, position, stale = entry
+        if stale:
+            for b in stale:
+                exponents[position[b]] = self.mechanism._exponent(stimulus, b)
+            stale.clear()
+        return feasible_behaviors, exponents
+
+    def invalidate(self, i, b):
+        '''Mark the exponents that depend on v[i][b] as stale.'''
+        for _, _, position, stale in self.element_entries[i]:
+            if b in position:
+                stale.add(b)
+
+
+class VectorView(MutableMapping):
+    '''A dict view, keyed by element, of a list indexed by element id.'''
+
+    def __init__(self, values, element_ind):
+        self.values_list = values
+        self.element_ind = element_ind
+
+    def __getitem__(self, element):
+        return self.values_list[self.element_ind[element]]
+
+    def __setitem__(self, element, value):
+        self.values_list[self.element_ind[element]] = value
+
+    def __delitem__(self, element):
+        raise TypeError("Cannot delete from mechanism state.")
+
+    def __iter__(self):
+        return iter(self.element_ind)
+
+    def __len__(self):
+        return len(self.element_ind)
+
+
+class MatrixView(MutableMapping):
+    '''
+    A dict view, keyed by (row key, column key), of a list of lists indexed by [row id][column id].
+    Used for v (keys (element, behavior)) and vss (keys (element, element)). If on_set is not
+    None, it is called with the row id and column id of each set value.
+    '''
+
+    def __init__(self, values, row_ind, col_ind, on_set=None):
+        self.values_list = values
+        self.row_ind = row_ind
+        self.col_ind = col_ind
+        self.on_set = on_set
+
+    def __getitem__(self, key):
+        return self.values_list[self.row_ind[key[0]]][self.col_ind[key[1]]]
+
+    def __setitem__(self, key, value):
+        row, col = self.row_ind[key[0]], self.col_ind[key[1]]
+        self.values_list[row][col] = value
+        if self.on_set is not None:
+            self.on_set(row, col)
+
+    def __delitem__(self, key):
+        raise TypeError("Cannot delete from mechanism state.")
+
+    def __iter__(self):
+        return ((r, c) for r in self.row_ind for c in self.col_ind)
+
+    def __len__(self):
+        return len(self.row_ind) * len(self.col_ind)
+
+
 # This cache doesn't seem to speed things up.
 # feasible_behaviors_cache = dict()
 def get_feasible_behaviors(stimulus, behaviors, stimulus_req):
@@ -176,15 +437,29 @@ def support_vector_static(stimulus, internal_intensities, behaviors, stimulus_re
 # For postprocessing (pplot) only
 def probability_of_response(stimulus, behavior, behaviors,
                             stimulus_req, beta, mu, v):
-    x, feasible_behaviors = support_vector_static(stimulus, None, behaviors,
-                                                  stimulus_req, beta, mu, v)
+    '''
+    The probability of behavior in a number of steps, as a NumPy array. Same computation as
+    support_vector_static, for v a dict with the values of v in the steps, as NumPy arrays.
+    '''
+    feasible_behaviors = get_feasible_behaviors(stimulus, behaviors, stimulus_req)
     if behavior not in feasible_behaviors:
         stimulus = [e for e in stimulus if e != 0]
         csse = ','.join(stimulus)  # Comma-separated stimulus elements
         raise Exception(f"Error in @pplot: Behavior '{behavior}' is not a possible response to '{csse}'.")
+
+    exponents = list()
+    for b in feasible_behaviors:
+        exponent = 0
+        for element, intensity in stimulus.items():
+            key = (element, b)
+            exponent = exponent + (beta[key] * v[key] * intensity + mu[key])
+        exponents.append(exponent)
+    max_exponent = np.max(exponents, axis=0)
+    shift = np.where(max_exponent > 500, max_exponent, 0)
+    x = [np.exp(exponent - shift) for exponent in exponents]
+
     index = feasible_behaviors.index(behavior)
-    p = x[index] / sum(x)
-    return p
+    return x[index] / sum(x)
 
 
 class StimulusResponse(Mechanism):
@@ -192,32 +467,31 @@ class StimulusResponse(Mechanism):
         super().__init__(parameters)
 
     def learn(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
+        u, c, alpha_v, v = self.u, self.c, self.alpha_v, self.v_list
+        r = self.response_ind
 
         usum, vsum = 0, 0
-        for element, intensity in stimulus.items():
-            usum += u[element] * intensity
-        for element, intensity in self.prev_stimulus.items():
-            vsum += self.v[(element, self.response)] * intensity
-        for element, intensity in self.prev_stimulus.items():
-            alpha_v_er = alpha_v[(element, self.response)]
-            self.v[(element, self.response)] += alpha_v_er * (usum - vsum - c[self.response]) * intensity
+        for i, intensity in stimulus:
+            usum += u[i] * intensity
+        for i, intensity in self.prev_stimulus_ids:
+            vsum += v[i][r] * intensity
+        for i, intensity in self.prev_stimulus_ids:
+            alpha_v_er = alpha_v[i][r]
+            v[i][r] += alpha_v_er * (usum - vsum - c[r]) * intensity
 
     def learn_i(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
+        u, c, alpha_v, v = self.u, self.c, self.alpha_v, self.v_list
+        r = self.response_ind
+        self._trace_floats(r)
 
         usum, vsum = 0, 0
-        for element, intensity in stimulus.items():
-            usum += u[element] * intensity
-        for element, intensity in self.prev_stimulus_intensities.items():
-            vsum += self.v[(element, self.response)] * intensity
-        for element, intensity in self.prev_stimulus_intensities.items():
-            alpha_v_er = alpha_v[(element, self.response)]
-            self.v[(element, self.response)] += alpha_v_er * (usum - vsum - c[self.response]) * intensity
+        for i, intensity in stimulus:
+            usum += u[i] * intensity
+        for i, intensity in self.prev_stimulus_intensities.items():
+            vsum += v[i][r] * intensity
+        for i, intensity in self.prev_stimulus_intensities.items():
+            alpha_v_er = alpha_v[i][r]
+            v[i][r] += alpha_v_er * (usum - vsum - c[r]) * intensity
 
 # class SARSA(Mechanism):
 #     def __init__(self, **kwargs):
@@ -241,32 +515,30 @@ class EXP_SARSA(Mechanism):
         super().__init__(parameters)
 
     def learn(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
-        discount = self.parameters.get(kw.DISCOUNT)
+        u, c, alpha_v, v = self.u, self.c, self.alpha_v, self.v_list
+        r = self.response_ind
 
         usum, vsum_prev = 0, 0
-        for element in stimulus:
-            usum += u[element]
-        for element in self.prev_stimulus:
-            vsum_prev += self.v[(element, self.response)]
+        for i, _ in stimulus:
+            usum += u[i]
+        for i, _ in self.prev_stimulus_ids:
+            vsum_prev += v[i][r]
 
         E = 0
-        for element in stimulus:
-            x, feasible_behaviors = self._support_vector({element: 1})
+        for i, _ in stimulus:
+            x, feasible_behaviors = self._support_vector([(i, 1)])
             sum_x = sum(x)
 
             expected_value = 0
             for index, b in enumerate(feasible_behaviors):
                 p = x[index] / sum_x
-                expected_value += p * self.v[(element, b)]
+                expected_value += p * v[i][b]
             E += expected_value
 
-        for element in self.prev_stimulus:
-            alpha_v_er = alpha_v[(element, self.response)]
-            delta = alpha_v_er * (usum + discount * E - c[self.response] - vsum_prev)
-            self.v[(element, self.response)] += delta
+        for i, _ in self.prev_stimulus_ids:
+            alpha_v_er = alpha_v[i][r]
+            delta = alpha_v_er * (usum + self.discount * E - c[r] - vsum_prev)
+            v[i][r] += delta
 
 
 class Qlearning(Mechanism):
@@ -274,33 +546,29 @@ class Qlearning(Mechanism):
         super().__init__(parameters)
 
     def learn(self, stimulus):
-        behaviors = self.parameters.get(kw.BEHAVIORS)
-        # stimulus_req = self.parameters.get(kw.STIMULUS_REQUIREMENTS)
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
-        discount = self.parameters.get(kw.DISCOUNT)
+        u, c, alpha_v, v = self.u, self.c, self.alpha_v, self.v_list
+        r = self.response_ind
 
         usum, vsum_prev = 0, 0
-        for element in stimulus:
-            usum += u[element]
-        for element in self.prev_stimulus:
-            vsum_prev += self.v[(element, self.response)]
+        for i, _ in stimulus:
+            usum += u[i]
+        for i, _ in self.prev_stimulus_ids:
+            vsum_prev += v[i][r]
 
         maxvsum_future = 0
-        for index, element in enumerate(stimulus):
-            feasible_behaviors = get_feasible_behaviors((element,), behaviors, self.stimulus_req)
+        for index, (i, _) in enumerate(stimulus):
+            feasible_behaviors = self._feasible_behaviors([(i, 1)])
             vsum_future = 0
             for b in feasible_behaviors:
-                vsum_future += self.v[(element, b)]
+                vsum_future += v[i][b]
 
             if (index == 0) or (vsum_future > maxvsum_future):
                 maxvsum_future = vsum_future
 
-        for element in self.prev_stimulus:
-            alpha_v_er = alpha_v[(element, self.response)]
-            delta = alpha_v_er * (usum + discount * maxvsum_future - c[self.response] - vsum_prev)
-            self.v[(element, self.response)] += delta
+        for i, _ in self.prev_stimulus_ids:
+            alpha_v_er = alpha_v[i][r]
+            delta = alpha_v_er * (usum + self.discount * maxvsum_future - c[r] - vsum_prev)
+            v[i][r] += delta
 
 
 class ActorCritic(Mechanism):
@@ -308,33 +576,30 @@ class ActorCritic(Mechanism):
         super().__init__(parameters)
 
     def learn(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
-        alpha_w = self.parameters.get(kw.ALPHA_W)
-        beta = self.parameters.get(kw.BETA)
-        discount = self.parameters.get(kw.DISCOUNT)
+        u, c, alpha_v, alpha_w, beta = self.u, self.c, self.alpha_v, self.alpha_w, self.beta
+        v, w = self.v_list, self.w_list
+        r = self.response_ind
 
         vsum_prev, wsum_prev, usum, wsum = 0, 0, 0, 0
-        for element in self.prev_stimulus:
-            vsum_prev += self.v[(element, self.response)]
-            wsum_prev += self.w[element]
-        for element in stimulus:
-            usum += u[element]
-            wsum += self.w[element]
+        for i, _ in self.prev_stimulus_ids:
+            vsum_prev += v[i][r]
+            wsum_prev += w[i]
+        for i, _ in stimulus:
+            usum += u[i]
+            wsum += w[i]
 
         # v
-        delta = usum + discount * wsum - c[self.response] - wsum_prev
-        x, feasible_behaviors = self._support_vector(self.prev_stimulus)
-        p = x[feasible_behaviors.index(self.response)] / sum(x)
-        for element in self.prev_stimulus:
-            alpha_v_er = alpha_v[(element, self.response)]
-            beta_er = beta[(element, self.response)]
-            self.v[(element, self.response)] += alpha_v_er * delta * beta_er * (1 - p)
+        delta = usum + self.discount * wsum - c[r] - wsum_prev
+        x, feasible_behaviors = self._support_vector(self.prev_stimulus_ids)
+        p = x[feasible_behaviors.index(r)] / sum(x)
+        for i, _ in self.prev_stimulus_ids:
+            alpha_v_er = alpha_v[i][r]
+            beta_er = beta[i][r]
+            v[i][r] += alpha_v_er * delta * beta_er * (1 - p)
         # w
-        for element in self.prev_stimulus:
-            alpha_w_e = alpha_w[element]
-            self.w[element] += alpha_w_e * delta
+        for i, _ in self.prev_stimulus_ids:
+            alpha_w_e = alpha_w[i]
+            w[i] += alpha_w_e * delta
 
     def has_w(self):
         return True
@@ -345,69 +610,77 @@ class Enquist(Mechanism):
         super().__init__(parameters)
 
     def learn(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_w = self.parameters.get(kw.ALPHA_W)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
-        discount = self.parameters.get(kw.DISCOUNT)
+        u, c, alpha_v, alpha_w = self.u, self.c, self.alpha_v, self.alpha_w
+        v, w = self.v_list, self.w_list
+        discount = self.discount
+        r = self.response_ind
 
         vsum_prev, wsum_prev, usum, wsum = 0, 0, 0, 0
-        for element in self.prev_stimulus:
-            vsum_prev += self.v[(element, self.response)]
-            wsum_prev += self.w[element]
-        for element in stimulus:
-            usum += u[element]
-            wsum += self.w[element]
+        for i, _ in self.prev_stimulus_ids:
+            vsum_prev += v[i][r]
+            wsum_prev += w[i]
+        for i, _ in stimulus:
+            usum += u[i]
+            wsum += w[i]
         # v
-        for element in self.prev_stimulus:
-            alpha_v_er = alpha_v[(element, self.response)]
-            delta = alpha_v_er * (usum + discount * wsum - c[self.response] - vsum_prev)
-            self.v[(element, self.response)] += delta
+        for i, _ in self.prev_stimulus_ids:
+            alpha_v_er = alpha_v[i][r]
+            delta = alpha_v_er * (usum + discount * wsum - c[r] - vsum_prev)
+            v[i][r] += delta
         # w
-        for element in self.prev_stimulus:
-            delta = alpha_w[element] * (usum + discount * wsum - c[self.response] - wsum_prev)
-            self.w[element] += delta
+        for i, _ in self.prev_stimulus_ids:
+            delta = alpha_w[i] * (usum + discount * wsum - c[r] - wsum_prev)
+            w[i] += delta
 
     def learn_i(self, stimulus):
-        u = self.parameters.get(kw.U)
-        c = self.parameters.get(kw.BEHAVIOR_COST)
-        alpha_w = self.parameters.get(kw.ALPHA_W)
-        alpha_v = self.parameters.get(kw.ALPHA_V)
-        discount = self.parameters.get(kw.DISCOUNT)
+        u, c, alpha_v, alpha_w = self.u, self.c, self.alpha_v, self.alpha_w
+        v, w = self.v_list, self.w_list
+        r = self.response_ind
+        self._trace_floats(r, include_w=True)
 
         usum, wsum = 0, 0
-        for element in stimulus:
-            usum += u[element]
-            wsum += self.w[element]
-        wsum *= discount
+        for i, _ in stimulus:
+            usum += u[i]
+            wsum += w[i]
+        wsum *= self.discount
 
         vsum_i, wsum_i = 0, 0
-        for element, intensity in self.prev_stimulus_intensities.items():
-            vsum_i += self.v[(element, self.response)] * intensity
-            wsum_i += self.w[element] * intensity
+        for i, intensity in self.prev_stimulus_intensities.items():
+            vsum_i += v[i][r] * intensity
+            wsum_i += w[i] * intensity
 
         # v
-        for element, intensity in self.prev_stimulus_intensities.items():
-            alpha_v_er = alpha_v[(element, self.response)]
-            delta = alpha_v_er * (usum + wsum - c[self.response] - vsum_i) * intensity
-            self.v[(element, self.response)] += delta
+        for i, intensity in self.prev_stimulus_intensities.items():
+            alpha_v_er = alpha_v[i][r]
+            delta = alpha_v_er * (usum + wsum - c[r] - vsum_i) * intensity
+            v[i][r] += delta
         # w
-        for element, intensity in self.prev_stimulus_intensities.items():
-            alpha_w_e = alpha_w[element]
-            delta = alpha_w_e * (usum + wsum - c[self.response] - wsum_i) * intensity
-            self.w[element] += delta
+        for i, intensity in self.prev_stimulus_intensities.items():
+            alpha_w_e = alpha_w[i]
+            delta = alpha_w_e * (usum + wsum - c[r] - wsum_i) * intensity
+            w[i] += delta
 
     def has_w(self):
         return True
 
 
 class OriginalRescorlaWagner(Mechanism):
+    '''The state vss is held in a list of lists indexed by [element id][element id].'''
+
     def __init__(self, parameters):
         super().__init__(parameters)
+        self.alpha_vss = self._element_element_list(parameters.get(kw.ALPHA_VSS))
+        self._lambda = self._element_list(parameters.get(kw.LAMBDA))
+
+    def _element_element_list(self, d):
+        if d is None:
+            return None
+        return [[d[(e1, e2)] for e2 in self.elements] for e1 in self.elements]
 
     def subject_reset(self):
         super().subject_reset()
-        self.vss = dict(self.parameters.get(kw.START_VSS))
+        self.vss_list = self._element_element_list(self.parameters.get(kw.START_VSS))
+        self.vss = MatrixView(self.vss_list, self.element_ind, self.element_ind)
 
     def learn_and_respond(self, stimulus, omit=False):
         if self.prev_stimulus is not None:  # and not omit: # Never omit in this mechanism
@@ -419,23 +692,20 @@ class OriginalRescorlaWagner(Mechanism):
         return None  # Dummy response
 
     def learn(self, stimulus):
-        _lambda = self.parameters.get(kw.LAMBDA)
-        alpha_vss = self.parameters.get(kw.ALPHA_VSS)
+        '''stimulus is a dict.'''
+        alpha_vss, vss = self.alpha_vss, self.vss_list
 
         # XXX Handle compound stimuli
         assert(len(self.prev_stimulus) == 1)
         assert(len(stimulus) == 1)
 
-        s1 = list(self.prev_stimulus.keys())[0]
-        s2 = list(stimulus.keys())[0]
-        # ss = (self.prev_stimulus[0], stimulus[0])
-        ss = (s1, s2)
-        self.vss[ss] += alpha_vss[ss] * (_lambda[s2] - self.vss[ss])
+        s1 = self.element_ind[list(self.prev_stimulus.keys())[0]]
+        s2 = self.element_ind[list(stimulus.keys())[0]]
+        vss[s1][s2] += alpha_vss[s1][s2] * (self._lambda[s2] - vss[s1][s2])
 
-        for s in self.parameters.get(kw.STIMULUS_ELEMENTS):
+        for s in range(len(self.elements)):
             if s != s2:
-                key = (s1, s)
-                self.vss[key] += -alpha_vss[key] * self.vss[key]
+                vss[s1][s] += -alpha_vss[s1][s] * vss[s1][s]
 
     def check_compatibility_with_world(self, world):
         err, lineno = super().check_compatibility_with_world(world)
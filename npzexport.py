@@ -0,0 +1,81 @@
+"""
+Exported files in NumPy's .npz format, as written by @export, @vexport, @hexport etc. when the
+filename ends with .npz. The arrays are stored uncompressed, so that load() can memory-map them
+instead of reading them into memory.
+
+An exported v, vss, w, p or n (or post expression) has the arrays
+    labels    The label of each expression, e.g. "v(s->b)"
+    data      data[i, j, k] is the value of expression i for subject j in step (or x-value) k.
+              With subject=all there is one row per subject, otherwise one. Steps after the
+              end of a subject, and points where the evaluation failed, are NaN.
+
+An exported history has the arrays
+    names     The names of the stimuli and behaviors
+    stimulus  stimulus[j, k] is the index in names of the stimulus of subject j in step k
+    response  response[j, k] is the index in names of the response of subject j in step k
+              Steps after the end of a subject are -1.
+"""
+
+import struct
+import zipfile
+
+import numpy as np
+
+
+NPZ_EXTENSION = '.npz'
+
+# Size of the fixed part of a local file header in a zip file, and the offset of the lengths
+# of the file name and extra field in it
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_LOCAL_HEADER_LENGTHS = 26
+
+
+def is_npz(filename):
+    return filename.lower().endswith(NPZ_EXTENSION)
+
+
+def save(filename, **arrays):
+    """Save the arrays uncompressed in the .npz file filename."""
+    # Pass a file, since np.savez appends .npz to a filename that does not end with (lowercase) .npz
+    with open(filename, 'wb') as file:
+        np.savez(file, **arrays)
+
+
+def load(filename, mmap_mode=None):
+    """
+    Load the arrays in the .npz file filename into a dict, keyed by array name. If mmap_mode is
+    not None (see numpy.memmap, e.g. 'r'), the arrays are memory-mapped.
+    """
+    if mmap_mode is None:
+        with np.load(filename) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    out = dict()
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as file:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type == zipfile.ZIP_STORED:
+                offset, shape, fortran_order, dtype = _array_location(file, info)
+                if not dtype.hasobject and len(shape) > 0 and 0 not in shape:
+                    out[name] = np.memmap(filename, dtype=dtype, mode=mmap_mode, shape=shape,
+                                          order='F' if fortran_order else 'C', offset=offset)
+                    continue
+            with zf.open(info) as member:
+                out[name] = np.lib.format.read_array(member)
+    return out
+
+
+def _array_location(file, info):
+    """
+    Return the offset in the .npz file of the data of the stored .npy member info, and the
+    shape, order and dtype of the array.
+    """
+    file.seek(info.header_offset + _ZIP_LOCAL_HEADER_LENGTHS)
+    name_length, extra_length = struct.unpack('<HH', file.read(4))
+    file.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length)
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    return file.tell(), shape, fortran_order, dtype
@@ -1,14 +1,33 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
 import util
 from mechanism import probability_of_response
 from exceptions import EvalException
+from symbols import SymbolTable
 import keywords as kw
 
+# The number of writes that a Val is preallocated for, if not predicted
+VAL_CAPACITY = 64
+
+# The maximum number of evaluated values (over all entries) in an EvalCache
+EVAL_CACHE_SIZE = 5000000
+
+# The parameters that an evaluation (RunOutput.vwpn_eval) depends on, besides the run parameters
+EVAL_PARAMETERS = (kw.EVAL_SUBJECT, kw.EVAL_PHASES, kw.XSCALE, kw.XSCALE_MATCH, kw.MATCH,
+                   kw.EVAL_CUMULATIVE)
+
 
 class ScriptOutput():
     def __init__(self, run_outputs):
         # A dict with RunOutput objects, keys are run-labels
         self.run_outputs = run_outputs
 
+        # The values evaluated by vwpn_eval, shared by all post-processing commands
+        self.eval_cache = EvalCache()
+
     def write_v(self, run_label, subject_ind, stimulus, response, step, mechanism):
         '''stimulus is a dict.'''
         self.run_outputs[run_label].write_v(subject_ind, stimulus, response, step, mechanism)
@@ -22,9 +41,22 @@ class ScriptOutput():
         self.run_outputs[run_label].write_w(subject_ind, stimulus, step, mechanism)
 
     def vwpn_eval(self, vwph, expr, parameters, run_parameters):
+        '''
+        Evaluate (or get from self.eval_cache) vwph for expr. The returned list must not be
+        modified.
+        '''
         # self._evalparse(parameters)
         run_label = parameters.get(kw.RUNLABEL)
-        return self.run_outputs[run_label].vwpn_eval(vwph, expr, parameters, run_parameters)
+        key = [run_label, vwph, expr] + [parameters.get(name) for name in EVAL_PARAMETERS]
+        if vwph == 'p':
+            key += [run_parameters.get(kw.BETA), run_parameters.get(kw.MU)]
+        key = _freeze(key)
+
+        out = self.eval_cache.get(key)
+        if out is None:
+            out = self.run_outputs[run_label].vwpn_eval(vwph, expr, parameters, run_parameters)
+            self.eval_cache.put(key, out)
+        return out
 
     def printout(self):
         for run_label, run_output in self.run_outputs.items():
@@ -105,14 +137,71 @@ class ScriptOutput():
     #     return evalprops
 
 
+class EvalCache():
+    '''
+    Evaluated values (lists, or lists of lists), keyed by hashable evaluation requests. When the
+    number of cached values exceeds max_size, the least recently used entries are evicted. hits
+    and misses count the lookups.
+    '''
+
+    def __init__(self, max_size=EVAL_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''The cached value for key, or None.'''
+        out = self.entries.get(key)
+        if out is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return out
+
+    def put(self, key, value):
+        value_size = _n_values(value)
+        if value_size > self.max_size:
+            return
+        self.entries[key] = value
+        self.size += value_size
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= _n_values(evicted)
+
+
+def _n_values(value):
+    '''The number of values in a list, or in a list of lists.'''
+    if value and type(value[0]) is list:
+        return sum(len(item) for item in value)
+    return len(value)
+
+
+def _freeze(value):
+    '''value, with lists and dicts (recursively) replaced by tuples, to be used as a dict key.'''
+    if type(value) is dict:
+        return (dict, tuple((key, _freeze(item)) for key, item in value.items()))
+    elif type(value) in (list, tuple):
+        return (type(value), tuple(_freeze(item) for item in value))
+    return value
+
+
 class RunOutput():
-    def __init__(self, n_subjects, mechanism_obj):
+    def __init__(self, n_subjects, mechanism_obj, symbols=None, recording=None):
         # A list of RunOutputSubject objects
         self.output_subjects = list()
         self.n_subjects = n_subjects
         self.mechanism_obj = mechanism_obj
-        for _ in range(n_subjects):
-            self.output_subjects.append(RunOutputSubject(mechanism_obj.stimulus_req))
+        for subject_ind in range(n_subjects):
+            subject_recording = None if recording is None else recording.for_subject(subject_ind)
+            self.output_subjects.append(RunOutputSubject(mechanism_obj.stimulus_req, symbols,
+                                                         subject_recording))
+
+    def set_subject(self, subject_ind, output_subject):
+        '''Set the RunOutputSubject object of a subject simulated elsewhere.'''
+        self.output_subjects[subject_ind] = output_subject
 
     def write_v(self, subject_ind, stimulus, response, step, mechanism):
         '''stimulus is a dict.'''
@@ -169,9 +258,17 @@ class RunOutput():
 
 
 class RunOutputSubject():
-    def __init__(self, stimulus_req):
+    def __init__(self, stimulus_req, symbols=None, recording=None):
         self.stimulus_req = stimulus_req
 
+        # The Recording with what to write (None to write everything)
+        self.recording = recording
+
+        # The SymbolTable for the codes in self.history_steps and self.phase_line_label_codes
+        if symbols is None:
+            symbols = SymbolTable()
+        self.symbols = symbols
+
         # Keys are 2-tuples (stimulus_element,response), values are Val objects
         self.v = dict()
 
@@ -181,27 +278,58 @@ class RunOutputSubject():
         # Keys are stimulus elements (strings), values are Val objects
         self.w = dict()
 
-        # History of stimulus and responses [S1,R1,S2,R2,...]
-        self.history = list()
+        # The number of writes to preallocate the Val objects for, keys are (variable, key) as in
+        # ('v', (element, response)). See predict_capacities().
+        self.val_capacities = dict()
+
+        # History of stimulus and responses, as codes in self.symbols
+        self.history_steps = History()
 
         # Tuple where first index is list of phase labels, second is list of step numbers for
         # first step in each phase
         self.first_step_phase = (list(), list())
 
-        # List of phase line labels, used for evaluating when parameter XSCALE is phase line label
-        self.phase_line_labels = list()
+        # List of phase line labels (as codes in self.symbols), used for evaluating when
+        # parameter XSCALE is phase line label
+        self.phase_line_label_codes = list()
 
         # Step numbers for the phase line labels in self.phase_line_labels. Used to keep track of
         # step numbers for help lines
         self.phase_line_labels_steps = list()
 
+        # The PhaseIndex, built when first used (after the simulation)
+        self._phase_index = None
+
+    @property
+    def history_codes(self):
+        """History of stimulus and responses [S1,R1,S2,R2,...], as codes in self.symbols."""
+        return self.history_steps.codes().tolist()
+
+    @property
+    def history(self):
+        """History of stimulus and responses [S1,R1,S2,R2,...], with names."""
+        return self.symbols.decode(self.history_codes)
+
+    @property
+    def phase_index(self):
+        """The PhaseIndex of the (simulated) subject."""
+        if self._phase_index is None:
+            self._phase_index = PhaseIndex(self)
+        return self._phase_index
+
+    @property
+    def phase_line_labels(self):
+        """The phase line labels in self.phase_line_label_codes, with names."""
+        return self.symbols.decode(self.phase_line_label_codes)
+
+    def records(self, variable):
+        '''Whether any key of the variable ('v', 'vss' or 'w') is written.'''
+        return self.recording is None or self.recording.records_any(variable)
+
     def write_history(self, stimulus, response):
-        stimulus_tuple = tuple([e for e in stimulus if stimulus[e] != 0])
-        if len(stimulus_tuple) == 1:
-            self.history.append(stimulus_tuple[0])
-        else:
-            self.history.append(stimulus_tuple)
-        self.history.append(response)
+        if self.recording is not None and not self.recording.history:
+            return
+        self.history_steps.write(self.symbols.stimulus_code(stimulus), self.symbols.code(response))
 
     def write_step(self, phase_label, step):
         if phase_label not in self.first_step_phase[0]:
@@ -209,23 +337,35 @@ class RunOutputSubject():
             self.first_step_phase[1].append(step)
 
     def write_phase_line_label(self, phase_line_label, step, preceeding_help_lines):
+        if self.recording is not None and not self.recording.history:
+            return
+        code = self.symbols.code
         if preceeding_help_lines:
             for line_label in preceeding_help_lines:
-                self.phase_line_labels.append(line_label)
+                self.phase_line_label_codes.append(code(line_label))
                 self.phase_line_labels_steps.append(step)
-        self.phase_line_labels.append(phase_line_label)
+        self.phase_line_label_codes.append(code(phase_line_label))
         self.phase_line_labels_steps.append(step)
 
+    def predict_capacities(self, output_subject):
+        '''
+        Preallocate the Val objects for as many writes as in the RunOutputSubject output_subject
+        (typically the previous subject).
+        '''
+        for variable in ('v', 'vss', 'w'):
+            for key, val in getattr(output_subject, variable).items():
+                self.val_capacities[(variable, key)] = len(val)
+        if len(self.history_steps) == 0:
+            self.history_steps = History(len(output_subject.history_steps))
+
     def write_v(self, stimulus, response, step, mechanism):
-        '''stimulus is a dict.'''
-        if mechanism.use_trace:
-            stimulus_elements = mechanism.parameters.get(kw.STIMULUS_ELEMENTS)
-        else:
-            stimulus_elements = stimulus
-        for element in stimulus_elements:
+        '''stimulus is a dict (or a list of stimulus elements).'''
+        for element in stimulus:
             key = (element, response)
             if key not in self.v:
-                self.v[key] = Val()
+                if self.recording is not None and not self.recording.records('v', key):
+                    continue
+                self.v[key] = Val(self.val_capacities.get(('v', key)))
             self.v[key].write(mechanism.v[key], step)
 
     def write_vss(self, stimulus1, stimulus2, step, mechanism):
@@ -235,7 +375,9 @@ class RunOutputSubject():
 
         key = (list(stimulus1.keys())[0], list(stimulus2.keys())[0])
         if key not in self.vss:
-            self.vss[key] = Val()
+            if self.recording is not None and not self.recording.records('vss', key):
+                return
+            self.vss[key] = Val(self.val_capacities.get(('vss', key)))
 
         self.vss[key].write(mechanism.vss[key], step)
 
@@ -243,13 +385,15 @@ class RunOutputSubject():
         for element in stimulus:
             key = element
             if key not in self.w:
-                self.w[key] = Val()
+                if self.recording is not None and not self.recording.records('w', key):
+                    continue
+                self.w[key] = Val(self.val_capacities.get(('w', key)))
             self.w[key].write(mechanism.w[key], step)
 
     def vwpn_eval(self, vwpn, expr, parameters, run_parameters):
         if vwpn == 'n':
             _, history, phase_line_labels, _ = self._phasefilter(None, parameters)
-            return RunOutputSubject.n_eval(expr, history, phase_line_labels, parameters)
+            return RunOutputSubject.n_eval(expr, history, phase_line_labels, parameters, self.symbols)
         else:
             if vwpn == 'p':
                 # expr is a tuple ({'e1':i1, 'e2':i2, ...}, behavior)
@@ -265,93 +409,81 @@ class RunOutputSubject():
                 fun = switcher[vwpn]
                 funout = fun(expr)
             funout, history, phase_line_labels, phase_line_labels_steps = self._phasefilter(funout, parameters)
-            return self._xscalefilter(funout, history, phase_line_labels, phase_line_labels_steps, parameters)
+            funout = self._xscalefilter(funout, history, phase_line_labels, phase_line_labels_steps, parameters)
+            if type(funout) is RunLengthSeries:
+                funout = funout.tolist()
+            return funout
 
     def _phasefilter(self, evalout, parameters):
         """
-        Filter evalout (output from {v,w,p}-eval) as well as self.history,
-        self.phase_line_labels and self.phase_line_labels_steps w.r.t. the parameter
-        'phases'.
+        Filter evalout (output from {v,w,p}-eval) as well as self.history_codes,
+        self.phase_line_label_codes and self.phase_line_labels_steps w.r.t. the parameter
+        'phases'. evalout is a list or a RunLengthSeries (which is filtered without expanding it).
         """
         plot_phases = parameters.get(kw.EVAL_PHASES)
         if plot_phases == kw.EVAL_ALL:
-            return evalout, self.history, self.phase_line_labels, self.phase_line_labels_steps
+            return evalout, self.history_steps.codes(), self.phase_line_label_codes, self.phase_line_labels_steps
 
-        # List of phases in the order they were run (don't include "last")
-        run_phases = self.first_step_phase[0][0:-1]
+        phase_index = self.phase_index
+        run_phases = phase_index.run_phases
         assert(len(run_phases) > 0)
 
         if plot_phases == run_phases:
-            return evalout, self.history, self.phase_line_labels, self.phase_line_labels_steps
+            return evalout, self.history_steps.codes(), self.phase_line_label_codes, self.phase_line_labels_steps
 
-        out = list()
-        history_out = list()
-        phase_line_labels_out = list()
-        phase_line_labels_steps_out = list()
         if type(plot_phases) is not list:
             plot_phases = (plot_phases,)
         for phase in plot_phases:
             if phase not in run_phases:
                 raise EvalException(f"Invalid phase label {phase}. Must be in {run_phases}.")
 
+        out_pieces = list()  # Slices of evalout
+        history_out = list()  # Arrays of codes
+        phase_line_labels_out = list()
+        phase_line_labels_steps_out = list()
+
         wrote_inital_value = False
         if evalout is not None:
             if plot_phases[0] == run_phases[0]:
                 # First value (out[0]) should be inital value (evalout[0]) if the first phase
                 # in 'phases' is the first run-phase.
-                out.append(evalout[0])
+                out_pieces.append(evalout[0:1])
                 wrote_inital_value = True
             else:
                 # First value (out[0]) should be last value of previous phase if the first
                 # phase in 'phases' is NOT the first run-phase.
-                first_plot_phase_index = run_phases.index(plot_phases[0])
-                first_plot_phase_startind = self.first_step_phase[1][first_plot_phase_index]
-                first_value_previous_phase = evalout[first_plot_phase_startind - 1]
-                out.append(first_value_previous_phase)
+                first_plot_phase_startind, _ = phase_index.step_ranges[plot_phases[0]]
+                out_pieces.append(evalout[first_plot_phase_startind:first_plot_phase_startind + 1])
 
         cnt = 1
         for phase in plot_phases:
-            fsp_index = run_phases.index(phase)
-            phase_startind = self.first_step_phase[1][fsp_index]
-            nextphase_startind = self.first_step_phase[1][fsp_index + 1]
-            phase_endind = nextphase_startind - 1
-            for j in range(phase_startind - 1, phase_endind):  # phase_startind is one-based
-                history_out.append(self.history[2 * j])
-                history_out.append(self.history[2 * j + 1])
+            startind, endind = phase_index.step_ranges[phase]
+            history_out.append(self.history_steps.codes(startind, endind))
 
             if evalout is not None:
-                for j in range(phase_startind - 1, phase_endind):
-                    if j == 0 and wrote_inital_value:
-                        pass
-                    else:
-                        out.append(evalout[j])
-
-            # Index to first occurence of phase_startind in self.phase_line_labels_steps
-            plls_startind = None
-            # Index to last occurence of phase_endind in self.phase_line_labels_steps
-            plls_endind = None
-            for j in range(phase_startind - 1, len(self.phase_line_labels_steps)):
-                plls_j = self.phase_line_labels_steps[j]
-                if plls_j == phase_startind:
-                    if plls_startind is None:  # We want the first index to phase_startind
-                        plls_startind = j
-                elif plls_j == phase_endind:
-                    plls_endind = j  # We want the last index to phase_endind-1
-                elif plls_j > phase_endind:
-                    break  # We need look no further
-            assert(plls_startind is not None)
-            assert(plls_endind is not None)
-
-            prev_plls = None
-            for j in range(plls_startind, plls_endind + 1):
-                curr_plls = self.phase_line_labels_steps[j]
-                phase_line_labels_out.append(self.phase_line_labels[j])
-                phase_line_labels_steps_out.append(cnt)
-                if prev_plls != curr_plls:
-                    cnt += 1
-                prev_plls = curr_plls
-
-        return out, history_out, phase_line_labels_out, phase_line_labels_steps_out
+                if startind == 0 and wrote_inital_value:
+                    out_pieces.append(evalout[1:endind])
+                else:
+                    out_pieces.append(evalout[startind:endind])
+
+            # The phase line labels are numbered from cnt, increasing after the first label and
+            # after each label with a new step
+            label_startind, label_endind = phase_index.label_ranges[phase]
+            assert(label_endind > label_startind)
+            label_steps = phase_index.phase_line_labels_steps[label_startind:label_endind]
+            increments = np.ones(len(label_steps), dtype=np.int64)
+            increments[1:] = (np.diff(label_steps) != 0)
+            label_cnts = np.cumsum(increments)
+            phase_line_labels_out.append(phase_index.phase_line_label_codes[label_startind:label_endind])
+            phase_line_labels_steps_out.append(cnt + label_cnts - increments)
+            cnt += int(label_cnts[-1])
+
+        if type(evalout) is RunLengthSeries:
+            out = RunLengthSeries.concatenate(out_pieces)
+        else:
+            out = [value for piece in out_pieces for value in piece]
+        return (out, np.concatenate(history_out), np.concatenate(phase_line_labels_out),
+                np.concatenate(phase_line_labels_steps_out))
 
     def _xscalefilter(self, evalout, history, phase_line_labels, phase_line_labels_steps,
                       parameters):
@@ -359,27 +491,45 @@ class RunOutputSubject():
         if xscale == kw.EVAL_ALL:
             return evalout
         else:
-            if xscale in phase_line_labels:  # xscale is a phase line label
-                findind, _ = util.find_and_cumsum(phase_line_labels, xscale, True)
-                out = [evalout[0]]  # evalout[0] must be kept
+            if self._is_phase_line_label(xscale, phase_line_labels, self.symbols):
+                match_sets = self.symbols.match_sets(xscale, True)
+                findind, _ = util.find_and_cumsum_codes(phase_line_labels, match_sets)
+                out_inds = [0]  # evalout[0] must be kept
                 for pll_ind, zero_or_one in enumerate(findind):
                     # pll_ind >= 1 because the first update is done after S->B->S'
                     if zero_or_one == 1 and pll_ind >= 1:  # 1 because pll_ind is index to phase_line_labels that contains only phase line labels
                         evalout_ind = phase_line_labels_steps[pll_ind] - 1  # Zero-based index
-                        out.append(evalout[evalout_ind])
-                return out
+                        out_inds.append(evalout_ind)
+                return RunOutputSubject._take(evalout, out_inds)
             else:
                 pattern = xscale
                 pattern_len = RunOutputSubject.compute_patternlen(pattern)
                 use_exact_match = (parameters.get(kw.XSCALE_MATCH) == 'exact')
-                findind, _ = util.find_and_cumsum(history, pattern, use_exact_match)
-                out = [evalout[0]]  # evalout[0] must be kept
+                match_sets = self.symbols.match_sets(pattern, use_exact_match)
+                findind, _ = util.find_and_cumsum_codes(history, match_sets)
+                out_inds = [0]  # evalout[0] must be kept
                 for history_ind, zero_or_one in enumerate(findind):
                     # history_ind >= 2 because the first update is done after S->B->S'
                     if zero_or_one == 1 and history_ind >= 2:  # 2 because history_ind is index to history that contains S,B,S,B,S,B,...
                         evalout_ind = RunOutputSubject.historyind2stepind(history_ind, pattern_len)
-                        out.append(evalout[evalout_ind])
-                return out
+                        out_inds.append(evalout_ind)
+                return RunOutputSubject._take(evalout, out_inds)
+
+    @staticmethod
+    def _take(evalout, inds):
+        """The list of the values in evalout (a list or a RunLengthSeries) at the indices inds."""
+        if type(evalout) is RunLengthSeries:
+            return evalout.take(inds)
+        else:
+            return [evalout[ind] for ind in inds]
+
+    @staticmethod
+    def _is_phase_line_label(xscale, phase_line_label_codes, symbols):
+        """Return True if xscale is one of the phase line labels in phase_line_label_codes."""
+        if type(xscale) is list:
+            return False
+        code = symbols.codes.get(xscale)
+        return (code is not None) and (code in phase_line_label_codes)
 
     @staticmethod
     def historyind2stepind(history_ind, pattern_len):
@@ -394,6 +544,9 @@ class RunOutputSubject():
             pattern_len = 1
         return pattern_len
 
+    # The values are returned as a RunLengthSeries, which vwpn_eval returns as a list of Python
+    # floats, which the post-processing arithmetic expects (for example, division by zero raises
+    # an exception)
     def v_eval(self, er):
         return self.v[er].evaluate()
 
@@ -413,26 +566,27 @@ class RunOutputSubject():
             if er[0] in nonzero_intensity_stimulus:
                 v_val[er] = self.v[er]
 
+        if not v_val:
+            return []
+
         behaviors = list()
-        nval = 0
         for er in v_val:
-            v_val[er] = self.v_eval(er)
-            if nval == 0:
-                nval = len(v_val[er])
             behavior = er[1]
             if behavior not in behaviors:
                 behaviors.append(behavior)
 
-        out = [None] * nval
-        for i in range(nval):
-            v_local = util.dict_of_list_ind(v_val, i)
-            out[i] = probability_of_response(nonzero_intensity_stimulus, response, behaviors,
-                                             self.stimulus_req, run_parameters.get(kw.BETA),
-                                             run_parameters.get(kw.MU), v_local)
-        return out
+        # The probability is computed (for all steps at once) at the steps where some of the v
+        # changes, and is constant in between
+        v_series = [self.v_eval(er) for er in v_val]
+        starts, v_values = RunLengthSeries.align(v_series)
+        p = probability_of_response(nonzero_intensity_stimulus, response, behaviors,
+                                    self.stimulus_req, run_parameters.get(kw.BETA),
+                                    run_parameters.get(kw.MU), dict(zip(v_val, v_values)))
+        return RunLengthSeries(p, starts, len(v_series[0]))
 
     @staticmethod
-    def n_eval(seq, history, phase_line_labels, parameters):
+    def n_eval(seq, history, phase_line_labels, parameters, symbols):
+        """history and phase_line_labels are lists of codes in the SymbolTable symbols."""
         is_exact = (parameters.get(kw.MATCH) == kw.EVAL_EXACT)
         is_cumulative = (parameters.get(kw.EVAL_CUMULATIVE) == kw.EVAL_ON)
         xscale = parameters.get(kw.XSCALE)
@@ -441,17 +595,20 @@ class RunOutputSubject():
         out = None
         # prepend_zero = (xscale == kw.EVAL_ALL)
         if (xscale == kw.EVAL_ALL):
+            match_sets = symbols.match_sets(seq, is_exact)
             if is_cumulative:
-                _, out = util.find_and_cumsum(history, seq, is_exact)
+                _, out = util.find_and_cumsum_codes(history, match_sets)
             else:
-                out, _ = util.find_and_cumsum(history, seq, is_exact)
+                out, _ = util.find_and_cumsum_codes(history, match_sets)
         else:
-            if xscale in phase_line_labels:  # xscale is a phase line label
+            if RunOutputSubject._is_phase_line_label(xscale, phase_line_labels, symbols):
                 raise Exception("xscale cannot be a phase line label in @nplot/@nexport.")
+            match_sets = symbols.match_sets(seq, is_exact)
+            interval_match_sets = symbols.match_sets(xscale, xscale_exact)
             if is_cumulative:
-                _, out = util.find_and_cumsum_interval(history, seq, is_exact, xscale, xscale_exact)
+                _, out = util.find_and_cumsum_interval_codes(history, match_sets, interval_match_sets)
             else:
-                out, _ = util.find_and_cumsum_interval(history, seq, is_exact, xscale, xscale_exact)
+                out, _ = util.find_and_cumsum_interval_codes(history, match_sets, interval_match_sets)
         # if is_cumulative:
         #     out = [0] + out
         return out
@@ -473,38 +630,368 @@ class RunOutputSubject():
         print(f"phase_line_labels_steps={self.phase_line_labels_steps}")
 
 
-class Val():
+class PhaseIndex():
+    '''
+    The steps and the phase line labels of each phase of a simulated subject (a RunOutputSubject),
+    so that filtering w.r.t. the parameter 'phases' is done by slicing. step_ranges and
+    label_ranges have the phase labels as keys and (start, stop) index ranges as values, into
+    the steps (as in the history) and the phase line labels, respectively.
+    '''
+
+    def __init__(self, output_subject):
+        phase_labels, first_steps = output_subject.first_step_phase
+
+        # List of phases in the order they were run (don't include "last")
+        self.run_phases = phase_labels[0:-1]
+
+        self.phase_line_label_codes = np.array(output_subject.phase_line_label_codes, dtype=np.int64)
+        self.phase_line_labels_steps = np.array(output_subject.phase_line_labels_steps, dtype=np.int64)
+
+        self.step_ranges = dict()
+        self.label_ranges = dict()
+        for i, phase in enumerate(self.run_phases):
+            # One-based steps
+            phase_startind = first_steps[i]
+            phase_endind = first_steps[i + 1] - 1
+            self.step_ranges[phase] = (phase_startind - 1, phase_endind)
+
+            # From the first phase line label at phase_startind to the last one at phase_endind
+            label_startind = np.searchsorted(self.phase_line_labels_steps, phase_startind, side='left')
+            label_endind = np.searchsorted(self.phase_line_labels_steps, phase_endind, side='right')
+            self.label_ranges[phase] = (int(label_startind), int(label_endind))
+
+
+class History():
+    '''
+    The history of stimuli and responses of a subject: the codes (in a SymbolTable) of the
+    stimulus and of the response in each step, held in two preallocated NumPy arrays (uint16, or
+    int32 for codes that do not fit) which double in size when full. capacity is the number of
+    steps to preallocate for.
+    '''
+
+    def __init__(self, capacity=None):
+        if capacity is None:
+            capacity = VAL_CAPACITY
+        capacity = max(capacity, 1)
+        self._stimulus_codes = np.empty(capacity, dtype=np.uint16)
+        self._response_codes = np.empty(capacity, dtype=np.uint16)
+        self._max_code = np.iinfo(np.uint16).max
+        self.length = 0
+
+    def write(self, stimulus_code, response_code):
+        n = self.length
+        if n == len(self._stimulus_codes):
+            self._stimulus_codes = np.concatenate((self._stimulus_codes, np.empty_like(self._stimulus_codes)))
+            self._response_codes = np.concatenate((self._response_codes, np.empty_like(self._response_codes)))
+        if stimulus_code > self._max_code or response_code > self._max_code:
+            self._stimulus_codes = self._stimulus_codes.astype(np.int32)
+            self._response_codes = self._response_codes.astype(np.int32)
+            self._max_code = np.iinfo(np.int32).max
+        self._stimulus_codes[n] = stimulus_code
+        self._response_codes[n] = response_code
+        self.length = n + 1
+
+    @property
+    def stimulus_codes(self):
+        '''The stimulus codes in each step, as a NumPy array.'''
+        return self._stimulus_codes[:self.length]
+
+    @property
+    def response_codes(self):
+        '''The response codes in each step, as a NumPy array.'''
+        return self._response_codes[:self.length]
+
+    def codes(self, start=0, stop=None):
+        '''The codes [S1,R1,S2,R2,...] in the steps with indices start to stop-1, as a NumPy array.'''
+        if stop is None:
+            stop = self.length
+        stop = max(min(stop, self.length), start)
+        out = np.empty(2 * (stop - start), dtype=self._stimulus_codes.dtype)
+        out[0::2] = self._stimulus_codes[start:stop]
+        out[1::2] = self._response_codes[start:stop]
+        return out
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def from_codes(stimulus_codes, response_codes):
+        '''A History with the specified stimulus and response codes (NumPy arrays) in each step.'''
+        history = History(len(stimulus_codes))
+        if len(stimulus_codes) > 0 and max(stimulus_codes.max(), response_codes.max()) > history._max_code:
+            history._max_code = np.iinfo(np.int32).max
+            history._stimulus_codes = history._stimulus_codes.astype(np.int32)
+            history._response_codes = history._response_codes.astype(np.int32)
+        history._stimulus_codes[:len(stimulus_codes)] = stimulus_codes
+        history._response_codes[:len(response_codes)] = response_codes
+        history.length = len(stimulus_codes)
+        return history
+
+    def __getstate__(self):
+        # Do not pickle the unused capacity (but keep room for one step)
+        state = dict(self.__dict__)
+        capacity = max(self.length, 1)
+        state['_stimulus_codes'] = self._stimulus_codes[:capacity].copy()
+        state['_response_codes'] = self._response_codes[:capacity].copy()
+        return state
+
+
+class Recording():
+    '''
+    What to write to the RunOutputSubject objects of a run, as needed by the post-processing
+    commands. v, vss and w are sets of keys (as in RunOutputSubject.v, vss and w), v_elements is
+    a set of stimulus elements for which v is written for all behaviors (as needed by p),
+    subjects is a set of subject indices for which the variables are written (None for all
+    subjects), and history is whether the history and the phase line labels are written.
+    '''
+
     def __init__(self):
-        # List of float values
-        self.values = list()
+        self.v = set()
+        self.v_elements = set()
+        self.vss = set()
+        self.w = set()
+        self.subjects = set()
+        self.history = False
+
+    def add(self, vwpn, expr, parameters):
+        '''
+        Add what is needed to evaluate vwpn ('v', 'vss', 'w', 'p', 'n', or 'h' for the history)
+        for the expression expr with the evaluation parameters parameters.
+        '''
+        if vwpn == 'v':
+            self.v.add(expr)
+        elif vwpn == 'vss':
+            self.vss.add(expr)
+        elif vwpn == 'w':
+            self.w.add(expr)
+        elif vwpn == 'p':
+            # expr is a tuple ({'e1':i1, 'e2':i2, ...}, behavior)
+            self.v_elements.update(e for e, i in expr[0].items() if i != 0)
+        else:
+            self.history = True
 
-        self.steps = list()
+        # The history is used to filter the evaluated values w.r.t. the phases and xscale
+        if (parameters.get(kw.EVAL_PHASES) != kw.EVAL_ALL) or (parameters.get(kw.XSCALE) != kw.EVAL_ALL):
+            self.history = True
 
-        # Phase labels
-        # self.phase_labels = list()
+        subject_ind = parameters.get(kw.EVAL_SUBJECT)
+        if subject_ind in (kw.EVAL_AVERAGE, kw.EVAL_ALL):
+            self.subjects = None
+        elif self.subjects is not None:
+            self.subjects.add(subject_ind)
+
+    def records(self, variable, key):
+        '''Whether the key of the variable ('v', 'vss' or 'w') is written.'''
+        if variable == 'v':
+            return (key in self.v) or (key[0] in self.v_elements)
+        return key in getattr(self, variable)
+
+    def records_any(self, variable):
+        '''Whether any key of the variable ('v', 'vss' or 'w') is written.'''
+        if variable == 'v':
+            return bool(self.v) or bool(self.v_elements)
+        return bool(getattr(self, variable))
+
+    def for_subject(self, subject_ind):
+        '''The Recording for the subject with index subject_ind.'''
+        if self.subjects is None or subject_ind in self.subjects:
+            return self
+        out = Recording()
+        out.history = self.history
+        return out
+
+
+class Val():
+    '''
+    The values of a variable written in some of the steps. The values and the steps are held in
+    preallocated NumPy arrays (float64 or float32 values, int32 steps), which double in size when
+    full. capacity is the number of writes to preallocate for.
+
+    Which of the written values were Python ints (such as an integer start_v that has not been
+    updated) is kept in a boolean array, allocated at the first int, so that they are returned
+    (and exported) as ints.
+    '''
+
+    def __init__(self, capacity=None, dtype=np.float64):
+        if capacity is None:
+            capacity = VAL_CAPACITY
+        capacity = max(capacity, 1)
+        self._values = np.empty(capacity, dtype=dtype)
+        self._steps = np.empty(capacity, dtype=np.int32)
+        self._is_int = None
+        self.length = 0
 
     def write(self, value, step):
-        self.values.append(value)
-        self.steps.append(step)
-        # self.phase_labels.append(phase_label)
+        n = self.length
+        if n == len(self._values):
+            self._values = np.concatenate((self._values, np.empty_like(self._values)))
+            self._steps = np.concatenate((self._steps, np.empty_like(self._steps)))
+            if self._is_int is not None:
+                self._is_int = np.concatenate((self._is_int, np.zeros_like(self._is_int)))
+        self._values[n] = value
+        self._steps[n] = step
+        if type(value) is int:
+            if self._is_int is None:
+                self._is_int = np.zeros(len(self._values), dtype=bool)
+            self._is_int[n] = True
+        self.length = n + 1
+
+    @property
+    def values(self):
+        '''The written values, as a list.'''
+        return _tolist(self._values[:self.length], self._used_is_int())
+
+    def _used_is_int(self):
+        '''self._is_int of the written values, or None if none of them is an int.'''
+        if self._is_int is None:
+            return None
+        return self._is_int[:self.length]
+
+    @property
+    def steps(self):
+        '''The steps of the written values, as a list.'''
+        return self._steps[:self.length].tolist()
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def from_arrays(values, steps):
+        '''A Val with the specified written values and steps (NumPy arrays).'''
+        val = Val(len(values))
+        val._values[:len(values)] = values
+        val._steps[:len(steps)] = steps
+        val.length = len(values)
+        return val
+
+    def __getstate__(self):
+        # Do not pickle the unused capacity
+        state = dict(self.__dict__)
+        state['_values'] = self._values[:self.length].copy()
+        state['_steps'] = self._steps[:self.length].copy()
+        if self._is_int is not None:
+            state['_is_int'] = self._is_int[:self.length].copy()
+        return state
 
     def evaluate(self):
-        '''Assumes that self.steps is increasing and that self.steps[0]=0.'''
-        max_step = self.steps[-1]
-        outlen = max_step + 1
-        out = [None] * outlen
-
-        nchunks = len(self.steps) - 1
-        for chunkind in range(nchunks):
-            startind = self.steps[chunkind]
-            stopind = self.steps[chunkind + 1]
-            v = self.values[chunkind]
-            for i in range(startind, stopind):
-                out[i] = v
-            out[max_step] = self.values[nchunks]  # Last point
-        return out
+        '''
+        The value in each step, as a RunLengthSeries. Assumes that self.steps is increasing and
+        that self.steps[0]=0.
+        '''
+        values = self._values[:self.length]
+        steps = self._steps[:self.length]
+
+        # The value written last in a step is used from that step until the next written step,
+        # and the last value in the last step
+        is_used = (np.diff(steps) > 0)
+        run_values = np.append(values[:-1][is_used], values[-1])
+        run_starts = np.append(steps[:-1][is_used], steps[-1])
+        is_int = self._used_is_int()
+        if is_int is not None:
+            is_int = np.append(is_int[:-1][is_used], is_int[-1])
+        return RunLengthSeries(run_values, run_starts, int(steps[-1]) + 1, is_int)
 
 
     def printout(self):
         print(f"values: {self.values}")
         print(f"steps: {self.steps}")
+
+
+class RunLengthSeries():
+    '''
+    A series of values, run-length encoded: values[k] (a NumPy array) is the value at the indices
+    from starts[k] (an increasing NumPy array, with starts[0]=0) to the next start (or to length).
+    Indexing with an integer and slicing is done on the encoded form. expand() and tolist()
+    return the full series. is_int[k] (a boolean NumPy array, or None if all are floats) is True
+    if values[k] was written as an int, in which case it is returned as an int (except by expand()
+    and align(), which are for array arithmetic).
+    '''
+
+    def __init__(self, values, starts, length, is_int=None):
+        self.values = values
+        self.starts = starts
+        self.length = length
+        self.is_int = is_int
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return self.tolist()[index]
+            return self._slice(start, stop)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("RunLengthSeries index out of range")
+        run = bisect_right(self.starts, index) - 1
+        if self.is_int is not None and self.is_int[run]:
+            return int(self.values[run])
+        return self.values[run].item()
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def _slice(self, start, stop):
+        if stop <= start:
+            return RunLengthSeries(self.values[:0], self.starts[:0], 0)
+        first = bisect_right(self.starts, start) - 1
+        last = bisect_right(self.starts, stop - 1)
+        starts = self.starts[first:last] - start
+        starts[0] = 0
+        is_int = None if self.is_int is None else self.is_int[first:last]
+        return RunLengthSeries(self.values[first:last], starts, stop - start, is_int)
+
+    def take(self, indices):
+        '''The list of the values at the specified indices.'''
+        runs = np.searchsorted(self.starts, indices, side='right') - 1
+        return _tolist(self.values[runs], None if self.is_int is None else self.is_int[runs])
+
+    @staticmethod
+    def align(series_list):
+        '''
+        For RunLengthSeries objects of equal length, return the starts of the runs where any of
+        them changes value (a NumPy array), and the list of the values of each series in these
+        runs (NumPy arrays).
+        '''
+        starts = np.unique(np.concatenate([series.starts for series in series_list]))
+        values = [series.values[np.searchsorted(series.starts, starts, side='right') - 1]
+                  for series in series_list]
+        return starts, values
+
+    @staticmethod
+    def concatenate(series_list):
+        '''Concatenate the specified RunLengthSeries objects.'''
+        series_list = [series for series in series_list if series.length > 0]
+        if not series_list:
+            return RunLengthSeries(np.empty(0), np.empty(0, dtype=np.int64), 0)
+        offsets = np.cumsum([0] + [series.length for series in series_list[:-1]])
+        values = np.concatenate([series.values for series in series_list])
+        starts = np.concatenate([series.starts + offset for series, offset in zip(series_list, offsets)])
+        is_int = None
+        if any(series.is_int is not None for series in series_list):
+            is_int = np.concatenate([np.zeros(len(series.values), dtype=bool) if series.is_int is None
+                                     else series.is_int for series in series_list])
+        return RunLengthSeries(values, starts, int(offsets[-1]) + series_list[-1].length, is_int)
+
+    def expand(self):
+        '''The full series, as a NumPy array.'''
+        return np.repeat(self.values, np.diff(np.append(self.starts, self.length)))
+
+    def tolist(self):
+        '''The full series, as a list of Python floats (and ints, see is_int).'''
+        if self.is_int is None:
+            return self.expand().tolist()
+        counts = np.diff(np.append(self.starts, self.length))
+        return _tolist(np.repeat(self.values, counts), np.repeat(self.is_int, counts))
+
+
+def _tolist(values, is_int):
+    '''The NumPy array values as a list, with ints where is_int (a boolean array, or None) is True.'''
+    if is_int is None or not is_int.any():
+        return values.tolist()
+    out = values.astype(object)
+    out[is_int] = values[is_int].astype(np.int64).tolist()
+    return out.tolist()
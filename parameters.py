@@ -1,5 +1,4 @@
 import os
-import random
 
 import keywords as kw
 import mechanism_names as mn
@@ -36,6 +35,8 @@ PD = {kw.BEHAVIORS: list(),              # list of (restricted) strings
       kw.CUMULATIVE: 'on',               # on or off
       kw.MATCH: 'subset',                # subset or exact
       kw.RANDOM_SEED: None,              # Any number
+      kw.JOBS: 1,                        # Positive integer
+      kw.ENGINE: 'reference',            # reference or vectorized
       kw.FILENAME: ''}                   # valid path                                     REQ
 
 
@@ -123,13 +124,21 @@ class Parameters():
             return None
 
         # Positive integer
-        elif prop == kw.N_SUBJECTS:
+        elif prop in (kw.N_SUBJECTS, kw.JOBS):
             v, err = ParseUtil.parse_posint(v_str, variables)
             if err:
                 return err
             if not v:
-                return "Parameter {} must be a positive integer.".format(kw.N_SUBJECTS)
-            self.val[kw.N_SUBJECTS] = v
+                return "Parameter {} must be a positive integer.".format(prop)
+            self.val[prop] = v
+            return None
+
+        # 'reference' or 'vectorized'
+        elif prop == kw.ENGINE:
+            v_str_lower = v_str.lower()
+            if v_str_lower not in ('reference', 'vectorized'):
+                return "Parameter {} must be 'reference' or 'vectorized'.".format(prop)
+            self.val[prop] = v_str_lower
             return None
 
         # Any nonempty (after strip) string
@@ -174,7 +183,6 @@ class Parameters():
             if self.val[kw.RANDOM_SEED] is not None:
                 return "Can only set random_seed once."
             self.val[kw.RANDOM_SEED] = v_str  # Can be anything, really
-            random.seed(v_str)
             return None
 
     def set_filename(self, filename):
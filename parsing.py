@@ -16,11 +16,15 @@ import csv
 import json
 import math
 
+import numpy as np
+
 import posteval
+import npzexport
 import keywords as kw
 from parameters import Parameters
 from parameters import is_parameter_name
 from simulation import Runs, Run
+from output import Recording
 from variables import Variables
 from phases import Phases
 from exceptions import ParseException, InterruptedSimulation, EvalException
@@ -33,6 +37,10 @@ POST_MATH = {'sin': math.sin, 'cos': math.cos, 'tan': math.tan, 'asin': math.asi
              'ceil': math.ceil, 'floor': math.floor,
              'exp': math.exp, 'log': math.log, 'log10': math.log10, 'sqrt': math.sqrt}
 
+# Number of rows that ExportCmd formats and writes at a time, and the buffer size of the file
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_BUFFER_SIZE = 1 << 20
+
 
 def clean_script(text):
     lines = text.split('\n')
@@ -85,8 +93,15 @@ class Script():
     def check_deprecated_syntax(self):
         return self.script_parser.check_deprecated_syntax()
 
-    def run(self, progress=None):
-        return self.script_parser.runs.run(progress)
+    def run(self, progress=None, jobs=None, record_all=True):
+        """
+        Simulate the runs. If record_all is False, only what the post-processing commands in the
+        script use is written to the output (which is then only meant to be post-processed with
+        this script).
+        """
+        random_seed = self.script_parser.parameters.get(kw.RANDOM_SEED)
+        recordings = None if record_all else self.script_parser.postcmds.recordings()
+        return self.script_parser.runs.run(progress, jobs, random_seed, recordings)
 
     def postproc(self, simulation_data, progress=None):
         if progress is not None:
@@ -972,10 +987,12 @@ class ScriptParser():
             raise ParseException(lineno, err)
         n_subjects = run_parameters.get(kw.N_SUBJECTS)
         bind_trials = run_parameters.get(kw.BIND_TRIALS)
+        jobs = run_parameters.get(kw.JOBS)
+        engine = run_parameters.get(kw.ENGINE)
         err, err_lineno = mechanism_obj.check_compatibility_with_world(world)
         if err:
             raise ParseException(err_lineno, err)
-        run = Run(run_label, world, mechanism_obj, n_subjects, bind_trials)
+        run = Run(run_label, world, mechanism_obj, n_subjects, bind_trials, jobs, engine)
 
         return run, run_label
 
@@ -1017,6 +1034,20 @@ class PostCmds():
     def add(self, cmd):
         self.cmds.append(cmd)
 
+    def recordings(self):
+        """
+        Return a dict with Recording objects (keys are run labels) with what the commands need
+        from the output of each run.
+        """
+        recordings = dict()
+        for cmd in self.cmds:
+            for vwpn, expr, parameters in cmd.evaluated():
+                run_label = parameters.get(kw.EVAL_RUNLABEL)
+                if run_label not in recordings:
+                    recordings[run_label] = Recording()
+                recordings[run_label].add(vwpn, expr, parameters)
+        return recordings
+
     def run(self, simulation_data, info_msg, progress=None):
         if progress:
             progress.reset1()
@@ -1120,6 +1151,11 @@ class PostCmds():
         return None
 
 
+# The variable evaluated by each plot and export command
+CMD_VWPN = {kw.VPLOT: 'v', kw.VSSPLOT: 'vss', kw.WPLOT: 'w', kw.PPLOT: 'p', kw.NPLOT: 'n',
+            kw.VEXPORT: 'v', kw.VSSEXPORT: 'vss', kw.WEXPORT: 'w', kw.PEXPORT: 'p', kw.NEXPORT: 'n'}
+
+
 class PostCmd():
     def __init__(self):
         self.plot_data = None
@@ -1139,6 +1175,17 @@ class PostCmd():
     def to_dict(self):
         return dict()
 
+    def evaluated(self):
+        """
+        Return a list of (vwpn, expr, parameters) tuples for the evaluations made by run(),
+        where vwpn is 'v', 'vss', 'w', 'p', 'n', or 'h' for the history.
+        """
+        return []
+
+    @staticmethod
+    def _evaluated_postexpr(post_expr, parameters):
+        return [(post_var.fn, post_var.parsed_arg, parameters) for post_var in post_expr.post_vars.values()]
+
 
 class PlotCmd(PostCmd):
     def __init__(self, cmd, expr, expr0, parameters, run_parameters, variables, mpl_prop, lineno):
@@ -1238,6 +1285,12 @@ class PlotCmd(PostCmd):
     def progress_label(self):
         return f"{self.cmd} {self.expr0}"
 
+    def evaluated(self):
+        if self.is_postexpr:
+            return self._evaluated_postexpr(self.expr, self.parameters)
+        else:
+            return [(CMD_VWPN[self.cmd], self.expr, self.parameters)]
+
     def to_dict(self):
         return self.plot_data.to_dict()
 
@@ -1293,6 +1346,17 @@ class ExportCmd(PostCmd):
 
         # parse_eval_prop(cmd, expr, eval_prop, VALID_PROPS[cmd])
 
+    def evaluated(self):
+        if self.cmd == kw.HEXPORT:
+            return [('h', None, self.parameters)]
+        out = list()
+        for expr in self.exprs:
+            if self.is_postexpr:
+                out.extend(self._evaluated_postexpr(expr, self.parameters))
+            else:
+                out.append((CMD_VWPN[self.cmd], expr, self.parameters))
+        return out
+
     def run(self, simulation_data, info_msg, progress=None):
         self.parameters.scalar_expand()  # If beta is not specified, scalar_expand has not been run
         filename = self.parameters.get(kw.EVAL_FILENAME)
@@ -1300,16 +1364,22 @@ class ExportCmd(PostCmd):
             raise ParseException(self.lineno, f"Parameter {kw.EVAL_FILENAME} to {self.cmd} is mandatory.")
         # if not filename.endswith(".csv"):
         #     filename = filename + ".csv"
-        file = open(filename, 'w', newline='')
-
-        try:
+        if npzexport.is_npz(filename):
             if self.cmd == kw.HEXPORT:
-                self._h_export(file, simulation_data)
+                npzexport.save(filename, **self._h_arrays(simulation_data))
             else:
-                self._vwpn_export(file, simulation_data)
-        except EvalException as ex:
-            file.close()
-            raise ex
+                npzexport.save(filename, **self._vwpn_arrays(simulation_data))
+        else:
+            file = open(filename, 'w', newline='', buffering=EXPORT_BUFFER_SIZE)
+
+            try:
+                if self.cmd == kw.HEXPORT:
+                    self._h_export(file, simulation_data)
+                else:
+                    self._vwpn_export(file, simulation_data)
+            except EvalException as ex:
+                file.close()
+                raise ex
 
         # Add to message log
         dirpath = os.path.dirname(os.path.abspath(__file__))
@@ -1317,61 +1387,65 @@ class ExportCmd(PostCmd):
         info_msg.append(f"Exported file {filepath}.")
 
     def _h_export(self, file, simulation_data):
-        # evalprops = simulation_data._evalparse(self.parameters)
-        with file as csvfile:
-            w = csv.writer(csvfile, quotechar='"', quoting=csv.QUOTE_NONNUMERIC, escapechar=None)
-
-            # if self.eval_prop[EVAL_SUBJECT] == EVAL_ALL:
-            run_label = self.parameters.get(kw.EVAL_RUNLABEL)
-            n_subjects = len(simulation_data.run_outputs[run_label].output_subjects)
-            subject_legend_labels = list()
-            for i in range(n_subjects):
-                # subject_legend_labels.append("phase line subject {}".format(i))
-                subject_legend_labels.append("stimulus subject {}".format(i))
-                subject_legend_labels.append("response subject {}".format(i))
-
-            # Write headers
-            w.writerow(['step'] + subject_legend_labels)
-
-            # Write data
-            maxlen = 0
-
-            for i in range(n_subjects):
-                len_history_i = len(simulation_data.run_outputs[run_label].output_subjects[i].history)
-                if len_history_i > maxlen:
-                    maxlen = len_history_i
-            for histind in range(0, maxlen, 2):
-                datarow = [histind // 2]
-                for i in range(n_subjects):
-                    history = simulation_data.run_outputs[run_label].output_subjects[i].history
-                    # phase_line_labels = simulation_data.run_outputs[run_label].output_subjects[i].phase_line_labels
-                    # phase_line_labels_steps = simulation_data.run_outputs[run_label].output_subjects[i].phase_line_labels_steps
-                    # print(history)
-                    # print(phase_line_labels)
-                    # print(phase_line_labels_steps)
-                    if histind < len(history):
-                        stimulus = history[histind]
-                        response = history[histind + 1]
-                        # phase_line = phase_line_labels[]
-                        datarow.append(stimulus)
-                        datarow.append(response)
-                    else:
-                        datarow.append(' ')
-                        datarow.append(' ')
-                w.writerow(datarow)
-            # else:
-            #     # Write headers
-            #     w.writerow(['step', 'stimulus', 'response'])
-
-            #     # Write data
-            #     for row in range(len(ydata)):
-            #         datarow = [row, ydata[row]]
-            #         w.writerow(datarow)
+        run_label = self.parameters.get(kw.EVAL_RUNLABEL)
+        output_subjects = simulation_data.run_outputs[run_label].output_subjects
+        subject_legend_labels = list()
+        for i in range(len(output_subjects)):
+            subject_legend_labels.append("stimulus subject {}".format(i))
+            subject_legend_labels.append("response subject {}".format(i))
+
+        # The history of each subject is read and decoded a chunk of steps at a time
+        columns = list()
+        for output_subject in output_subjects:
+            history = output_subject.history_steps
+            fields = np.array([_csv_field(name) for name in output_subject.symbols.names], dtype=object)
+            columns.append(_CsvColumn(len(history),
+                                      lambda start, stop, history=history, fields=fields:
+                                      fields[history.stimulus_codes[start:stop]].tolist()))
+            columns.append(_CsvColumn(len(history),
+                                      lambda start, stop, history=history, fields=fields:
+                                      fields[history.response_codes[start:stop]].tolist()))
 
-    def _vwpn_export(self, file, simulation_data):
+        with file as csvfile:
+            _write_csv(csvfile, ['step'] + subject_legend_labels, columns)
+
+    def _h_arrays(self, simulation_data):
+        """The arrays in an exported .npz file with the history (see npzexport)."""
+        run_label = self.parameters.get(kw.EVAL_RUNLABEL)
+        output_subjects = simulation_data.run_outputs[run_label].output_subjects
+        n_steps = max((len(output_subject.history_steps) for output_subject in output_subjects), default=0)
+        stimulus = np.full((len(output_subjects), n_steps), -1, dtype=np.int32)
+        response = np.full((len(output_subjects), n_steps), -1, dtype=np.int32)
+
+        # The subjects may have different symbol tables (when simulated in parallel), so the
+        # codes of each subject are mapped to indices in a common list of names
+        indices = dict()
+        for i, output_subject in enumerate(output_subjects):
+            index = np.array([indices.setdefault(str(name), len(indices))
+                              for name in output_subject.symbols.names], dtype=np.int32)
+            history = output_subject.history_steps
+            if len(index) > 0:
+                stimulus[i, :len(history)] = index[history.stimulus_codes]
+                response[i, :len(history)] = index[history.response_codes]
+        return {'names': np.array(list(indices), dtype=str), 'stimulus': stimulus, 'response': response}
+
+    def _vwpn_arrays(self, simulation_data):
+        """The arrays in an exported .npz file with the evaluated expressions (see npzexport)."""
+        ydatas, legend_labels = self._vwpn_evaluate(simulation_data)
+        if self.parameters.get(kw.EVAL_SUBJECT) != kw.EVAL_ALL:
+            ydatas = [[ydata] for ydata in ydatas]
+        n_subjects = max((len(ydata) for ydata in ydatas), default=0)
+        n_steps = max((len(ydata_i) for ydata in ydatas for ydata_i in ydata), default=0)
+        data = np.full((len(ydatas), n_subjects, n_steps), np.nan)
+        for i, ydata in enumerate(ydatas):
+            for j, ydata_j in enumerate(ydata):
+                data[i, j, :len(ydata_j)] = np.array(ydata_j, dtype=float)  # None becomes NaN
+        return {'labels': np.array(legend_labels, dtype=str), 'data': data}
+
+    def _vwpn_evaluate(self, simulation_data):
+        """Evaluate the expressions, returning the list of evaluated ydata and their labels."""
         ydatas = []
         legend_labels = []
-        n_ydata = None
         for expr, expr0 in zip(self.exprs, self.exprs0):
             label_expr = expr0  # beautify_expr_for_label(self.expr)
             if self.is_postexpr:  # @export v(s->b) + 2*w(s) / sin(n(s->b->s))
@@ -1399,50 +1473,27 @@ class ExportCmd(PostCmd):
                     legend_label = f"n({label_expr})"
             ydatas.append(ydata)
             legend_labels.append(legend_label)
-            if n_ydata is None:
-                n_ydata = len(ydata)
+        return ydatas, legend_labels
 
-        with file as csvfile:
-            w = csv.writer(csvfile, quotechar='"', quoting=csv.QUOTE_NONNUMERIC, escapechar=None)
-
-            if self.parameters.get(kw.EVAL_SUBJECT) == kw.EVAL_ALL:
-                subject_legend_labels = list()
-
-                for legend_label in legend_labels:
-                    for i in range(n_ydata):
-                        subject_legend_label = f"{legend_label} subject {i + 1}"
-                        subject_legend_labels.append(subject_legend_label)
-
-                # Write headers
-                w.writerow(['x'] + subject_legend_labels)
-
-                # Write data
-                maxlen = 0
-                for ydata in ydatas:
-                    for i in range(n_ydata):
-                        len_ydata_i = len(ydata[i])
-                        if len_ydata_i > maxlen:
-                            maxlen = len_ydata_i
-                for row in range(maxlen):
-                    datarow = [row]
-                    for ydata in ydatas:
-                        for i in range(n_ydata):
-                            if row < len(ydata[i]):
-                                datarow.append(ydata[i][row])
-                            else:
-                                datarow.append(' ')
-                    w.writerow(datarow)
-            else:
-                # Write headers
-                # w.writerow(['x', legend_label])
-                w.writerow(['x'] + legend_labels)
+    def _vwpn_export(self, file, simulation_data):
+        ydatas, legend_labels = self._vwpn_evaluate(simulation_data)
+        n_ydata = len(ydatas[0])
+
+        if self.parameters.get(kw.EVAL_SUBJECT) == kw.EVAL_ALL:
+            header = ['x']
+            columns = list()
+            for legend_label, ydata in zip(legend_labels, ydatas):
+                for i in range(n_ydata):
+                    header.append(f"{legend_label} subject {i + 1}")
+                    columns.append(_CsvColumn(len(ydata[i]),
+                                              lambda start, stop, ydata_i=ydata[i]: _csv_fields(ydata_i[start:stop])))
+        else:
+            header = ['x'] + legend_labels
+            columns = [_CsvColumn(len(ydata), lambda start, stop, ydata=ydata: _csv_fields(ydata[start:stop]))
+                       for ydata in ydatas]
 
-                # Write data
-                for row in range(len(ydata)):
-                    datarow = [row]
-                    for ydata in ydatas:
-                        datarow.append(ydata[row])
-                    w.writerow(datarow)
+        with file as csvfile:
+            _write_csv(csvfile, header, columns)
 
     def progress_label(self):
         # return f"{self.cmd} {self.exprs0}"
@@ -1452,6 +1503,56 @@ class ExportCmd(PostCmd):
         return {'type': 'export', 'filename': self.parameters.get(kw.FILENAME), 'filename_no_path': self.filename_no_path}
 
 
+class _CsvColumn():
+    """
+    A column in an exported file: its length and a function that returns the formatted fields in
+    the rows start to stop-1 (with stop <= length).
+    """
+    def __init__(self, length, fields):
+        self.length = length
+        self.fields = fields
+
+
+_CSV_PADDING = '" "'  # Field for the rows after the end of a shorter column
+
+
+def _csv_field(value):
+    """Format value like csv.writer does with QUOTE_NONNUMERIC."""
+    if value is None:
+        return '""'
+    if isinstance(value, (int, float, np.number)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _csv_fields(values):
+    """Format the values in the list values like csv.writer does with QUOTE_NONNUMERIC."""
+    types = set(map(type, values))
+    if types <= {float, int}:
+        return list(map(str, values))
+    return list(map(_csv_field, values))
+
+
+def _write_csv(file, header, columns):
+    """
+    Write the header and the rows with the step number followed by the field in each column
+    (padded to the longest column), EXPORT_CHUNK_ROWS rows at a time.
+    """
+    csv.writer(file, quotechar='"', quoting=csv.QUOTE_NONNUMERIC, escapechar=None).writerow(header)
+    n_rows = max((column.length for column in columns), default=0)
+    for start in range(0, n_rows, EXPORT_CHUNK_ROWS):
+        stop = min(start + EXPORT_CHUNK_ROWS, n_rows)
+        chunk = [list(map(str, range(start, stop)))]
+        for column in columns:
+            if column.length >= stop:
+                chunk.append(column.fields(start, stop))
+            else:
+                fields = column.fields(start, column.length) if column.length > start else []
+                chunk.append(fields + [_CSV_PADDING] * (stop - start - len(fields)))
+        file.write('\r\n'.join(map(','.join, zip(*chunk))))
+        file.write('\r\n')
+
+
 class FigureCmd(PostCmd):
     def __init__(self, title, mpl_prop, fname, savefig_prop):
         super().__init__()
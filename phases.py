@@ -697,8 +697,8 @@ class EndPhaseCondition():
         self.lineno = lineno
         self.cond = endcond_str
 
-    def is_met(self, variables, event_counter):
-        ismet, err = ParseUtil.evaluate(self.cond, variables, event_counter, ParseUtil.STOP_COND)
+    def is_met(self, variables, event_counter, rng=None):
+        ismet, err = ParseUtil.evaluate(self.cond, variables, event_counter, ParseUtil.STOP_COND, rng)
         if err:
             raise ParseException(self.lineno, err)
         if type(ismet) is not bool:
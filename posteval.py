@@ -1,6 +1,8 @@
 import ast
 import re
 
+import numpy as np
+
 from util import ParseUtil
 from exceptions import EvalException
 
@@ -19,6 +21,14 @@ class PostExpr():
     def __init__(self, expr, post_vars):
         self.expr = expr
         self.post_vars = post_vars  # dict
+        self.code = compile(expr, '<postexpr>', 'eval')
+
+        # Names and calls that decide whether the expression can be evaluated over arrays
+        tree = ast.parse(expr, mode='eval')
+        self.names = {node.id for node in ast.walk(tree) if type(node) is ast.Name}
+        self.has_round_ndigits = any(type(node) is ast.Call and type(node.func) is ast.Name and
+                                     node.func.id == 'round' and len(node.args) + len(node.keywords) > 1
+                                     for node in ast.walk(tree))
 
     def eval(self, simulation_data, parameters, run_parameters, variables, POST_MATH):
         # Evaluate each variable v(s->b), w(s), n(s->b->s)
@@ -32,20 +42,131 @@ class PostExpr():
             else:  # Number of evaluated values should be the same for all variables
                 assert(n_values == len(var_ydata[alias])), f"{n_values} != {len(var_ydata[alias])}"
 
-        # Evaluate the expression using the evaluated variable values
+        # Evaluate the expression using the evaluated variable values. With subject=all, each
+        # value is the list of one subject, and the expression is evaluated for each subject.
+        per_subject = n_values > 0 and all(type(val[0]) is list for val in var_ydata.values())
+        if per_subject:
+            ydata = [self._eval_series({key: val[i] for key, val in var_ydata.items()}, variables, POST_MATH)
+                     for i in range(n_values)]
+            failed = all(series.count(None) == len(series) for series in ydata)
+        else:
+            ydata = self._eval_series(var_ydata, variables, POST_MATH)
+            failed = (ydata.count(None) == n_values)
+        if n_values > 0 and failed:  # Evaluation failed for ALL i (allow occational divide by zero, for example)
+            return None, f"Expression evaluation failed."
+        else:
+            return ydata, None
+
+    def _eval_series(self, var_ydata, variables, POST_MATH):
+        """
+        Evaluate the expression for each point in the equally long lists in var_ydata, with
+        None for the points where the evaluation fails.
+        """
+        ydata = None
+        if self.names.intersection(POST_MATH).issubset(ARRAY_MATH) and not self.has_round_ndigits:
+            try:
+                ydata = self._eval_arrays(var_ydata, variables, POST_MATH)
+            except Exception:
+                ydata = None
+        if ydata is None:
+            ydata = self._eval_points(var_ydata, variables, POST_MATH)
+        return ydata
+
+    def _eval_arrays(self, var_ydata, variables, POST_MATH):
+        """
+        Evaluate the expression once over whole arrays. The points where the result is not finite
+        (division by zero, log of zero, overflow, and so on) are evaluated again point by point,
+        to get the same value (inf, or None where the evaluation raises) as _eval_points. So are
+        the points where a float array has an int value (such as an integer start_v), to get the
+        same type. Returns None if the expression cannot be evaluated this way.
+        """
+        n_values = len(next(iter(var_ydata.values())))
+        arrays = {key: np.asarray(val) for key, val in var_ydata.items()}
+        for val in arrays.values():
+            if val.shape != (n_values,) or val.dtype.kind not in 'iuf':
+                return None
+
+        result = self._eval_code(arrays, variables, n_values)
+        if result is None:
+            return None
+        if result.dtype.kind in 'iu':
+            # int64 overflows silently where Python int does not, so compare with the result
+            # using float arithmetic
+            float_arrays = {key: val.astype(float) for key, val in arrays.items()}
+            float_result = self._eval_code(float_arrays, variables, n_values)
+            if float_result is None or not np.allclose(result, float_result, rtol=1e-9, atol=0):
+                return None
+
+        ydata = result.tolist()
+        if result.dtype.kind == 'f':
+            redo = set(np.flatnonzero(~np.isfinite(result)).tolist())
+            for key, val in var_ydata.items():
+                if arrays[key].dtype.kind == 'f':
+                    redo.update(i for i, value in enumerate(val) if type(value) is int)
+            if redo:
+                redo = sorted(redo)
+                points = self._eval_points({key: [val[i] for i in redo] for key, val in var_ydata.items()},
+                                           variables, POST_MATH)
+                for i, y in zip(redo, points):
+                    ydata[i] = y
+        return ydata
+
+    def _eval_code(self, arrays, variables, n_values):
+        """Evaluate the expression with the arrays, or return None if the result is not numeric."""
+        names = dict(arrays)
+        names.update(ARRAY_MATH)
+        names.update(variables.values)
+        with np.errstate(all='ignore'):
+            result = eval(self.code, {'__builtins__': {'round': _array_round}}, names)
+        result = np.broadcast_to(np.asarray(result), (n_values,))
+        if result.dtype.kind not in 'iuf':
+            return None
+        return result
+
+    def _eval_points(self, var_ydata, variables, POST_MATH):
+        """
+        Evaluate the expression point by point, with None where the evaluation raises.
+        """
+        n_values = len(next(iter(var_ydata.values())))
         ydata = [None] * n_values
         for i in range(n_values):
             alias_values = {key: val[i] for key, val in var_ydata.items()}
             alias_values.update(POST_MATH)
             alias_values.update(variables.values)
             try:
-                ydata[i] = eval(self.expr, {'__builtins__': {'round': round}}, alias_values)
+                ydata[i] = eval(self.code, {'__builtins__': {'round': round}}, alias_values)
             except Exception as e:
                 ydata[i] = None
-        if n_values > 0 and ydata.count(None) == n_values:  # Evaluation failed for ALL i (allow occational divide by zero, for example)
-            return None, f"Expression evaluation failed."
-        else:
-            return ydata, None
+        return ydata
+
+
+def _to_int(x):
+    # Like math.ceil, math.floor and round, return int when all values are finite
+    if np.all(np.isfinite(x)):
+        if np.any(np.abs(x) >= 2.0 ** 63):
+            raise OverflowError("Too large for int64.")
+        return x.astype(np.int64)
+    return x
+
+
+def _array_round(x):
+    # round(x, ndigits) is evaluated point by point, since np.round does not round like round
+    return _to_int(np.rint(x))  # Rounds half to even, like round
+
+
+def _array_log(x, base=None):
+    if base is None:
+        return np.log(x)
+    return np.log(x) / np.log(base)
+
+
+# NumPy counterparts of the functions in POST_MATH, used when evaluating over whole arrays
+ARRAY_MATH = {'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+              'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan,
+              'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+              'asinh': np.arcsinh, 'acosh': np.arccosh, 'atanh': np.arctanh,
+              'ceil': lambda x: _to_int(np.ceil(x)), 'floor': lambda x: _to_int(np.floor(x)),
+              'exp': np.exp, 'log': _array_log, 'log10': np.log10, 'sqrt': np.sqrt}
 
 
 def is_arithmetic(expr, allowed_names):
@@ -0,0 +1,145 @@
+"""
+The random generators used in the simulation.
+
+Each subject of a run draws all its random numbers (responses, probabilistic gotos, and rand()
+and choice() in phase lines) from its own generator. The generator is seeded with a hash of the
+parameter random_seed, the run label and the subject index, so that a subject gets the same
+numbers whether the subjects are simulated one at a time, in worker processes (parameter jobs)
+or in lockstep (engine = vectorized), and regardless of the other runs in the script.
+
+A generator is a stream of uniform numbers in [0, 1) from a counter-based NumPy generator
+(Philox), drawn in blocks. All random functions (random, randint, choice, choices) are computed
+from the numbers in this stream, so the numbers a subject gets do not depend on the block size,
+and the vectorized engine can draw the numbers of all subjects from an array of blocks (see
+UniformBuffers).
+"""
+import hashlib
+import random
+
+import numpy as np
+
+
+# The smallest and largest number of uniform numbers drawn at a time by a BufferedRandom
+MIN_BLOCK_SIZE = 64
+MAX_BLOCK_SIZE = 4096
+
+
+def new_random_seed():
+    """Return a seed for a script where the parameter random_seed is not set."""
+    return random.getrandbits(64)
+
+
+def derive_seed(*key):
+    """Return the seed for the generator with the specified key (a tuple of str and int)."""
+    digest = hashlib.sha256(repr(key).encode()).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def derive_random(*key):
+    """Return a BufferedRandom generator seeded with a hash of key (a tuple of str and int)."""
+    return BufferedRandom(derive_seed(*key))
+
+
+def subject_seed(random_seed, run_label, subject_ind):
+    """Return the seed of the generator of the specified subject in the specified run."""
+    return derive_seed(random_seed, run_label, subject_ind)
+
+
+def subject_random(random_seed, run_label, subject_ind):
+    """Return the generator of the specified subject in the specified run."""
+    return BufferedRandom(subject_seed(random_seed, run_label, subject_ind))
+
+
+def uniform_generator(seed):
+    """Return the NumPy generator producing the uniform numbers of the generator with seed."""
+    return np.random.Generator(np.random.Philox(seed))
+
+
+class BufferedRandom(random.Random):
+    """
+    A random.Random whose numbers come from the uniform numbers of uniform_generator(seed),
+    drawn in blocks that grow from MIN_BLOCK_SIZE to MAX_BLOCK_SIZE. Since only random() is
+    overridden, random.Random computes randint, choice, etc. from random() as well.
+    """
+
+    def __init__(self, seed=0):
+        self.uniform_seed = seed
+        self.generator = uniform_generator(seed)
+        self.buffer = []  # The next numbers, in reverse order
+        self.block_size = MIN_BLOCK_SIZE
+        super().__init__(seed)
+
+    def random(self):
+        buffer = self.buffer
+        if buffer:
+            return buffer.pop()
+        return self._refill()
+
+    def _refill(self):
+        """Draw the next block of numbers, and return the first."""
+        self.buffer = self.generator.random(self.block_size)[::-1].tolist()
+        self.block_size = min(2 * self.block_size, MAX_BLOCK_SIZE)
+        return self.buffer.pop()
+
+    def __reduce__(self):
+        return (self.__class__, (self.uniform_seed,), self.__dict__.copy())
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class UniformBuffers():
+    """
+    The uniform number streams of a population of subjects (with the same numbers as
+    BufferedRandom generators with the same seeds), in an array with one row of buffered numbers
+    per subject. take() draws the next number of several subjects at once, and generator(i)
+    returns a random.Random for the numbers of subject i that are not drawn with take().
+    """
+
+    def __init__(self, seeds, block_size=256):
+        self.generators = [uniform_generator(seed) for seed in seeds]
+        self.block_size = block_size
+        self.values = np.empty((len(seeds), block_size))
+        self.pos = np.full(len(seeds), block_size)  # Position of the next number in each row
+
+    def take(self, ix):
+        """Return the next number of each subject in the integer array ix (without repeats)."""
+        pos = self.pos[ix]
+        empty = pos == self.block_size
+        if empty.any():
+            for i in ix[empty].tolist():
+                self._refill(i)
+            pos = self.pos[ix]
+        self.pos[ix] = pos + 1
+        return self.values[ix, pos]
+
+    def take_one(self, i):
+        """Return the next number of subject i."""
+        pos = self.pos.item(i)
+        if pos == self.block_size:
+            self._refill(i)
+            pos = 0
+        self.pos[i] = pos + 1
+        return self.values.item(i, pos)
+
+    def generator(self, i):
+        return _BufferRandom(self, i)
+
+    def _refill(self, i):
+        self.values[i] = self.generators[i].random(self.block_size)
+        self.pos[i] = 0
+
+
+class _BufferRandom(random.Random):
+    """A random.Random drawing the numbers of subject i in UniformBuffers."""
+
+    def __init__(self, buffers=None, i=0):
+        self.buffers = buffers
+        self.i = i
+        super().__init__(0)
+
+    def random(self):
+        return self.buffers.take_one(self.i)
+
+    def __reduce__(self):
+        return (self.__class__, (self.buffers, self.i))
@@ -1,6 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import keywords as kw
+import vectorized
+from compiled_world import CompiledWorld
 from exceptions import ParseException, InterruptedSimulation
-from output import ScriptOutput, RunOutput
+from output import ScriptOutput, RunOutput, RunOutputSubject, Recording
+from randomstreams import new_random_seed, subject_random
+from symbols import SymbolTable
 
 
 class Runs():
@@ -40,62 +46,166 @@ class Runs():
                 return False
         return True
 
-    def run(self, progress=None):
+    def run(self, progress=None, jobs=None, random_seed=None, recordings=None):
+        """
+        Simulate all runs. If jobs is not None, it overrides the parameter 'jobs' of each run.
+        random_seed is the parameter random_seed (None if not set). recordings is a dict with
+        Recording objects (keys are run labels) with what to write to the output of each run
+        (runs without a Recording write nothing but the phases), or None to write everything.
+
+        With more than one job, the subjects of all runs are simulated in a common pool of
+        worker processes (with as many processes as the largest 'jobs' of the runs), so that
+        the runs are executed concurrently.
+        """
+        if random_seed is None:
+            random_seed = new_random_seed()
+        for label in self.run_labels:
+            self.runs[label].recording = None if recordings is None else recordings.get(label, Recording())
+        if jobs is None:
+            jobs = max((self.runs[label].jobs for label in self.run_labels), default=1)
+        jobs = min(jobs, sum(self.get_n_subjects()))
+
+        if jobs > 1:
+            run_outputs = _run_parallel([self.runs[label] for label in self.run_labels], jobs, random_seed,
+                                        progress)
+            return ScriptOutput(run_outputs)
+
         out = dict()
         for label in self.run_labels:
             run = self.runs[label]
             if progress:
                 progress.report1(f"Running {label}")
-            out[label] = run.run(progress)
+            out[label] = run.run(progress, 1, random_seed)
 
         return ScriptOutput(out)
 
 
+# The Run objects (keys are run labels) simulated by the worker processes in _run_parallel
+_worker_runs = None
+
+
+def _init_worker(runs):
+    global _worker_runs
+    _worker_runs = {run.run_label: run for run in runs}
+
+
+def _simulate_subjects(run_label, random_seed, subject_inds):
+    """Simulate a shard of subjects of the specified run in a worker process. Returns a list of
+    (subject_ind, RunOutputSubject) tuples."""
+    run = _worker_runs[run_label]
+    out = list()
+    for subject_ind in subject_inds:
+        recording = None if run.recording is None else run.recording.for_subject(subject_ind)
+        output_subject = RunOutputSubject(run.mechanism_obj.stimulus_req, run.symbols, recording)
+        run.simulate_subject(output_subject, random_seed, subject_ind)
+        out.append((subject_ind, output_subject))
+    return out
+
+
+def _simulate_vectorized(run_label, random_seed):
+    """Simulate all subjects of the specified run (with the vectorized engine) in a worker
+    process. Returns a RunOutput object."""
+    return vectorized.simulate(_worker_runs[run_label], random_seed)
+
+
+def _run_parallel(runs, jobs, random_seed, progress=None):
+    """
+    Simulate the subjects of the specified Run objects in a pool of jobs worker processes.
+    Each subject uses its own random generator (see randomstreams.py), so the result is the
+    same as when simulating the subjects one at a time. Runs using the vectorized engine are
+    simulated as a whole in one worker process. Returns a dict with RunOutput objects, keys are
+    run labels in the order of runs.
+    """
+    run_outputs = dict()
+    tasks = list()
+    vectorized_tasks = list()
+    for run in runs:
+        run_outputs[run.run_label] = RunOutput(run.n_subjects, run.mechanism_obj, run.symbols, run.recording)
+        if run.engine == 'vectorized':
+            vectorized_tasks.append((run.run_label, random_seed))
+            continue
+
+        # A few shards per worker to balance the load between the workers
+        shard_len = max(1, run.n_subjects // (4 * jobs))
+        for i in range(0, run.n_subjects, shard_len):
+            tasks.append((run.run_label, random_seed, range(i, min(i + shard_len, run.n_subjects))))
+
+    n_done = {run.run_label: 0 for run in runs}
+    if progress:
+        progress.reset2()
+        progress.report2("")
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(runs,)) as executor:
+        futures = {executor.submit(_simulate_vectorized, *task): task[0] for task in vectorized_tasks}
+        futures.update({executor.submit(_simulate_subjects, *task): task[0] for task in tasks})
+        for future in as_completed(futures):
+            if progress and progress.get_stop_clicked():
+                for f in futures:
+                    f.cancel()
+                raise InterruptedSimulation()
+            run_label = futures[future]
+            result = future.result()
+            if isinstance(result, RunOutput):
+                subject_results = enumerate(result.output_subjects)
+            else:
+                subject_results = result
+            for subject_ind, output_subject in subject_results:
+                run_outputs[run_label].set_subject(subject_ind, output_subject)
+                n_done[run_label] += 1
+                if progress:
+                    progress.increment1()
+            if progress:
+                run_messages = [f"{run.run_label}: {n_done[run.run_label]} of {run.n_subjects}" for run in runs]
+                if len(runs) > 1:
+                    progress.report1(f"Simulated subjects ({', '.join(run_messages)})")
+                else:
+                    progress.report1(f"Simulated {n_done[run_label]} of {runs[0].n_subjects} subjects")
+    return run_outputs
+
+
 class Run():
     """A class for a script run."""
 
-    def __init__(self, run_label, world, mechanism_obj, n_subjects, bind_trials):
+    def __init__(self, run_label, world, mechanism_obj, n_subjects, bind_trials, jobs=1,
+                 engine='reference'):
         self.run_label = run_label
         self.world = world
+        self.compiled_world = CompiledWorld(world)
         self.mechanism_obj = mechanism_obj
+        self.symbols = SymbolTable(mechanism_obj.parameters.get(kw.STIMULUS_ELEMENTS),
+                                   mechanism_obj.parameters.get(kw.BEHAVIORS), world)
         self.has_v = mechanism_obj.has_v()
         self.has_w = mechanism_obj.has_w()
         self.has_vss = mechanism_obj.has_vss()
         self.n_subjects = n_subjects
         self.bind_trials = bind_trials
+        self.jobs = jobs
+        self.engine = engine
 
-    def run(self, progress=None):
+        # The Recording with what to write to the output (None to write everything), see Runs.run
+        self.recording = None
 
-        # Remove when omit_learn using new_trial is no longer suppoerted
-        def _omit_learn_using_new_trial(phase_line_label, preceeding_help_lines, is_bind_off):
-            is_new_trial = (phase_line_label.lower() == "new_trial")
-            lower_phh = [x.lower() for x in preceeding_help_lines]
-            omit_learn_using_new_trial = (is_bind_off and (is_new_trial or ("new_trial" in lower_phh)))
-            return omit_learn_using_new_trial
+    def run(self, progress=None, jobs=None, random_seed=None):
+        """
+        Simulate all subjects of the run. With more than one job, the subjects are simulated in
+        a pool of worker processes. With the vectorized engine, all subjects are simulated in
+        lockstep in this process (see vectorized.py). In all cases, each subject uses its own
+        random generator derived from random_seed (see randomstreams.py).
+        """
+        if random_seed is None:
+            random_seed = new_random_seed()
 
-        out = RunOutput(self.n_subjects, self.mechanism_obj)
+        if self.engine == 'vectorized':
+            return vectorized.simulate(self, random_seed, progress)
 
-        stimulus_elements = self.mechanism_obj.parameters.get(kw.STIMULUS_ELEMENTS)
-        behaviors = self.mechanism_obj.parameters.get(kw.BEHAVIORS)
-        is_bind_off = (self.bind_trials == "off")
+        if jobs is None:
+            jobs = self.jobs
+        jobs = min(jobs, self.n_subjects)
 
-        # Initialize output with start values
-        for subject_ind in range(self.n_subjects):
-            for element in stimulus_elements:
-                if self.has_w:
-                    out.write_w(subject_ind, {element: 1}, 0, self.mechanism_obj)
-                if self.has_v:
-                    for behavior in behaviors:
-                        out.write_v(subject_ind, {element: 1}, behavior, 0, self.mechanism_obj)
-                if self.has_vss:
-                    for element2 in stimulus_elements:
-                        out.write_vss(subject_ind, {element: 1}, {element2: 1}, 0, self.mechanism_obj)
-            # out.write_step(subject_ind, self.world.phases[0].label, 0)
+        if jobs > 1:
+            return _run_parallel([self], jobs, random_seed, progress)[self.run_label]
 
-        # The actual simulation
+        out = RunOutput(self.n_subjects, self.mechanism_obj, self.symbols, self.recording)
         for subject_ind in range(self.n_subjects):
-            # print(subject_ind)
-            prev_phase_label = None  # For phases progress
             if progress:
                 if progress.get_n_runs() > 1:
                     progress.report1(f"{self.run_label}: Simulating subject {subject_ind + 1}")
@@ -103,79 +213,123 @@ class Run():
                     progress.report1(f"Simulating subject {subject_ind + 1}")
                 progress.reset2()
                 progress.report2("")
-            step = 1
-            subject_done = False
-            response = None
-            while not subject_done:
-                if progress and progress.get_stop_clicked():
-                    raise InterruptedSimulation()
-                next_stimulus_out = self.world.next_stimulus(response)
-                stimulus, phase_label, phase_line_label, preceeding_help_lines, omit_learn = next_stimulus_out
-                if progress:
-                    if phase_label != prev_phase_label:  # Update phases progress
-                        progress.increment2(self.run_label)
-                        progress.report2(f"Phase {phase_label}")
-                        prev_phase_label = phase_label
-
-                subject_done = (stimulus is None)
-                if not subject_done:
-
-                    # Remove when omit_learn using new_trial is no longer suppoerted
-                    omit_learn_using_new_trial = _omit_learn_using_new_trial(phase_line_label, preceeding_help_lines,
-                                                                             is_bind_off)
-                    omit_learn = (omit_learn or omit_learn_using_new_trial)
-
-                    prev_stimulus = self.mechanism_obj.prev_stimulus
-                    prev_response = self.mechanism_obj.response
-                    response = self.mechanism_obj.learn_and_respond(stimulus, omit_learn)
-
-                    if prev_stimulus is not None:
-                        if self.has_w:
-                            out.write_w(subject_ind, prev_stimulus, step, self.mechanism_obj)
-                        if self.has_v:
-                            out.write_v(subject_ind, prev_stimulus, prev_response, step,
-                                        self.mechanism_obj)
-                        if self.has_vss:
-                            # Loop since *all* vss[(prev_stimulus,*)] is set in
-                            # OriginalRescorlaWagner.learn_and_respond, not only
-                            # vss[(prev_stimulus,stimulus)]
-                            for e in stimulus_elements:
-                                out.write_vss(subject_ind, prev_stimulus, {e: 1}, step,
-                                              self.mechanism_obj)
-                        out.write_history(subject_ind, prev_stimulus, prev_response)
-                        phase_step = step
-                        if step > 1:
-                            phase_step = step + 1
-                        out.write_step(subject_ind, phase_label, phase_step)
-                        step += 1
-                    out.write_phase_line_label(subject_ind, phase_line_label, step,
-                                               preceeding_help_lines)
-                    last_stimulus = dict(stimulus)  # XXX dict ok?
-                    last_response = response
-                else:
-                    step -= 1
-                    # Write last step to all variables
-                    if self.has_w:
-                        for element in stimulus_elements:
-                            out.write_w(subject_ind, (element,), step, self.mechanism_obj)
-                    if self.has_v:
-                        for element in stimulus_elements:
-                            for behavior in behaviors:
-                                out.write_v(subject_ind, {element: 1}, behavior, step,
-                                            self.mechanism_obj)
-
-                    if self.has_vss:
-                        for element1 in stimulus_elements:
-                            for element2 in stimulus_elements:
-                                out.write_vss(subject_ind, {element1: 1}, {element2: 1}, step,
-                                              self.mechanism_obj)
-
-                    out.write_history(subject_ind, last_stimulus, last_response)
-                    out.write_step(subject_ind, "last", step + 2)
-
-                    # Reset mechanism and world for the next subject
-                    self.mechanism_obj.subject_reset()
-                    self.world.subject_reset()
+            if subject_ind > 0:
+                out.output_subjects[subject_ind].predict_capacities(out.output_subjects[subject_ind - 1])
+            self.simulate_subject(out.output_subjects[subject_ind], random_seed, subject_ind, progress)
             if progress:
                 progress.increment1()
         return out
+
+    # Remove when omit_learn using new_trial is no longer suppoerted
+    @staticmethod
+    def omit_learn_using_new_trial(phase_line_label, preceeding_help_lines, is_bind_off):
+        is_new_trial = (phase_line_label.lower() == "new_trial")
+        lower_phh = [x.lower() for x in preceeding_help_lines]
+        omit_learn_using_new_trial = (is_bind_off and (is_new_trial or ("new_trial" in lower_phh)))
+        return omit_learn_using_new_trial
+
+    def simulate_subject(self, out, random_seed, subject_ind, progress=None):
+        """
+        Simulate the subject with index subject_ind and write the result to the RunOutputSubject
+        object out. The mechanism and the world are reset afterwards.
+        """
+        rng = subject_random(random_seed, self.run_label, subject_ind)
+        self.mechanism_obj.rng = rng
+        self.compiled_world.set_random(rng, (random_seed, self.run_label))
+
+        stimulus_elements = self.mechanism_obj.parameters.get(kw.STIMULUS_ELEMENTS)
+        behaviors = self.mechanism_obj.parameters.get(kw.BEHAVIORS)
+        is_bind_off = (self.bind_trials == "off")
+
+        # The variables to write to the output
+        has_v = self.has_v and out.records('v')
+        has_w = self.has_w and out.records('w')
+        has_vss = self.has_vss and out.records('vss')
+
+        # Initialize output with start values
+        for element in stimulus_elements:
+            if has_w:
+                out.write_w({element: 1}, 0, self.mechanism_obj)
+            if has_v:
+                for behavior in behaviors:
+                    out.write_v({element: 1}, behavior, 0, self.mechanism_obj)
+            if has_vss:
+                for element2 in stimulus_elements:
+                    out.write_vss({element: 1}, {element2: 1}, 0, self.mechanism_obj)
+
+        # The actual simulation
+        prev_phase_label = None  # For phases progress
+        step = 1
+        subject_done = False
+        response = None
+        while not subject_done:
+            if progress and progress.get_stop_clicked():
+                raise InterruptedSimulation()
+            next_stimulus_out = self.compiled_world.next_stimulus(response)
+            stimulus, phase_label, phase_line_label, preceeding_help_lines, omit_learn = next_stimulus_out
+            if progress:
+                if phase_label != prev_phase_label:  # Update phases progress
+                    progress.increment2(self.run_label)
+                    progress.report2(f"Phase {phase_label}")
+                    prev_phase_label = phase_label
+
+            subject_done = (stimulus is None)
+            if not subject_done:
+
+                # Remove when omit_learn using new_trial is no longer suppoerted
+                omit_learn_using_new_trial = self.omit_learn_using_new_trial(phase_line_label,
+                                                                             preceeding_help_lines, is_bind_off)
+                omit_learn = (omit_learn or omit_learn_using_new_trial)
+
+                prev_stimulus = self.mechanism_obj.prev_stimulus
+                prev_response = self.mechanism_obj.response
+                response = self.mechanism_obj.learn_and_respond(stimulus, omit_learn)
+
+                if prev_stimulus is not None:
+                    if has_w:
+                        out.write_w(prev_stimulus, step, self.mechanism_obj)
+                    if has_v:
+                        if self.mechanism_obj.use_trace:
+                            # With trace, v may have changed for all elements with an intensity
+                            # in the previous internal intensities
+                            out.write_v(self.mechanism_obj.trace_v_elements, prev_response, step,
+                                        self.mechanism_obj)
+                        else:
+                            out.write_v(prev_stimulus, prev_response, step, self.mechanism_obj)
+                    if has_vss:
+                        # Loop since *all* vss[(prev_stimulus,*)] is set in
+                        # OriginalRescorlaWagner.learn_and_respond, not only
+                        # vss[(prev_stimulus,stimulus)]
+                        for e in stimulus_elements:
+                            out.write_vss(prev_stimulus, {e: 1}, step, self.mechanism_obj)
+                    out.write_history(prev_stimulus, prev_response)
+                    phase_step = step
+                    if step > 1:
+                        phase_step = step + 1
+                    out.write_step(phase_label, phase_step)
+                    step += 1
+                out.write_phase_line_label(phase_line_label, step, preceeding_help_lines)
+                last_stimulus = dict(stimulus)  # XXX dict ok?
+                last_response = response
+            else:
+                step -= 1
+                # Write last step to all variables
+                if has_w:
+                    for element in stimulus_elements:
+                        out.write_w((element,), step, self.mechanism_obj)
+                if has_v:
+                    for element in stimulus_elements:
+                        for behavior in behaviors:
+                            out.write_v({element: 1}, behavior, step, self.mechanism_obj)
+
+                if has_vss:
+                    for element1 in stimulus_elements:
+                        for element2 in stimulus_elements:
+                            out.write_vss({element1: 1}, {element2: 1}, step, self.mechanism_obj)
+
+                out.write_history(last_stimulus, last_response)
+                out.write_step("last", step + 2)
+
+                # Reset mechanism and world for the next subject
+                self.mechanism_obj.subject_reset()
+                self.compiled_world.subject_reset()
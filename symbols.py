@@ -0,0 +1,103 @@
+"""
+A table mapping the names of stimulus elements, behaviors and phase line labels to small integer
+codes. The recordings of a simulation (the history of stimuli and responses and the phase line
+labels) are stored as codes, and the names are restored when they are plotted or exported.
+"""
+
+
+class SymbolTable():
+    """
+    Maps each name to an integer code. A name is a stimulus element, a behavior, a phase line
+    label, or a tuple of stimulus elements for a compound stimulus in a history. Names are added
+    at parse time (see Run), and compound stimuli not known at parse time are added when they are
+    first recorded.
+    """
+
+    def __init__(self, stimulus_elements=(), behaviors=(), world=None):
+        # The names, indexed by code
+        self.names = list()
+
+        # Keys are names, values are codes
+        self.codes = dict()
+
+        for name in stimulus_elements:
+            self.code(name)
+        for name in behaviors:
+            self.code(name)
+        if world is not None:
+            for phase in world.phases:
+                for label, phase_line in phase.phase_lines.items():
+                    self.code(label)
+                    if not phase_line.is_help_line:
+                        stimulus = phase_line.stimulus
+                        if all(type(intensity) is not str for intensity in stimulus.values()):
+                            self.stimulus_code(stimulus)
+
+    def code(self, name):
+        """Return the code for name, adding name to the table if it is not there."""
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(name)
+            self.codes[name] = code
+        return code
+
+    def stimulus_code(self, stimulus):
+        """
+        Return the code for the stimulus (a dict with intensities) as it is written in a history:
+        the element if the stimulus has one element with nonzero intensity, otherwise the tuple of
+        elements with nonzero intensity.
+        """
+        elements = tuple([e for e in stimulus if stimulus[e] != 0])
+        if len(elements) == 1:
+            return self.code(elements[0])
+        else:
+            return self.code(elements)
+
+    def name(self, code):
+        return self.names[code]
+
+    def decode(self, codes):
+        """Return the list of names for the list of codes."""
+        names = self.names
+        return [names[code] for code in codes]
+
+    def match_sets(self, pattern, use_exact_match):
+        """
+        Return a list with, for each item in pattern (as in util.find_and_cumsum), the set of
+        codes of the names that match it.
+        """
+        pattern_type = type(pattern)
+        assert (pattern_type is list) or (pattern_type is tuple) or (pattern_type is str)
+        if pattern_type is list:
+            for p in pattern:
+                assert (type(p) is str) or (type(p) is tuple)
+            pattern_list = pattern
+        else:
+            if pattern_type is tuple:
+                for p in pattern:
+                    assert type(p) is str
+            pattern_list = [pattern]
+        return [self._match_set(p, use_exact_match) for p in pattern_list]
+
+    def _match_set(self, pattern, use_exact_match):
+        """Same matching as util.find_and_cumsum, for each name in the table."""
+        out = set()
+        if type(pattern) is tuple:
+            pattern_set = set(pattern)
+            for code, name in enumerate(self.names):
+                if type(name) is tuple:
+                    if use_exact_match:
+                        is_match = (set(name) == pattern_set)
+                    else:
+                        is_match = pattern_set.issubset(set(name))
+                    if is_match:
+                        out.add(code)
+        else:
+            for code, name in enumerate(self.names):
+                if type(name) is tuple:
+                    if not use_exact_match and pattern in name:
+                        out.add(code)
+                elif name == pattern:
+                    out.add(code)
+        return out
@@ -0,0 +1,104 @@
+"""
+Measures the simulation speed, in steps (stimulus presentations) per second, for a number of
+standard worlds. Run from the repository root with
+
+    python -m tests.benchmark_steps
+"""
+import time
+
+from parsing import Script
+
+COMMON = '''
+random_seed = 1
+n_subjects = 50
+'''
+
+WORLDS = {
+    'instrumental': '''
+    mechanism = ga
+    behaviors = R, R0
+    stimulus_elements = S, reward, background
+    alpha_v = 0.1
+    alpha_w = 0.1
+    u = reward:10, default:0
+
+    @phase instrumental stop: S=500
+    START       S          | R: REWARD | NO_REWARD
+    REWARD      reward     | START
+    NO_REWARD   background | START
+
+    @run instrumental
+    ''',
+
+    'fixed_ratio': '''
+    mechanism = sr
+    behaviors = R, R0
+    stimulus_elements = lever, reward, background
+    alpha_v = 0.1
+    alpha_w = 0.1
+    u = reward:10, default:0
+
+    @phase fixed_ratio stop: reward=100
+    LEVER       lever      | count_line(R)=5: REWARD | LEVER
+    REWARD      reward     | LEVER
+
+    @run fixed_ratio
+    ''',
+
+    'variables_and_help_lines': '''
+    @variables p:0.8
+    mechanism = ga
+    behaviors = R, R0
+    stimulus_elements = S, reward, background
+    alpha_v = 0.1
+    alpha_w = 0.1
+    u = reward:10, default:0
+
+    @phase training stop: S=500
+    START       S          | R and count_line()<3: n:rand(1, 3), REWARD(p), NO_REWARD(1-p) | HELP
+    HELP                   | count(background)>=10: count_reset(background), ITI | NO_REWARD
+    REWARD      reward     | START
+    NO_REWARD   background | START
+    ITI         background | ITI=3: START | ITI
+
+    @run training
+    ''',
+
+    'pavlovian': '''
+    mechanism = rw
+    behaviors = cr, no_cr
+    stimulus_elements = cs, us, context
+    alpha_vss = 0.1
+    lambda = us:1, default:0
+
+    @phase conditioning stop: cs=300
+    CS          cs         | US
+    US          us         | ITI
+    ITI         context    | ITI>=choice(1, 2, 3): CS | ITI
+
+    @phase extinction stop: cs=300
+    CS          cs         | ITI
+    ITI         context    | ITI=2: CS | ITI
+
+    @run conditioning, extinction
+    ''',
+}
+
+
+def steps_per_second(text):
+    script = Script(COMMON + text)
+    script.parse()
+    start = time.perf_counter()
+    script_output = script.run()
+    elapsed = time.perf_counter() - start
+    n_steps = 0
+    for run_output in script_output.run_outputs.values():
+        for output_subject in run_output.output_subjects:
+            n_steps += len(output_subject.history) // 2
+    return n_steps, n_steps / elapsed
+
+
+if __name__ == '__main__':
+    for name, text in WORLDS.items():
+        n_steps, speed = steps_per_second(text)
+        print(f"{name:<28}{n_steps:>10} steps{speed:>12.0f} steps/s")
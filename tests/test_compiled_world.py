@@ -0,0 +1,298 @@
+import random
+
+from .testutil import LsTestCase
+
+from parsing import Script
+from compiled_world import CompiledWorld, CompiledExpression, CompiledEventCounter
+from phases import PhaseEventCounter
+from util import ParseUtil
+from variables import Variables
+
+
+def get_runs(text):
+    script = Script(text)
+    script.parse()
+    return script.script_parser.runs
+
+
+def step_both(self, text, responses, seed=1):
+    """Step the World and the CompiledWorld of the run with the same responses and seed, and check
+    that the output is the same."""
+    run = get_runs(text).get_last_run_obj()
+    world = run.world
+    compiled_world = CompiledWorld(world)
+    for subject in range(2):
+        random.seed(seed + subject)
+        world_out = list()
+        response = None
+        for i in range(len(responses)):
+            out = world.next_stimulus(response)
+            world_out.append((dict(out[0]) if out[0] else None, out[1], out[2], list(out[3]), bool(out[4])))
+            if out[0] is None:
+                break
+            response = responses[i]
+
+        random.seed(seed + subject)
+        compiled_out = list()
+        response = None
+        for i in range(len(responses)):
+            out = compiled_world.next_stimulus(response)
+            compiled_out.append((dict(out[0]) if out[0] else None, out[1], out[2], list(out[3]), bool(out[4])))
+            if out[0] is None:
+                break
+            response = responses[i]
+
+        self.assertEqual(world_out, compiled_out)
+        world.subject_reset()
+        compiled_world.subject_reset()
+    return compiled_out
+
+
+class TestSameAsWorld(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_help_lines_and_actions(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward, background
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: S=30
+        START     S          | R: REWARD | NO_REWARD
+        REWARD    reward     | x:1, START
+        NO_REWARD background | count(R0)>=3: count_reset(R0), HELP | START
+        HELP                 | y=2, HELP2
+        HELP2                | @omit_learn, START
+
+        @phase phase2 stop: reward=5
+        L1        S[2]       | R: L2(0.3), L3(0.5) | L1
+        L2        reward     | L1
+        L3        background | L1
+
+        @run phase1, phase2
+        '''
+        responses = [random.choice(['R', 'R0']) for _ in range(200)]
+        out = step_both(self, text, responses)
+        self.assertIsNone(out[-1][0])
+        self.assertIn(['HELP', 'HELP2'], [o[3] for o in out])
+
+    def test_variables(self):
+        text = '''
+        @variables p:0.5, n:4
+        mechanism: sr
+        behaviors: R, R0
+        stimulus_elements: S, reward
+        alpha_v: 0.1
+
+        @phase phase1 stop: reward=n
+        START     S[n/2]   | R: REWARD(p) | START
+        REWARD    reward   | x=n+1, START
+
+        @run phase1
+        '''
+        responses = ['R'] * 100
+        out = step_both(self, text, responses)
+        self.assertEqual(out[0][0], {'S': 2.0})
+
+    def test_count_conditions(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward, background
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: S==50 or reward>=10
+        START     S          | R and count_line()>=2: REWARD | R0 and count(R0)=3: count_reset(R0), BG | START
+        REWARD    reward     | count_line(START)<1: BG | START
+        BG        background | BG>=2 or count(reward)>3: START | BG
+
+        @run phase1
+        '''
+        responses = [random.choice(['R', 'R0']) for _ in range(200)]
+        out = step_both(self, text, responses)
+        self.assertIsNone(out[-1][0])
+
+    def test_stop_condition_dependencies(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward, background
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: n>=4 or R0>=30
+        INIT                 | n:0, START
+        START     S          | R: n:n+1, REWARD | START
+        REWARD    reward     | count(reward)>=5: count_reset(reward), n:0, START | START
+
+        @phase phase2 stop: m>=3 and S>=4
+        INIT                 | m:0, START
+        START     S          | R: m:rand(1, 3), BG | START
+        BG        background | count(BG)>=3: count_reset(BG), count_reset(S), START | START
+
+        @phase phase3 stop: S*2>=rand(10, 20)
+        START     S          | START
+
+        @run phase1, phase2, phase3
+        '''
+        rng = random.Random(1)
+        responses = [rng.choice(['R', 'R0']) for _ in range(1000)]
+        out = step_both(self, text, responses)
+        self.assertIsNone(out[-1][0])
+        self.assertEqual({o[1] for o in out}, {'phase1', 'phase2', 'phase3'})
+
+
+class TestCompiledExpression(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_same_as_evaluate(self):
+        parameters = {'stimulus_elements': ['S', 'reward'], 'behaviors': ['R', 'R0']}
+        linelabels = ['START', 'REWARD']
+        event_counter = PhaseEventCounter(linelabels, parameters)
+        event_counter.count.update({'S': 3, 'reward': 2, 'R': 1, 'R0': 4, 'START': 3, 'REWARD': 2})
+        event_counter.count_line.update({'S': 1, 'R0': 2, 'START': 2})
+        event_counter.line_label = 'START'
+        event_counter.last_response = 'R0'
+        event_ids = {event: i for i, event in enumerate(event_counter.count)}
+        compiled_counter = CompiledEventCounter(len(event_ids))
+        for event, event_id in event_ids.items():
+            compiled_counter.count[event_id] = event_counter.count[event]
+            compiled_counter.count_line[event_id] = event_counter.count_line[event]
+        compiled_counter.last_response = 'R0'
+        global_variables = Variables({'x': 2, 'y': 0.5})
+        local_variables = Variables({'y': 1.5, 'z': 0})
+
+        exprs = ['x + y', 'x * y = 3', 'x > 1 and z', 'z or x', 'x / z', 'x + w', 'x +', 'S = 3',
+                 'S + R', 'count(R0) >= 4', 'count_line(R0) = 2 and count_line() = 2', 'R0 and START = 2',
+                 'R or count(reward) = 2', 'count(foo) = 1', '(1, 2)', 'rand(1, 1) + x']
+        for event_counter_type in [None, ParseUtil.STOP_COND, ParseUtil.PHASE_LINE]:
+            for expr in exprs:
+                variables = Variables.join(global_variables, local_variables)
+                expected = ParseUtil.evaluate(expr, variables, event_counter if event_counter_type is not None else None,
+                                              event_counter_type)
+                compiled_expr = CompiledExpression(expr, event_counter_type, event_ids, linelabels,
+                                                   parameters['behaviors'], 'START')
+                out = compiled_expr.evaluate(local_variables.values, global_variables.values,
+                                             {'rand': lambda a, b: a, 'choice': None},
+                                             compiled_counter if event_counter_type is not None else None)
+                self.assertEqual(out, expected, (event_counter_type, expr))
+
+    def test_read_counters(self):
+        event_ids = {'S': 0, 'reward': 1, 'R': 2, 'R0': 3, 'START': 4, 'REWARD': 5}
+        linelabels = ['START', 'REWARD']
+        behaviors = ['R', 'R0']
+        expr = CompiledExpression('count(S) > 1 and count_line(R) = 2 or count_line() = 1 and REWARD = 0',
+                                  ParseUtil.PHASE_LINE, event_ids, linelabels, behaviors, 'START')
+        self.assertEqual(expr.count_events, {0})
+        self.assertEqual(expr.count_line_events, {2, 4, 5})
+
+        expr = CompiledExpression('reward = 3 or R0 > x', ParseUtil.STOP_COND, event_ids)
+        self.assertEqual(expr.count_events, {1, 3})
+        self.assertEqual(expr.count_line_events, set())
+        self.assertEqual(expr.variable_names, {'x'})
+        self.assertIsNone(expr.count_comparison)
+
+    def test_count_comparison(self):
+        event_ids = {'S': 0, 'reward': 1}
+        expr = CompiledExpression('reward = 3', ParseUtil.STOP_COND, event_ids)
+        event_id, compare, value = expr.count_comparison
+        self.assertEqual((event_id, value), (1, 3))
+        self.assertTrue(compare(3, value))
+        self.assertFalse(compare(4, value))
+
+        for expr in ['reward = x', '3 < S', 'S > 1 and reward > 1', 'S < 2 < 3', 'foo = 2', 'S = True']:
+            self.assertIsNone(CompiledExpression(expr, ParseUtil.STOP_COND, event_ids).count_comparison, expr)
+        self.assertIsNone(CompiledExpression('S = 3', ParseUtil.PHASE_LINE, event_ids).count_comparison)
+
+
+class TestCompiledEventCounter(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_reset_count_line(self):
+        event_counter = CompiledEventCounter(3)
+        event_counter.increment_count(0)
+        event_counter.increment_count_line(0)
+        event_counter.increment_count_line(0)
+        event_counter.increment_count_line(1)
+        self.assertEqual(event_counter.get_count_line(0), 2)
+        self.assertEqual(event_counter.get_count_line(1), 1)
+        self.assertEqual(event_counter.get_count_line(2), 0)
+
+        event_counter.reset_count_line()
+        self.assertEqual(event_counter.get_count_line(0), 0)
+        self.assertEqual(event_counter.get_count_line(1), 0)
+        event_counter.increment_count_line(1)
+        self.assertEqual(event_counter.get_count_line(1), 1)
+        self.assertEqual(event_counter.count[0], 1)
+
+        event_counter.reset_count(0)
+        self.assertEqual(event_counter.count[0], 0)
+
+
+class TestErrors(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_no_condition_met(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: S=30
+        START     S          | R: START
+
+        @run phase1
+        '''
+        compiled_world = CompiledWorld(get_runs(text).get_last_run_obj().world)
+        compiled_world.next_stimulus(None)
+        msg = "Error on line 9: No condition in 'R: START' was met for response 'R0'."
+        with self.assertRaisesMsg(msg):
+            compiled_world.next_stimulus('R0')
+
+    def test_probabilities(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: S=30
+        START     S          | START(0.5), REWARD(0.6)
+        REWARD    reward     | START
+
+        @run phase1
+        '''
+        compiled_world = CompiledWorld(get_runs(text).get_last_run_obj().world)
+        compiled_world.next_stimulus(None)
+        msg = "Error on line 9: Sum of probabilities is 1.1>1."
+        with self.assertRaisesMsg(msg):
+            compiled_world.next_stimulus('R0')
+
+    def test_unknown_variable(self):
+        text = '''
+        mechanism: ga
+        behaviors: R, R0
+        stimulus_elements: S, reward
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase1 stop: S=30
+        START     S          | R and count(S)>n: START | START
+
+        @run phase1
+        '''
+        compiled_world = CompiledWorld(get_runs(text).get_last_run_obj().world)
+        compiled_world.next_stimulus(None)
+        msg = "Error on line 9: Unknown variable 'n'."
+        with self.assertRaisesMsg(msg):
+            compiled_world.next_stimulus('R')
@@ -0,0 +1,284 @@
+import statistics
+
+import numpy as np
+
+from .testutil import LsTestCase
+from keywords import ENGINE
+from parsing import Script
+from randomstreams import BufferedRandom, UniformBuffers
+from vectorized import sample_responses
+
+
+def parse(text):
+    script = Script(text)
+    script.parse()
+    return script.script_parser.parameters.val[ENGINE]
+
+
+def simulate(text):
+    script = Script(text)
+    script.parse()
+    return script.run().run_outputs['run1']
+
+
+def get_script(mechanism, engine, n_subjects=1, extra='', forced=True):
+    if forced:  # Only one possible response to each stimulus, and a deterministic world
+        response_requirements = "response_requirements = r1: [s1, reward], r2: s2"
+        logic_r = "A"
+    else:
+        response_requirements = ""
+        logic_r = "A(0.5), B(0.5)"
+    if mechanism == 'rw':
+        logic_a, logic_b = "B", "R"
+    else:
+        logic_a, logic_b = "r1: R | B", "r2: R | A"
+    return f'''
+    n_subjects = {n_subjects}
+    engine = {engine}
+    mechanism = {mechanism}
+    behaviors = r1, r2
+    stimulus_elements = s1, s2, reward
+    {response_requirements}
+    alpha_v = 0.1
+    alpha_w = 0.2
+    alpha_vss = 0.1
+    start_v = 0.5
+    beta = 0.8
+    mu = 0.1
+    lambda = reward:1, default:0
+    u = reward:3, default:0
+    behavior_cost = r1:0.1, default:0
+    discount = 0.9
+    {extra}
+
+    @phase phase1 stop: s1=30
+    A s1     | {logic_a}
+    B s2     | {logic_b}
+    R reward | {logic_r}
+
+    @run phase1
+    '''
+
+
+class TestParse(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_default(self):
+        text = '''
+        n_subjects: 100
+        '''
+        self.assertEqual(parse(text), 'reference')
+
+    def test_simple(self):
+        text = '''
+        engine: Vectorized
+        '''
+        self.assertEqual(parse(text), 'vectorized')
+
+    def test_error(self):
+        text = '''
+        engine: fast
+        '''
+        msg = "Error on line 2: Parameter engine must be 'reference' or 'vectorized'."
+        with self.assertRaisesMsg(msg):
+            parse(text)
+
+
+class TestSameAsReference(LsTestCase):
+    """With one possible response to each stimulus, the two engines produce the same values."""
+
+    def setUp(self):
+        pass
+
+    def assertSameOutput(self, mechanism, extra=''):
+        out_reference = simulate(get_script(mechanism, 'reference', extra=extra)).output_subjects[0]
+        out_vectorized = simulate(get_script(mechanism, 'vectorized', extra=extra)).output_subjects[0]
+
+        self.assertEqual(out_reference.history, out_vectorized.history)
+        self.assertEqual(out_reference.first_step_phase, out_vectorized.first_step_phase)
+        self.assertEqual(out_reference.phase_line_labels, out_vectorized.phase_line_labels)
+        for var in ['v', 'w', 'vss']:
+            vals_reference = getattr(out_reference, var)
+            vals_vectorized = getattr(out_vectorized, var)
+            self.assertEqual(set(vals_reference), set(vals_vectorized))
+            for key in vals_reference:
+                self.assertEqual(vals_reference[key].steps, vals_vectorized[key].steps)
+                self.assertAlmostEqualList(vals_reference[key].values, vals_vectorized[key].values)
+
+    def test_sr(self):
+        self.assertSameOutput('sr')
+        self.assertSameOutput('sr', 'trace = 0.5')
+
+    def test_ga(self):
+        self.assertSameOutput('ga')
+        self.assertSameOutput('ga', 'trace = 0.5')
+
+    def test_es(self):
+        self.assertSameOutput('es')
+
+    def test_ql(self):
+        self.assertSameOutput('ql')
+
+    def test_ac(self):
+        self.assertSameOutput('ac')
+
+    def test_rw(self):
+        self.assertSameOutput('rw')
+
+
+class TestSameRandomChoices(LsTestCase):
+    """With the same random_seed, the two engines make the same random choices."""
+
+    def setUp(self):
+        pass
+
+    def test_histories(self):
+        for mechanism in ['sr', 'ga', 'es', 'ql', 'ac']:
+            extra = 'random_seed = 11'
+            out_reference = simulate(get_script(mechanism, 'reference', n_subjects=5, extra=extra, forced=False))
+            out_vectorized = simulate(get_script(mechanism, 'vectorized', n_subjects=5, extra=extra, forced=False))
+            for subject_reference, subject_vectorized in zip(out_reference.output_subjects,
+                                                             out_vectorized.output_subjects):
+                self.assertEqual(subject_reference.history, subject_vectorized.history)
+                for key in subject_reference.v:
+                    self.assertAlmostEqualList(subject_reference.v[key].values,
+                                               subject_vectorized.v[key].values)
+
+    def test_diverging_worlds(self):
+        # Subjects at different phase lines and phases, after help lines, and ending at different steps
+        text = '''
+        random_seed = 3
+        n_subjects = 20
+        engine = {}
+        mechanism = ga
+        behaviors = r1, r2
+        stimulus_elements = s1, s2, reward
+        alpha_v = 0.1
+        alpha_w = 0.1
+        u = reward:3, default:0
+
+        @phase phase1 stop: reward=5
+        A         s1       | r1: HELP | B(0.5), A(0.5)
+        HELP               | count(s1)>=3: count_reset(s1), R | new_trial
+        new_trial          | @omit_learn, A
+        B         s2       | r2: R | A
+        R         reward   | A
+
+        @phase phase2 stop: s2=5
+        C         s1, s2   | r1: D | C(0.3), D(0.7)
+        D         s2       | C
+
+        @run phase1, phase2
+        '''
+        out_reference = simulate(text.format('reference'))
+        out_vectorized = simulate(text.format('vectorized'))
+        lengths = set()
+        for subject_reference, subject_vectorized in zip(out_reference.output_subjects,
+                                                         out_vectorized.output_subjects):
+            self.assertEqual(subject_reference.history, subject_vectorized.history)
+            self.assertEqual(subject_reference.phase_line_labels, subject_vectorized.phase_line_labels)
+            self.assertEqual(subject_reference.first_step_phase, subject_vectorized.first_step_phase)
+            for key in subject_reference.v:
+                self.assertAlmostEqualList(subject_reference.v[key].values, subject_vectorized.v[key].values)
+            lengths.add(len(subject_reference.history))
+        self.assertGreater(len(lengths), 1)
+
+    def test_compound_stimulus(self):
+        # The feasible behaviors of a compound stimulus are not in the order of the behaviors
+        text = '''
+        random_seed = 5
+        n_subjects = 20
+        engine = {}
+        mechanism = {}
+        behaviors = b1, b2, b3
+        stimulus_elements = s1, s2, s3
+        response_requirements = b1: [s2, s3], b2: [s1, s3]
+        alpha_v = 0.1
+        alpha_w = 0.1
+        {}
+        u = s3:2, default:0
+
+        @phase phase1 stop: s3=20
+        A         s1, s2   | b1: B | A
+        B         s3       | A
+
+        @run phase1
+        '''
+        for mechanism, extra in [('sr', ''), ('ga', ''), ('ga', 'trace = 0.5'), ('es', ''), ('ql', ''), ('ac', '')]:
+            out_reference = simulate(text.format('reference', mechanism, extra))
+            out_vectorized = simulate(text.format('vectorized', mechanism, extra))
+            for subject_reference, subject_vectorized in zip(out_reference.output_subjects,
+                                                             out_vectorized.output_subjects):
+                self.assertEqual(subject_reference.history, subject_vectorized.history)
+
+
+class TestStatistical(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_sr(self):
+        n_subjects = 400
+        means = list()
+        for engine in ['reference', 'vectorized']:
+            out = simulate(get_script('sr', engine, n_subjects=n_subjects, forced=False))
+            last_values = [output_subject.v[('s1', 'r1')].values[-1] for output_subject in out.output_subjects]
+            means.append(statistics.mean(last_values))
+            stdev = statistics.stdev(last_values)
+        standard_error = stdev / n_subjects**0.5
+        self.assertLess(abs(means[0] - means[1]), 6 * standard_error)
+
+    def test_jobs(self):
+        text = get_script('ga', 'vectorized', n_subjects=5, forced=False) + '''
+        @run phase1 runlabel: run2
+        jobs = 2
+        engine = reference
+        @run phase1 runlabel: run3
+        '''
+        script = Script(text)
+        script.parse()
+        script_output = script.run()
+        self.assertEqual(list(script_output.run_outputs), ['run1', 'run2', 'run3'])
+        for run_output in script_output.run_outputs.values():
+            self.assertEqual(len(run_output.output_subjects), 5)
+            for output_subject in run_output.output_subjects:
+                self.assertEqual(output_subject.first_step_phase[0], ['phase1', 'last'])
+
+
+class TestSampler(LsTestCase):
+    def test_sample_responses(self):
+        x_cumsum = np.cumsum([[1, 1, 2], [0, 3, 1], [4, 0, 0]], axis=1)
+        uniforms = np.array([0.5, 0.99, 0.0])
+        # q = [2, 3.96, 0]
+        self.assertEqual(list(sample_responses(x_cumsum, uniforms)), [1, 2, 0])
+        uniforms = np.array([0.0, 0.25, 0.75])
+        # q = [0, 1, 3]
+        self.assertEqual(list(sample_responses(x_cumsum, uniforms)), [0, 1, 0])
+
+    def test_sample_responses_infeasible(self):
+        # Behavior 0 is not feasible (and has zero support)
+        x_cumsum = np.cumsum([[0, 3, 1], [0, 0, 2], [0, 3, 1]], axis=1)
+        feasible = np.array([[False, True, True], [False, True, True], [False, True, True]])
+        uniforms = np.array([0.0, 0.0, 0.5])
+        # q = [0, 0, 2]
+        self.assertEqual(list(sample_responses(x_cumsum, uniforms, feasible)), [1, 1, 1])
+        # Without feasible, index 0 is feasible
+        self.assertEqual(list(sample_responses(x_cumsum, uniforms)), [0, 0, 1])
+
+    def test_uniform_buffers(self):
+        seeds = [11, 22, 33]
+        streams = [BufferedRandom(seed) for seed in seeds]
+        buffers = UniformBuffers(seeds, block_size=5)
+        generators = [buffers.generator(i) for i in range(len(seeds))]
+        for step in range(40):
+            ix = np.array([i for i in range(len(seeds)) if (step + i) % 3 != 0])
+            self.assertEqual(buffers.take(ix).tolist(), [streams[i].random() for i in ix])
+            i = step % len(seeds)
+            self.assertEqual(generators[i].randint(1, 6), streams[i].randint(1, 6))
+            self.assertEqual(generators[i].choice('abc'), streams[i].choice('abc'))
+
+    def test_buffered_random(self):
+        # The numbers do not depend on the block sizes
+        stream = BufferedRandom(5)
+        numbers = [stream.random() for _ in range(1000)]
+        self.assertEqual(numbers, np.random.Generator(np.random.Philox(5)).random(1000).tolist())
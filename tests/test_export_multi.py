@@ -1,7 +1,13 @@
+import csv
+import io
+
 from math import sin, cos, tan, asin, acos, atan, sinh, cosh, tanh, asinh, acosh, atanh, ceil, floor, exp, log, log10, sqrt
 import os
 import matplotlib.pyplot as plt
 
+import parsing
+from parsing import _CsvColumn, _write_csv
+
 from .testutil import LsTestCase, run, get_plot_data, create_exported_files_folder, remove_exported_files, delete_exported_files_folder, get_csv_file_contents
 
 
@@ -664,3 +670,35 @@ class TestExceptions(LsTestCase):
         msg = "Error on line 14: Expected a behavior name, got ,."
         with self.assertRaisesMsg(msg):
             run(text)
+
+
+class TestWriteCsv(LsTestCase):
+    def test_same_as_csv_writer(self):
+        header = ['x', 'a "quoted" label', 'b', 'c']
+        data = [[0.1, None, 2, -1e-20, float('inf')],
+                ['s', ('s', 'light'), 'x"y'],
+                [True, 3, 1.5, 7, 8, 9, 10]]
+
+        expected = io.StringIO()
+        w = csv.writer(expected, quotechar='"', quoting=csv.QUOTE_NONNUMERIC, escapechar=None)
+        w.writerow(header)
+        for row in range(7):
+            w.writerow([row] + [column[row] if row < len(column) else ' ' for column in data])
+
+        chunk_rows = parsing.EXPORT_CHUNK_ROWS
+        try:
+            for n in [1, 2, 3, 100]:
+                parsing.EXPORT_CHUNK_ROWS = n
+                columns = [_CsvColumn(len(column), lambda start, stop, column=column:
+                                      [parsing._csv_field(value) for value in column[start:stop]])
+                           for column in data]
+                out = io.StringIO()
+                _write_csv(out, header, columns)
+                self.assertEqual(out.getvalue(), expected.getvalue())
+        finally:
+            parsing.EXPORT_CHUNK_ROWS = chunk_rows
+
+    def test_no_rows(self):
+        out = io.StringIO()
+        _write_csv(out, ['x', 'v(s->b)'], [_CsvColumn(0, None)])
+        self.assertEqual(out.getvalue(), '"x","v(s->b)"\r\n')
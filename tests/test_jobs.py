@@ -0,0 +1,187 @@
+from .testutil import LsTestCase
+from keywords import JOBS
+from parsing import Script
+
+
+def parse(text):
+    script = Script(text)
+    script.parse()
+    return script.script_parser.parameters.val[JOBS]
+
+
+def simulate(text, jobs=None):
+    script = Script(text)
+    script.parse()
+    return script.run(jobs=jobs)
+
+
+def get_script(jobs=1, seed=None):
+    seed_line = '' if seed is None else f"random_seed = {seed}"
+    return f'''
+    {seed_line}
+    n_subjects        = 7
+    jobs              = {jobs}
+    mechanism         = ga
+    behaviors         = response, no_response
+    stimulus_elements = background, stimulus, reward
+    start_v           = -1
+    alpha_v           = 0.1
+    alpha_w           = 0.1
+    beta              = 1
+    u                 = reward:10, default:0
+
+    @PHASE training stop: stimulus=20
+    START       stimulus   | response: REWARD | NO_REWARD
+    REWARD      reward     | START
+    NO_REWARD   background | START
+
+    @run training
+    '''
+
+
+class TestParse(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_default(self):
+        text = '''
+        n_subjects: 100
+        '''
+        jobs = parse(text)
+        self.assertEqual(jobs, 1)
+
+    def test_simple(self):
+        text = '''
+        @variables n: 2
+        jobs: n * 2
+        '''
+        jobs = parse(text)
+        self.assertEqual(jobs, 4)
+
+    def test_errors(self):
+        text = '''
+        jobs: 0
+        '''
+        msg = "Error on line 2: Parameter jobs must be a positive integer."
+        with self.assertRaisesMsg(msg):
+            parse(text)
+
+        text = '''
+        jobs: 1.5
+        '''
+        msg = "Error on line 2: Parameter jobs must be a positive integer."
+        with self.assertRaisesMsg(msg):
+            parse(text)
+
+
+class TestSimulate(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_same_layout_as_serial(self):
+        out_serial = simulate(get_script(jobs=1)).run_outputs['run1']
+        out_parallel = simulate(get_script(jobs=3)).run_outputs['run1']
+        self.assertEqual(len(out_parallel.output_subjects), 7)
+        for subject_serial, subject_parallel in zip(out_serial.output_subjects, out_parallel.output_subjects):
+            self.assertEqual(set(subject_serial.v), set(subject_parallel.v))
+            self.assertEqual(set(subject_serial.w), set(subject_parallel.w))
+            self.assertEqual(subject_serial.first_step_phase, subject_parallel.first_step_phase)
+            self.assertEqual(len(subject_serial.history), len(subject_parallel.history))
+
+    def test_same_as_serial(self):
+        out_serial = simulate(get_script(jobs=1, seed=5)).run_outputs['run1']
+        out_parallel = simulate(get_script(jobs=3, seed=5)).run_outputs['run1']
+        for subject_serial, subject_parallel in zip(out_serial.output_subjects, out_parallel.output_subjects):
+            self.assertEqual(subject_serial.history, subject_parallel.history)
+            for key in subject_serial.v:
+                self.assertEqual(subject_serial.v[key].values, subject_parallel.v[key].values)
+            for key in subject_serial.w:
+                self.assertEqual(subject_serial.w[key].values, subject_parallel.w[key].values)
+
+    def test_random_world(self):
+        def script(jobs, engine):
+            return f'''
+            random_seed = 2
+            n_subjects = 4
+            jobs = {jobs}
+            engine = {engine}
+            mechanism = sr
+            behaviors = response, no_response
+            stimulus_elements = background, stimulus, reward
+            alpha_v = 0.1
+            u = reward:10, default:0
+
+            @PHASE training stop: stimulus=20
+            START       stimulus   | x:rand(1,3), response: REWARD(0.8), NO_REWARD(0.2) | NO_REWARD
+            REWARD      reward     | x=3: START | BACKGROUND
+            NO_REWARD   background | START
+            BACKGROUND  background | choice(0,1)=1: START | NO_REWARD
+
+            @run training
+            '''
+        out_serial = simulate(script(1, 'reference')).run_outputs['run1']
+        out_parallel = simulate(script(2, 'reference')).run_outputs['run1']
+        out_vectorized = simulate(script(1, 'vectorized')).run_outputs['run1']
+        for subject_serial, subject_parallel, subject_vectorized in zip(out_serial.output_subjects,
+                                                                        out_parallel.output_subjects,
+                                                                        out_vectorized.output_subjects):
+            self.assertEqual(subject_serial.history, subject_parallel.history)
+            self.assertEqual(subject_serial.history, subject_vectorized.history)
+            self.assertEqual(subject_serial.phase_line_labels, subject_vectorized.phase_line_labels)
+
+    def test_reproducible(self):
+        out1 = simulate(get_script(jobs=2, seed=3)).run_outputs['run1']
+        out2 = simulate(get_script(jobs=3, seed=3)).run_outputs['run1']
+        for subject1, subject2 in zip(out1.output_subjects, out2.output_subjects):
+            self.assertEqual(subject1.history, subject2.history)
+            for key in subject1.v:
+                self.assertEqual(subject1.v[key].values, subject2.v[key].values)
+
+    def test_override(self):
+        out1 = simulate(get_script(jobs=1, seed=3), jobs=2).run_outputs['run1']
+        out2 = simulate(get_script(jobs=4, seed=3)).run_outputs['run1']
+        for subject1, subject2 in zip(out1.output_subjects, out2.output_subjects):
+            self.assertEqual(subject1.history, subject2.history)
+
+
+class TestMultipleRuns(LsTestCase):
+    def setUp(self):
+        pass
+
+    def get_script(self, jobs):
+        return f'''
+        random_seed = 7
+        n_subjects        = 3
+        mechanism         = sr
+        behaviors         = response, no_response
+        stimulus_elements = background, stimulus, reward
+        alpha_v           = 0.1
+        beta              = 1
+        u                 = reward:10, default:0
+
+        @PHASE training stop: stimulus=20
+        START       stimulus   | response: REWARD | NO_REWARD
+        REWARD      reward     | START
+        NO_REWARD   background | START
+
+        @run training runlabel: first
+        n_subjects = 2
+        jobs = {jobs}
+        @run training runlabel: second
+        u = reward:1, default:0
+        @run training runlabel: third
+        '''
+
+    def test_runs(self):
+        out1 = simulate(self.get_script(2))
+        out2 = simulate(self.get_script(5))
+        self.assertEqual(list(out1.run_outputs), ['first', 'second', 'third'])
+        self.assertEqual(list(out2.run_outputs), ['first', 'second', 'third'])
+        self.assertEqual([len(out1.run_outputs[label].output_subjects) for label in out1.run_outputs],
+                         [3, 2, 2])
+        for label in out1.run_outputs:
+            for subject1, subject2 in zip(out1.run_outputs[label].output_subjects,
+                                          out2.run_outputs[label].output_subjects):
+                self.assertEqual(subject1.history, subject2.history)
+                for key in subject1.v:
+                    self.assertEqual(subject1.v[key].values, subject2.v[key].values)
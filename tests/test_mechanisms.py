@@ -2,6 +2,8 @@ import matplotlib.pyplot as plt
 
 from .testutil import LsTestCase
 from .testutil import run, get_plot_data, create_exported_files_folder, delete_exported_files_folder, remove_exported_files
+from parsing import Script
+import mechanism
 
 
 class TestVMechanisms(LsTestCase):
@@ -45,6 +47,110 @@ class TestVMechanisms(LsTestCase):
             run(text)
 
 
+class TestStateViews(LsTestCase):
+    def parse_mechanism(self, mechanism_name):
+        text = f'''
+        mechanism: {mechanism_name}
+        stimulus_elements: s1, s2
+        behaviors: b1, b2
+        start_v: s1->b1:1, s1->b2:2, s2->b1:3, s2->b2:4
+        start_w: s1:5, s2:6
+        start_vss: s1->s1:7, s1->s2:8, s2->s1:9, s2->s2:10
+        alpha_v: 0.1
+        alpha_w: 0.1
+        alpha_vss: 0.1
+
+        @phase phase stop:s1=10
+        L1 s1 | L2
+        L2 s2 | L1
+
+        @run phase runlabel:run1
+        '''
+        script = Script(text)
+        script.parse()
+        return script.script_parser.runs.get('run1').mechanism_obj
+
+    def test_v_w(self):
+        mechanism_obj = self.parse_mechanism('ga')
+        self.assertEqual(dict(mechanism_obj.v), {('s1', 'b1'): 1, ('s1', 'b2'): 2,
+                                                 ('s2', 'b1'): 3, ('s2', 'b2'): 4})
+        self.assertEqual(dict(mechanism_obj.w), {'s1': 5, 's2': 6})
+
+        mechanism_obj.v[('s2', 'b1')] = 0.5
+        mechanism_obj.w['s1'] = 0.25
+        self.assertEqual(mechanism_obj.v_list, [[1, 2], [0.5, 4]])
+        self.assertEqual(mechanism_obj.w_list, [0.25, 6])
+
+        mechanism_obj.learn_and_respond({'s1': 1})
+        mechanism_obj.learn_and_respond({'s2': 1})
+        mechanism_obj.subject_reset()
+        self.assertEqual(mechanism_obj.v[('s2', 'b1')], 3)
+        self.assertEqual(mechanism_obj.w['s1'], 5)
+
+        with self.assertRaises(KeyError):
+            mechanism_obj.v[('s3', 'b1')]
+
+    def test_vss(self):
+        mechanism_obj = self.parse_mechanism('rw')
+        self.assertEqual(dict(mechanism_obj.vss), {('s1', 's1'): 7, ('s1', 's2'): 8,
+                                                   ('s2', 's1'): 9, ('s2', 's2'): 10})
+        mechanism_obj.learn_and_respond({'s1': 1})
+        mechanism_obj.learn_and_respond({'s2': 1})
+        self.assertEqual(mechanism_obj.vss[('s1', 's2')], 8 + 0.1 * (0 - 8))
+        self.assertEqual(mechanism_obj.vss[('s1', 's1')], 7 - 0.1 * 7)
+        self.assertEqual(mechanism_obj.vss[('s2', 's1')], 9)
+
+
+class TestSupportVectorCache(LsTestCase):
+    def parse_mechanism(self, mechanism_name):
+        text = f'''
+        mechanism: {mechanism_name}
+        stimulus_elements: s1, s2, rew
+        behaviors: b1, b2, b3
+        response_requirements: b1:[s1, s2], b2:[s1, s2], b3:[s2, rew]
+        u: rew:1, default:0
+        beta: s1->b1:2, default:1
+        mu: s2->b3:0.5, default:0
+        alpha_v: 0.1
+        alpha_w: 0.1
+
+        @phase phase stop:s1=10
+        L1 s1 | L2
+        L2 s2 | L1
+
+        @run phase runlabel:run1
+        '''
+        script = Script(text)
+        script.parse()
+        return script.script_parser.runs.get('run1').mechanism_obj
+
+    def assertSameAsUncached(self, mechanism_obj, stimulus):
+        stimulus_ids = [(mechanism_obj.element_ind[e], intensity) for e, intensity in stimulus.items()]
+        x, feasible_behaviors = mechanism_obj._support_vector(stimulus_ids)
+        expected_x, expected_feasible_behaviors = mechanism.support_vector_static(
+            stimulus, None, mechanism_obj.behaviors, mechanism_obj.stimulus_req, mechanism_obj.parameters.get('beta'),
+            mechanism_obj.parameters.get('mu'), mechanism_obj.v)
+        self.assertEqual([mechanism_obj.behaviors[b] for b in feasible_behaviors], expected_feasible_behaviors)
+        self.assertEqual(x, expected_x)
+
+    def test_same_as_uncached(self):
+        stimuli = [{'s1': 1}, {'s2': 1}, {'s1': 1, 's2': 0.5}, {'rew': 1}, {'s2': 1, 'rew': 1}]
+        for mechanism_name in ['ga', 'sr', 'es', 'ql', 'ac']:
+            mechanism_obj = self.parse_mechanism(mechanism_name)
+            for i in range(100):
+                mechanism_obj.learn_and_respond(stimuli[i % len(stimuli)])
+                for stimulus in stimuli:
+                    self.assertSameAsUncached(mechanism_obj, stimulus)
+
+            mechanism_obj.v[('s2', 'b3')] = 10
+            for stimulus in stimuli:
+                self.assertSameAsUncached(mechanism_obj, stimulus)
+
+            mechanism_obj.subject_reset()
+            for stimulus in stimuli:
+                self.assertSameAsUncached(mechanism_obj, stimulus)
+
+
 class TestRescorlaWagner(LsTestCase):
     @classmethod
     def setUpClass(cls):
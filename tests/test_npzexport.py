@@ -0,0 +1,120 @@
+import math
+import os
+import matplotlib.pyplot as plt
+import numpy as np
+
+import npzexport
+from .testutil import LsTestCase, run, create_exported_files_folder, delete_exported_files_folder, get_csv_file_contents
+
+
+def exported_file(filename):
+    return os.path.join('.', 'tests', 'exported_files', filename)
+
+
+class TestNpzExport(LsTestCase):
+    def setUp(self):
+        create_exported_files_folder()
+
+    def tearDown(self):
+        delete_exported_files_folder()
+        plt.close('all')
+
+    def get_script(self, extension):
+        return f'''
+        n_subjects        = 3
+        mechanism         = ga
+        behaviors         = response, no_response
+        stimulus_elements = background, s, reward, light
+        start_v           = -1
+        alpha_v           = 0.1
+        alpha_w           = 0.1
+        u                 = reward:10, default:0
+
+        @phase training stop: s=20
+        START       s             | response: REWARD | NO_REWARD
+        REWARD      reward, light | @omit_learn, START
+        NO_REWARD   background    | START
+
+        @run training
+
+        subject: all
+        @hexport ./tests/exported_files/h.{extension}
+        @vexport s->response ./tests/exported_files/v.{extension}
+        @nexport s->response ./tests/exported_files/n.{extension}
+        filename = ./tests/exported_files/e.{extension}
+        @export 1/n(s->response->reward); p(s->response)
+
+        subject: average
+        @wexport s ./tests/exported_files/w.{extension}
+        '''
+
+    def test_same_as_csv(self):
+        text = self.get_script('csv') + self.get_script('npz').split('@run training')[1]
+        run(text)
+
+        for name in ['v', 'n', 'e', 'w']:
+            titles, rows = get_csv_file_contents(exported_file(name + '.csv'))
+            for mmap_mode in [None, 'r']:
+                arrays = npzexport.load(exported_file(name + '.npz'), mmap_mode)
+                data = arrays['data']
+                labels = list(arrays['labels'])
+                n_subjects = data.shape[1]
+                self.assertEqual(data.shape[2], len(rows))
+                for i in range(len(titles) - 1):
+                    label = labels[i // n_subjects]
+                    if n_subjects > 1:
+                        label += f" subject {i % n_subjects + 1}"
+                    self.assertEqual(titles[i + 1], label)
+                    for k, row in enumerate(rows):
+                        y = data[i // n_subjects, i % n_subjects, k]
+                        if row[i + 1] in ('', ' '):
+                            self.assertTrue(math.isnan(y))
+                        else:
+                            self.assertEqual(float(row[i + 1]), y)
+
+        titles, rows = get_csv_file_contents(exported_file('h.csv'))
+        for mmap_mode in [None, 'r']:
+            arrays = npzexport.load(exported_file('h.npz'), mmap_mode)
+            names = arrays['names']
+            self.assertEqual(arrays['stimulus'].shape, (3, len(rows)))
+            for j in range(3):
+                for k, row in enumerate(rows):
+                    self.assertEqual(names[arrays['stimulus'][j, k]], row[1 + 2 * j])
+                    self.assertEqual(names[arrays['response'][j, k]], row[2 + 2 * j])
+
+    def test_load(self):
+        filename = exported_file('arrays.npz')
+        data = np.arange(12.0).reshape(3, 4)
+        labels = np.array(['v(s->b)', 'w(s)'])
+        empty = np.zeros((0, 5))
+        npzexport.save(filename, data=data, labels=labels, empty=empty, scalar=np.array(3))
+
+        for mmap_mode in [None, 'r']:
+            arrays = npzexport.load(filename, mmap_mode)
+            self.assertEqual(set(arrays), {'data', 'labels', 'empty', 'scalar'})
+            np.testing.assert_array_equal(arrays['data'], data)
+            np.testing.assert_array_equal(arrays['labels'], labels)
+            self.assertEqual(arrays['empty'].shape, (0, 5))
+            self.assertEqual(arrays['scalar'], 3)
+        self.assertIsInstance(npzexport.load(filename, 'r')['data'], np.memmap)
+
+    def test_uppercase_extension(self):
+        text = '''
+        stimulus_elements = s
+        behaviors = b
+        mechanism = ga
+        alpha_v = 0.1
+        alpha_w = 0.1
+
+        @phase foo stop: s=5
+        S s | S
+
+        @run foo
+
+        @vexport s->b ./tests/exported_files/v.NPZ
+        '''
+        run(text)
+        self.assertEqual(os.listdir(os.path.join('.', 'tests', 'exported_files')), ['v.NPZ'])
+        arrays = npzexport.load(exported_file('v.NPZ'))
+        self.assertEqual(list(arrays['labels']), ['v(s->b)'])
+        self.assertEqual(arrays['data'].shape, (1, 1, 5))
@@ -0,0 +1,388 @@
+import os
+import pickle
+
+import numpy as np
+
+from .testutil import LsTestCase, create_exported_files_folder, delete_exported_files_folder
+
+from output import Val, RunOutputSubject, RunLengthSeries, History, EvalCache
+from parsing import Script
+from mechanism import support_vector_static
+
+
+class WMechanism():
+    """Has the attribute w, as a Mechanism."""
+
+    def __init__(self, w):
+        self.w = w
+
+
+class TestVal(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_evaluate(self):
+        val = Val(capacity=1)
+        for step, value in [(0, 1), (0, 2), (3, 5), (4, 6), (4, 7), (9, 8)]:
+            val.write(value, step)
+        out = val.evaluate()
+        self.assertIsInstance(out, RunLengthSeries)
+        self.assertEqual(out.tolist(), [2, 2, 2, 5, 7, 7, 7, 7, 7, 8])
+        self.assertEqual(out.values.tolist(), [2, 5, 7, 8])
+        self.assertEqual(out.starts.tolist(), [0, 3, 4, 9])
+        self.assertEqual(val.values, [1, 2, 5, 6, 7, 8])
+        self.assertEqual(val.steps, [0, 0, 3, 4, 4, 9])
+        self.assertEqual(len(val), 6)
+
+        val = Val()
+        val.write(0.5, 0)
+        self.assertEqual(val.evaluate().tolist(), [0.5])
+
+    def test_float32(self):
+        val = Val(dtype=np.float32)
+        val.write(0.1, 0)
+        val.write(0.2, 2)
+        self.assertEqual(val.evaluate().expand().dtype, np.float32)
+        self.assertAlmostEqualList(val.evaluate().tolist(), [0.1, 0.1, 0.2])
+
+    def test_pickle(self):
+        val = Val(capacity=100)
+        val.write(1.5, 0)
+        val.write(2.5, 1)
+        val = pickle.loads(pickle.dumps(val))
+        self.assertEqual(len(val._values), 2)
+        val.write(3.5, 3)
+        self.assertEqual(val.evaluate().tolist(), [1.5, 2.5, 2.5, 3.5])
+
+    def test_int_values(self):
+        # Values written as ints (such as an integer start_v) are returned as ints
+        val = Val(capacity=1)
+        for step, value in [(0, 0), (2, 0.5), (3, 1), (3, 2.5), (5, 3)]:
+            val.write(value, step)
+        self.assertEqual([type(value) for value in val.values], [int, float, int, float, int])
+        out = val.evaluate().tolist()
+        self.assertEqual(out, [0, 0, 0.5, 2.5, 2.5, 3])
+        self.assertEqual([type(value) for value in out], [int, int, float, float, float, int])
+        val = pickle.loads(pickle.dumps(val))
+        val.write(4, 6)
+        self.assertEqual([type(value) for value in val.values], [int, float, int, float, int, int])
+
+        val = Val()
+        val.write(0.0, 0)
+        self.assertIs(type(val.evaluate().tolist()[0]), float)
+
+    def test_from_arrays(self):
+        val = Val.from_arrays(np.array([1.0, 2.5]), np.array([0, 3]))
+        self.assertEqual(val.values, [1.0, 2.5])
+        self.assertEqual(val.steps, [0, 3])
+        val.write(4.0, 5)
+        self.assertEqual(val.evaluate().tolist(), [1.0, 1.0, 1.0, 2.5, 2.5, 4.0])
+
+    def test_predict_capacities(self):
+        subject1 = RunOutputSubject(None)
+        for step in range(200):
+            subject1.write_w(('e',), step, WMechanism({'e': step}))
+        subject2 = RunOutputSubject(None)
+        subject2.predict_capacities(subject1)
+        subject2.write_w(('e',), 0, WMechanism({'e': 0}))
+        self.assertEqual(len(subject2.w['e']._values), 200)
+
+
+class TestRunLengthSeries(LsTestCase):
+    def setUp(self):
+        self.series = RunLengthSeries(np.array([2., 5., 7., 8.]), np.array([0, 3, 4, 9]), 12)
+        self.expanded = [2., 2., 2., 5., 7., 7., 7., 7., 7., 8., 8., 8.]
+
+    def test_expand(self):
+        self.assertEqual(len(self.series), 12)
+        self.assertEqual(self.series.tolist(), self.expanded)
+        self.assertEqual(list(self.series), self.expanded)
+
+    def test_getitem(self):
+        for i in range(-12, 12):
+            self.assertEqual(self.series[i], self.expanded[i])
+            self.assertIs(type(self.series[i]), float)
+        with self.assertRaises(IndexError):
+            self.series[12]
+
+    def test_slice(self):
+        for start in range(13):
+            for stop in range(13):
+                self.assertEqual(self.series[start:stop].tolist(), self.expanded[start:stop])
+        self.assertEqual(self.series[1::2], self.expanded[1::2])
+
+    def test_take(self):
+        self.assertEqual(self.series.take([0, 2, 3, 4, 8, 9, 11]), [2., 2., 5., 7., 7., 8., 8.])
+
+    def test_align(self):
+        other = RunLengthSeries(np.array([1., 2.]), np.array([0, 6]), 12)
+        starts, values = RunLengthSeries.align([self.series, other])
+        self.assertEqual(starts.tolist(), [0, 3, 4, 6, 9])
+        self.assertEqual(values[0].tolist(), [2., 5., 7., 7., 8.])
+        self.assertEqual(values[1].tolist(), [1., 1., 1., 2., 2.])
+
+    def test_concatenate(self):
+        pieces = [self.series[0:1], self.series[5:5], self.series[2:10], self.series[11:12]]
+        out = RunLengthSeries.concatenate(pieces)
+        self.assertEqual(out.tolist(), self.expanded[0:1] + self.expanded[2:10] + self.expanded[11:12])
+        self.assertEqual(RunLengthSeries.concatenate([]).tolist(), [])
+
+    def test_int_values(self):
+        series = RunLengthSeries(np.array([2., 5., 7., 8.]), np.array([0, 3, 4, 9]), 12,
+                                 np.array([True, False, False, True]))
+        types = [int, int, int, float, float, float, float, float, float, int, int, int]
+        self.assertEqual([type(value) for value in series.tolist()], types)
+        self.assertEqual([type(series[i]) for i in range(12)], types)
+        self.assertEqual([type(value) for value in series[2:10].tolist()], types[2:10])
+        self.assertEqual([type(value) for value in series.take([0, 3, 11])], [int, float, int])
+        out = RunLengthSeries.concatenate([series[0:4], self.series[4:6], series[9:12]])
+        self.assertEqual(out.tolist(), self.expanded[0:4] + self.expanded[4:6] + self.expanded[9:12])
+        self.assertEqual([type(value) for value in out.tolist()], types[0:4] + [float, float] + types[9:12])
+
+
+class TestIntExport(LsTestCase):
+    def setUp(self):
+        create_exported_files_folder()
+
+    def tearDown(self):
+        delete_exported_files_folder()
+
+    def test_int_start_values(self):
+        # The values that are still the integer start values are exported as ints
+        text = '''
+        mechanism = ga
+        behaviors = b1, b2
+        stimulus_elements = s1, s2
+        response_requirements = b1: s1, b2: s2
+        start_v = 0
+        start_w = s1: 1, default: 0
+        alpha_v = 0.1
+        alpha_w = 0.1
+        u = s2: 1, default: 0
+
+        @phase phase1 stop: s1=3
+        A s1 | B
+        B s2 | A
+
+        @run phase1
+
+        subject: 1
+        @vexport s1->b1 ./tests/exported_files/v1.csv
+        @vexport s2->b1 ./tests/exported_files/v2.csv
+        @wexport s1 ./tests/exported_files/w1.csv
+        filename = ./tests/exported_files/e.csv
+        @export v(s1->b1) * 2; v(s2->b1) + 1
+        '''
+        script_obj = Script(text)
+        script_obj.parse()
+        script_obj.postproc(script_obj.run())
+
+        def rows(filename):
+            with open(os.path.join('.', 'tests', 'exported_files', filename)) as file:
+                return [line.strip() for line in file.readlines()[1:]]
+
+        self.assertEqual(rows('v1.csv')[0:2], ['0,0', '1,0.1'])
+        self.assertEqual(rows('v2.csv'), ['0,0', '1,0', '2,0', '3,0', '4,0'])
+        self.assertEqual(rows('w1.csv')[0:2], ['0,1', '1,1.0'])
+        self.assertEqual(rows('e.csv')[0:2], ['0,0,1', '1,0.2,1'])
+
+
+class TestRecording(LsTestCase):
+    def setUp(self):
+        pass
+
+    @staticmethod
+    def script(postcmds):
+        return f'''
+        n_subjects        : 3
+        mechanism         : ga
+        behaviors         : b1, b2
+        stimulus_elements : e1, e2, e3
+        alpha_v           : 0.1
+        alpha_w           : 0.1
+        random_seed       : 1
+
+        @phase phase1 stop: e1=10
+        L1 e1 | L2
+        L2 e2 | b1: L1 | L3
+        L3 e3 | L1
+
+        @phase phase2 stop: e1=5
+        L1 e1 | L2
+        L2 e2 | L1
+
+        @run phase1, phase2
+        {postcmds}
+        '''
+
+    def test_recorded_keys(self):
+        script_obj = Script(self.script("@vplot e1->b1\n@pplot e2->b2\n@wplot e3"))
+        script_obj.parse()
+        output_subject = script_obj.run(record_all=False).run_outputs['run1'].output_subjects[0]
+        self.assertEqual(set(output_subject.v), {('e1', 'b1'), ('e2', 'b1'), ('e2', 'b2')})
+        self.assertEqual(set(output_subject.w), {'e3'})
+        self.assertEqual(output_subject.history_codes, [])
+        self.assertEqual(output_subject.first_step_phase[0], ['phase1', 'phase2', 'last'])
+
+    def test_recorded_subjects_and_history(self):
+        script_obj = Script(self.script("subject: 2\n@vplot e1->b1\nsubject: 3\n@nplot e1"))
+        script_obj.parse()
+        output_subjects = script_obj.run(record_all=False).run_outputs['run1'].output_subjects
+        self.assertEqual([set(output_subject.v) for output_subject in output_subjects],
+                         [set(), {('e1', 'b1')}, {('e1', 'b1')}])
+        for output_subject in output_subjects:
+            self.assertGreater(len(output_subject.history_codes), 0)
+
+        script_obj = Script(self.script("phases: phase2\n@vplot e1->b1"))
+        script_obj.parse()
+        output_subjects = script_obj.run(record_all=False).run_outputs['run1'].output_subjects
+        self.assertEqual([set(output_subject.v) for output_subject in output_subjects], [{('e1', 'b1')}] * 3)
+
+    def test_same_as_record_all(self):
+        postcmds = ["phases: phase2\n@vplot e1->b1", "subject: all\n@pplot e2->b1",
+                    "xscale: e1\n@plot v(e2->b2) + w(e3)", "subject: 1\nxscale: L2\n@wplot e2"]
+        for postcmd in postcmds:
+            ydatas = list()
+            for record_all in [False, True]:
+                script_obj = Script(self.script(f"@figure\n{postcmd}"))
+                script_obj.parse()
+                script_output = script_obj.run(record_all=record_all)
+                script_obj.postproc(script_output)
+                ydatas.append(script_obj.script_parser.postcmds.cmds[-1].ydata_list)
+            self.assertEqual(ydatas[0], ydatas[1])
+
+
+class TestHistory(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_write(self):
+        history = History(capacity=1)
+        for step in range(10):
+            history.write(step, 100 + step)
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history.stimulus_codes.dtype, np.uint16)
+        self.assertEqual(history.codes().tolist()[0:6], [0, 100, 1, 101, 2, 102])
+        self.assertEqual(history.codes(8, 20).tolist(), [8, 108, 9, 109])
+        self.assertEqual(history.codes(3, 2).tolist(), [])
+
+    def test_large_codes(self):
+        history = History()
+        history.write(1, 2)
+        history.write(100000, 3)
+        self.assertEqual(history.stimulus_codes.dtype, np.int32)
+        self.assertEqual(history.codes().tolist(), [1, 2, 100000, 3])
+
+    def test_from_codes(self):
+        history = History.from_codes(np.array([1, 3]), np.array([2, 4]))
+        self.assertEqual(history.stimulus_codes.dtype, np.uint16)
+        self.assertEqual(history.codes().tolist(), [1, 2, 3, 4])
+        history = History.from_codes(np.array([1, 100000]), np.array([2, 3]))
+        self.assertEqual(history.stimulus_codes.dtype, np.int32)
+        self.assertEqual(history.codes().tolist(), [1, 2, 100000, 3])
+        self.assertEqual(len(History.from_codes(np.array([], dtype=int), np.array([], dtype=int))), 0)
+
+    def test_pickle(self):
+        history = History(capacity=100)
+        history = pickle.loads(pickle.dumps(history))
+        history.write(1, 2)
+        history = pickle.loads(pickle.dumps(history))
+        self.assertEqual(len(history._stimulus_codes), 1)
+        history.write(3, 4)
+        self.assertEqual(history.codes().tolist(), [1, 2, 3, 4])
+
+    def test_output_subject(self):
+        output_subject = RunOutputSubject(None)
+        output_subject.write_history({'e1': 1}, 'b1')
+        output_subject.write_history({'e1': 1, 'e2': 1, 'e3': 0}, 'b2')
+        self.assertEqual(output_subject.history, ['e1', 'b1', ('e1', 'e2'), 'b2'])
+
+
+class TestPhaseIndex(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_ranges(self):
+        script_obj = Script(TestRecording.script(""))
+        script_obj.parse()
+        output_subject = script_obj.run().run_outputs['run1'].output_subjects[0]
+        phase_index = output_subject.phase_index
+        self.assertIs(output_subject.phase_index, phase_index)
+        self.assertEqual(phase_index.run_phases, ['phase1', 'phase2'])
+
+        first_steps = output_subject.first_step_phase[1]
+        self.assertEqual(phase_index.step_ranges['phase1'], (0, first_steps[1] - 1))
+        self.assertEqual(phase_index.step_ranges['phase2'], (first_steps[1] - 1, first_steps[2] - 1))
+
+        label_startind, label_endind = phase_index.label_ranges['phase2']
+        self.assertEqual(label_endind, len(output_subject.phase_line_labels_steps))
+        self.assertEqual(output_subject.phase_line_labels_steps[label_startind], first_steps[1])
+        self.assertEqual(output_subject.phase_line_labels_steps[label_startind - 1], first_steps[1] - 1)
+
+
+class TestPEval(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_same_as_support_vector(self):
+        text = TestRecording.script("").replace("stimulus_elements : e1, e2, e3",
+                                                "stimulus_elements : e1, e2, e3\n"
+                                                "        response_requirements : b2: [e2, e3]")
+        script_obj = Script(text)
+        script_obj.parse()
+        output_subject = script_obj.run().run_outputs['run1'].output_subjects[0]
+        run_parameters = script_obj.script_parser.runs.get('run1').mechanism_obj.parameters
+        beta, mu = run_parameters.get('beta'), run_parameters.get('mu')
+
+        for stimulus, behavior in [({'e1': 1}, 'b1'), ({'e2': 1, 'e3': 0.5}, 'b2'), ({'e2': 1, 'e1': 0}, 'b1')]:
+            p = output_subject.p_eval(stimulus, behavior, None, run_parameters)
+            self.assertIsInstance(p, RunLengthSeries)
+            v_steps = {key: val.evaluate().tolist() for key, val in output_subject.v.items()}
+            for step, p_step in enumerate(p.tolist()):
+                nonzero_stimulus = {e: i for e, i in stimulus.items() if i != 0}
+                v = {key: values[step] for key, values in v_steps.items()}
+                x, feasible_behaviors = support_vector_static(nonzero_stimulus, None, ['b1', 'b2'],
+                                                              output_subject.stimulus_req, beta, mu, v)
+                self.assertAlmostEqual(p_step, x[feasible_behaviors.index(behavior)] / sum(x), 12)
+
+
+class TestEvalCache(LsTestCase):
+    def setUp(self):
+        pass
+
+    def test_eviction(self):
+        cache = EvalCache(max_size=5)
+        cache.put('a', [1, 2])
+        cache.put('b', [[3], [4]])
+        self.assertEqual(cache.get('a'), [1, 2])
+        cache.put('c', [5, 6])  # Evicts 'b', the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), [1, 2])
+        self.assertEqual(cache.get('c'), [5, 6])
+        self.assertEqual(cache.size, 4)
+        cache.put('d', list(range(6)))  # Too large to cache
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_shared_between_commands(self):
+        text = TestRecording.script("""
+        @figure
+        @vplot e1->b1
+        @plot v(e1->b1) + v(e2->b1)
+        @pplot e2->b1
+        phases: phase2
+        @vplot e1->b1
+        @pplot e2->b1
+        """)
+        script_obj = Script(text)
+        script_obj.parse()
+        script_output = script_obj.run()
+        script_obj.postproc(script_output)
+        cache = script_output.eval_cache
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+        cmds = script_obj.script_parser.postcmds.cmds
+        self.assertNotEqual(len(cmds[1].ydata_list[0]), len(cmds[4].ydata_list[0]))
+
+        # The cached values are used when post-processing again
+        script_obj.postproc(script_output)
+        self.assertEqual((cache.hits, cache.misses), (7, 5))
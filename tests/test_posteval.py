@@ -0,0 +1,123 @@
+import math
+import random
+import unittest
+
+from posteval import parse_postexpr
+from parsing import POST_MATH
+from variables import Variables
+
+
+class SimulationData():
+    '''
+    Stand-in for ScriptOutput that returns fixed values for each post variable.
+    '''
+    def __init__(self, values):
+        self.values = values  # Keyed by (fn, arg)
+
+    def vwpn_eval(self, vwpn, expr, parameters, run_parameters):
+        return self.values[(vwpn, expr)]
+
+
+class TestPostExpr(unittest.TestCase):
+    def evaluate(self, expr, values, variables=None):
+        variables = variables or Variables()
+        post_expr, err = parse_postexpr(expr, variables, POST_MATH)
+        self.assertIsNone(err)
+        for post_var in post_expr.post_vars.values():
+            post_var.parsed_arg = post_var.arg
+        simulation_data = SimulationData(values)
+        ydata, err = post_expr.eval(simulation_data, dict(), dict(), variables, POST_MATH)
+        points = None
+        if not any(type(val[0]) is list for val in values.values()):
+            var_ydata = {alias: values[(post_var.fn, post_var.arg)]
+                         for alias, post_var in post_expr.post_vars.items()}
+            points = post_expr._eval_points(var_ydata, variables, POST_MATH)
+        return ydata, err, points
+
+    def test_same_as_per_point(self):
+        random.seed(1)
+        v = [random.uniform(-2, 2) for _ in range(200)]
+        w = [random.uniform(-2, 2) for _ in range(200)]
+        n = [random.randint(0, 5) for _ in range(200)]
+        values = {('v', 's->b'): v, ('w', 's'): w, ('n', 's->b->s'): n}
+        exprs = ["v(s->b) + 2*w(s) / sin(n(s->b->s))",
+                 "-v(s->b) * n(s->b->s) - 3",
+                 "sqrt(v(s->b)) + log(w(s)) + log(n(s->b->s), 2)",
+                 "asin(v(s->b)) + acosh(w(s)) + atanh(v(s->b) / 3)",
+                 "ceil(v(s->b)) + floor(w(s)) + round(v(s->b)) + round(w(s), 1)",
+                 "exp(n(s->b->s)) + log10(n(s->b->s)) / w(s) ** 2",
+                 "n(s->b->s) ** 3 + n(s->b->s) ** -1"]
+        for expr in exprs:
+            ydata, err, points = self.evaluate(expr, values)
+            self.assertIsNone(err)
+            self.assertEqual(len(ydata), len(points))
+            for y, p in zip(ydata, points):
+                if p is None:
+                    self.assertIsNone(y)
+                else:
+                    self.assertAlmostEqual(y, p)
+                    self.assertIs(type(y), type(p))
+
+    def test_divide_by_zero(self):
+        ydata, err, _ = self.evaluate("1 / n(s->b->s)", {('n', 's->b->s'): [0, 1, 2, 0, 4]})
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [None, 1, 0.5, None, 0.25])
+
+        ydata, err, _ = self.evaluate("v(s->b) / (v(s->b) - 1)", {('v', 's->b'): [1.0, 2.0]})
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [None, 2.0])
+
+    def test_all_failed(self):
+        ydata, err, _ = self.evaluate("sqrt(v(s->b))", {('v', 's->b'): [-1.0, -2.0]})
+        self.assertIsNone(ydata)
+        self.assertEqual(err, "Expression evaluation failed.")
+
+    def test_int_result(self):
+        ydata, err, _ = self.evaluate("n(s->b->s) * 2 + x", {('n', 's->b->s'): [0, 1, 2]},
+                                      Variables({'x': 1}))
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [1, 3, 5])
+        for y in ydata:
+            self.assertIs(type(y), int)
+
+        # Python int does not overflow
+        ydata, err, _ = self.evaluate("n(s->b->s) ** 30", {('n', 's->b->s'): [0, 10]})
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [0, 10 ** 30])
+
+    def test_all_subjects(self):
+        values = {('v', 's->b'): [[1.0, 2.0], [3.0, 4.0]], ('w', 's'): [[0.0, 1.0], [2.0, 2.0]]}
+        ydata, err, _ = self.evaluate("v(s->b) / w(s)", values)
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [[None, 2.0], [1.5, 2.0]])
+
+        ydata, err, _ = self.evaluate("v(s->b)", values)
+        self.assertIsNone(err)
+        self.assertEqual(ydata, [[1.0, 2.0], [3.0, 4.0]])
+
+    def test_same_as_per_point_edge_cases(self):
+        values = {('v', 's->b'): [10.0, 1e200, -1.0, 0.0, 2.675, 2.5, 1e19],
+                  ('n', 's->b->s'): [0, 1, 2, 3, 10 ** 9, 4, 5]}
+        exprs = ["v(s->b) * 1e308",  # inf, not None
+                 "-v(s->b) * 1e308 + 1 / v(s->b)",
+                 "exp(v(s->b))",  # OverflowError in math.exp
+                 "v(s->b) ** 2",  # OverflowError for floats
+                 "sqrt(v(s->b)) + log(v(s->b))",
+                 "round(v(s->b), 2) + round(v(s->b))",
+                 "ceil(v(s->b)) + floor(v(s->b) * 1e300)",
+                 "n(s->b->s) * n(s->b->s) * n(s->b->s)",  # Overflows int64
+                 "n(s->b->s) ** -1 + 1 / n(s->b->s)"]
+        for expr in exprs:
+            ydata, err, points = self.evaluate(expr, values)
+            self.assertEqual(len(ydata), len(points))
+            for y, p in zip(ydata, points):
+                self.assertIs(type(y), type(p), expr)
+                if type(p) is float and math.isfinite(p):
+                    self.assertAlmostEqual(y, p, msg=expr)
+                else:
+                    self.assertEqual(y, p, expr)
+
+        ydata, _, _ = self.evaluate("v(s->b) * 1e308", values)
+        self.assertEqual(ydata[:2], [float('inf'), float('inf')])
+        ydata, _, _ = self.evaluate("round(v(s->b), 2)", values)
+        self.assertEqual(ydata[4], 2.67)
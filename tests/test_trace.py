@@ -1,6 +1,10 @@
+import os
+
 import matplotlib.pyplot as plt
 
-from .testutil import LsTestCase, run, get_plot_data
+from .testutil import (LsTestCase, run, get_plot_data, create_exported_files_folder,
+                       delete_exported_files_folder, get_csv_file_contents)
+from parsing import Script
 
 
 class TestBasic(LsTestCase):
@@ -429,3 +433,140 @@ runlabel:ga0.5
                 self.assertLess(abs(sr_y_last - ga_y_last), 0.1)
             else:
                 self.assertLess(abs(sr_y_last - ga_y_last), 0.015)
+
+
+class TestActiveSet(LsTestCase):
+    def setUp(self):
+        pass
+
+    def parse_mechanism(self, trace):
+        text = f'''
+        mechanism: sr
+        behaviors: response, no_response
+        stimulus_elements: s1, s2, s3, reward
+        alpha_v: 0.1
+        u: reward:10, default:0
+        trace: {trace}
+
+        @phase phase stop: s1=10
+        L1 s1 | L1
+
+        @run phase runlabel:run1
+        '''
+        script = Script(text)
+        script.parse()
+        return script.script_parser.runs.get('run1').mechanism_obj
+
+    def test_decayed_elements_removed(self):
+        mechanism_obj = self.parse_mechanism(0.5)
+        s1, s2 = mechanism_obj.element_ind['s1'], mechanism_obj.element_ind['s2']
+
+        mechanism_obj.learn_and_respond({'s1': 1})
+        mechanism_obj.learn_and_respond({'s2': 2})
+        self.assertEqual(mechanism_obj.stimulus_intensities, {s1: 0.5, s2: 2})
+        # All elements are written the first time a response is learned, see _trace_floats
+        self.assertEqual(mechanism_obj.trace_v_elements, ['s1', 's2', 's3', 'reward'])
+
+        for _ in range(100):
+            mechanism_obj.learn_and_respond({'s2': 1})
+        self.assertEqual(mechanism_obj.stimulus_intensities, {s2: 2})
+        self.assertEqual(mechanism_obj.trace_v_elements, ['s2'])
+
+        mechanism_obj.subject_reset()
+        self.assertEqual(mechanism_obj.stimulus_intensities, dict())
+        self.assertEqual(mechanism_obj.trace_v_elements, list())
+
+    def test_written_elements(self):
+        script = '''
+mechanism         : sr
+behaviors         : response, no_response
+stimulus_elements : s1, s2, s3, reward
+alpha_v           : 0.1
+u                 : reward:10, default:0
+trace             : 0.1
+random_seed       : 1
+
+@PHASE training stop: s1=20
+S1     s1     | S2
+S2     s2     | response: REWARD | S1
+REWARD reward | S1
+
+@run training
+'''
+        script_obj, script_output = run(script)
+        output_subject = script_output.run_outputs['run1'].output_subjects[0]
+
+        # v(s3->response) is only written at the first and last step, and when each response is
+        # learned the first time (see Mechanism._trace_floats)
+        for key in [('s3', 'response'), ('s3', 'no_response')]:
+            self.assertLessEqual(len(output_subject.v[key].steps), 4)
+            self.assertEqual(output_subject.v[key].steps[0], 0)
+        self.assertGreater(len(output_subject.v[('s1', 'response')].steps), 10)
+
+    def test_same_export_as_writing_all_elements(self):
+        # v was written for all elements in each step, before only the active elements were. The
+        # exported rows are the same (up to rounding), with the same ints and floats.
+        script = '''
+mechanism         : ga
+behaviors         : b1, b2
+stimulus_elements : s1, s2, s3, reward
+response_requirements: b1: [s1, s3], b2: [s2, reward]
+alpha_v           : 0.1
+alpha_w           : 0.1
+u                 : reward:3, default:0
+trace             : 0.1
+
+@phase phase1 stop: s1=2
+A s1     | R
+R reward | A
+
+@phase phase2 stop: s2=14
+B s2     | B
+
+@phase phase3 stop: s1=2
+C s1, s3 | D
+D reward | C
+
+@run phase1, phase2, phase3
+
+subject: 1
+@vexport s1->b1 ./tests/exported_files/v1.csv
+@vexport s3->b1 ./tests/exported_files/v2.csv
+@vexport reward->b2 ./tests/exported_files/v3.csv
+@wexport s2 ./tests/exported_files/w.csv
+'''
+        # The exported values when all elements were written (v1, v2, v3 and w in each row)
+        expected_rows = [
+            ('0', '0', '0', '0'),
+            ('0.30000000000000004', '0.0', '0', '0'),
+            ('0.30000000000000004', '0.0', '0.030000000000000006', '0'),
+            ('0.30000000000000004', '0.0', '0.030000000000000006', '0'),
+            ('0.30000000000000004', '0.0', '0.029999397000000008', '-0.0030842700000000005'),
+            ('0.30000000000000004', '0.0', '0.02999908918221151', '-0.0033892632482820303'),
+            ('0.30000000000000004', '0.0', '0.029999059657158048', '-0.0033820801581083888'),
+            ('0.30000000000000004', '0.0', '0.02999905708175919', '-0.0033437950699377605'),
+            ('0.30000000000000004', '0.0', '0.02999905685990081', '-0.0033028605273055373'),
+            ('0.30000000000000004', '0.0', '0.029999056840863923', '-0.0032621191539641626'),
+            ('0.30000000000000004', '0.0', '0.029999056839236007', '-0.0032218495456942655'),
+            ('0.30000000000000004', '0.0', '0.02999905683909734', '-0.0031820739720928933'),
+            ('0.30000000000000004', '0.0', '0.029999056839085582', '-0.0031427891429060776'),
+            ('0.30000000000000004', '0.0', '0.02999905683908459', '-0.003103989280410359'),
+            ('0.30000000000000004', '0.0', '0.029999056839084506', '-0.003065668425443207'),
+            ('0.30000000000000004', '0.0', '0.0299990568390845', '-0.003027820667139052'),
+            ('0.30000000000000004', '0.0', '0.0299990568390845', '-0.0029904401650790715'),
+            ('0.30000000000000004', '0.0', '0.0299990568390845', '-0.0029904401650790715'),
+            ('0.572696888106605', '0.27269688810660464', '0.0299990568390845', '-0.0029904401650790715'),
+            ('0.572696888106605', '0.27269688810660464', '0.11170865675640185', '0.02810346470328'),
+        ]
+        create_exported_files_folder()
+        try:
+            run(script)
+            for column, filename in enumerate(['v1.csv', 'v2.csv', 'v3.csv', 'w.csv']):
+                _, data_rows = get_csv_file_contents(os.path.join('.', 'tests', 'exported_files', filename))
+                self.assertEqual([row[0] for row in data_rows], [str(x) for x in range(len(expected_rows))])
+                for row, expected_row in zip(data_rows, expected_rows):
+                    value, expected = row[1], expected_row[column]
+                    self.assertEqual('.' in value, '.' in expected)
+                    self.assertAlmostEqual(float(value), float(expected), places=12)
+        finally:
+            delete_exported_files_folder()
@@ -1,6 +1,10 @@
+import random
 import unittest
 
+import numpy as np
+
 import util
+from symbols import SymbolTable
 
 
 class TestUtil(unittest.TestCase):
@@ -130,6 +134,51 @@ class TestUtil(unittest.TestCase):
                'no_response']
         self._test_find_and_cumsum_seq(seq)
 
+    def test_find_and_cumsum_codes(self):
+        seq = ['a', 'b', ('a', 'b', 'c'), 'a', ('a',), ('a', 'b'), 'b', ('b', 'a'),
+               ('a', 'b', 'c', 'd'), 'aa', 'bb', ('aa', 'bb', 'cc'), 'cc']
+        symbols = SymbolTable()
+        codes = [symbols.code(s) for s in seq]
+        self.assertEqual(symbols.decode(codes), seq)
+
+        patterns = ['a', 'c', 'x', ('a',), ('a', 'b'), ('b', 'a'), ('c', 'a', 'b'), ('x',),
+                    ['a', 'b'], ['b', ('a', 'b')], [('a', 'b'), 'a'], ['bb', ('aa', 'bb')],
+                    seq[2:6], seq]
+        for pattern in patterns:
+            for use_exact_match in [True, False]:
+                expected = util.find_and_cumsum(seq, pattern, use_exact_match)
+                match_sets = symbols.match_sets(pattern, use_exact_match)
+                self.assertEqual(util.find_and_cumsum_codes(codes, match_sets), expected)
+
+                expected = util.find_and_cumsum_interval(seq, pattern, use_exact_match, 'b', False)
+                interval_match_sets = symbols.match_sets('b', False)
+                self.assertEqual(util.find_and_cumsum_interval_codes(codes, match_sets, interval_match_sets),
+                                 expected)
+
+    def test_eval_average(self):
+        self.assertEqual(util.eval_average([[1, 2, 3], [3], [2, 4]]), [2.0, 3.0, 3.0])
+        self.assertEqual(util.eval_average([[0.1, 0.2]]), [0.1, 0.2])
+        self.assertEqual(util.eval_average([[], []]), [])
+
+        rng = random.Random(1)
+        datas = [[rng.random() for _ in range(rng.randrange(50))] for _ in range(20)]
+        for ind, average in enumerate(util.eval_average(datas)):
+            values = [data[ind] for data in datas if ind < len(data)]
+            self.assertEqual(average, sum(values) / len(values))
+
+    def test_find_and_cumsum_codes_random(self):
+        rng = random.Random(1)
+        for seq_len in [0, 1, 2, 5, 100]:
+            seq = np.array([rng.randrange(6) for _ in range(seq_len)], dtype=np.uint16)
+            for pattern_len in [1, 2, 3]:
+                match_sets = [{rng.randrange(8) for _ in range(2)} for _ in range(pattern_len)]
+                expected_findind = [int(i + pattern_len <= seq_len and
+                                        all(seq[i + j] in match_sets[j] for j in range(pattern_len)))
+                                    for i in range(seq_len)]
+                findind, cumsum = util.find_and_cumsum_codes(seq, match_sets)
+                self.assertEqual(findind, expected_findind)
+                self.assertEqual(cumsum, util.cumsum(expected_findind))
+
     def _test_find_and_cumsum_seq(self, seq):
         for patternlen in range(1, len(seq) + 1):
             for i in range(0, len(seq) + 1 - patternlen):
@@ -4,8 +4,12 @@ import re
 import random
 import os
 import sys
+from functools import partial
+
+import numpy as np
 
 from exceptions import ParseException, EvalException
+from symbols import SymbolTable
 
 
 SILENT = False
@@ -20,17 +24,17 @@ if IS_TEST:
 SEMICOLON_ERR = "Cannot use semicolon-separated expressions with wildcard."
 
 
-def rand(start, stop):
+def rand(start, stop, rng=random):
     if not type(start) is int:
         raise Exception("First argument to 'rand' must be integer.")
     if not type(stop) is int:
         raise Exception("Second argument to 'rand' must be integer.")
     if start > stop:
         raise Exception("The first argument to 'rand' must be less than or equal to the second argument.")
-    return random.randint(start, stop)
+    return rng.randint(start, stop)
 
 
-def choice(*args):
+def choice(*args, rng=random):
     def _is_numeric_iter(vec):
         return all(isinstance(x, (int, float)) for x in vec)
 
@@ -39,10 +43,10 @@ def choice(*args):
         if not _is_numeric_iter(population):
             raise Exception(ERRMSG)
         if weights is None:
-            return random.choice(population)
+            return rng.choice(population)
         if not _is_numeric_iter(weights):
             raise Exception(ERRMSG)
-        return random.choices(population=population, weights=weights, k=1)[0]
+        return rng.choices(population=population, weights=weights, k=1)[0]
 
     ERRMSG = "Invalid arguments to choice."
     nargs = len(args)
@@ -64,6 +68,17 @@ def choice(*args):
         else:
             return _choice_float(population=args)
 
+def random_functions(rng=None):
+    """
+    Return the functions rand and choice available in expressions, drawing from the random
+    generator rng (the global one if rng is None).
+    """
+    if rng is None:
+        return {'rand': rand, 'choice': choice}
+    else:
+        return {'rand': partial(rand, rng=rng), 'choice': partial(choice, rng=rng)}
+
+
 def count(event_counter, event):
     return event_counter.count[event]
 
@@ -278,10 +293,12 @@ class ParseUtil():
         return behavior_context
 
     @staticmethod
-    def evaluate(expr, variables=None, phase_event_counter=None, phase_event_counter_type=None):
+    def evaluate(expr, variables=None, phase_event_counter=None, phase_event_counter_type=None,
+                 rng=None):
         """
         Evaluate the specified expression using the specified Variables and PhaseEventCounter
-        objects.
+        objects. rand() and choice() in the expression use the random generator rng (the global
+        one if rng is None).
 
         Returns evaluated_value, error
         """
@@ -289,7 +306,7 @@ class ParseUtil():
 
         expr = ParseUtil._single2double_eq(expr)
 
-        context = {'rand': rand, 'choice': choice}
+        context = random_functions(rng)
         if variables is not None:
             context.update(variables.values)
 
@@ -1179,22 +1196,19 @@ def parse_sso(string):
 
 
 def eval_average(datas):
-    '''data is a list of float-lists (of different lengths).'''
-    ndata = len(datas)
-    data_lengths = [0] * ndata
-    for i, data in enumerate(datas):
-        data_lengths[i] = len(data)
-    maxlen = max(data_lengths)
-    sumpoints = [0] * maxlen
-    npoints = [0] * maxlen
-    for ind in range(maxlen):
-        for i in range(ndata):
-            if ind < data_lengths[i]:
-                sumpoints[ind] += datas[i][ind]
-                npoints[ind] += 1
-    for ind in range(maxlen):
-        sumpoints[ind] /= npoints[ind]
-    return sumpoints
+    '''
+    data is a list of float-lists (of different lengths). The average at each index is over the
+    lists that are long enough. The lists are added one at a time to a sum array, so that only
+    one list at a time is held as an array (and the sums are the same as when adding in a loop).
+    '''
+    maxlen = max(len(data) for data in datas)
+    sumpoints = np.zeros(maxlen)
+    npoints = np.zeros(maxlen, dtype=np.int64)
+    for data in datas:
+        data_len = len(data)
+        sumpoints[:data_len] += np.asarray(data, dtype=np.float64)
+        npoints[:data_len] += 1
+    return (sumpoints / npoints).tolist()
 
 
 def dict_of_list_ind(d, ind):
@@ -1212,70 +1226,10 @@ def find_and_cumsum(seq, pattern, use_exact_match):
     pattern is a string, a tuple of strings or a list of strings and tuples of strings.
     If use_exact_match is false, count also part of tuples as match.
     '''
-    def _is_match(seq, pattern, use_exact_match):
-        for i in range(len(seq)):
-            if not _is_match_local(seq[i], pattern[i], use_exact_match):
-                return False
-        return True
-
-    def _is_match_local(st, pattern, use_exact_match):
-        st_type = type(st)
-        pattern_type = type(pattern)
-        if pattern_type is tuple:
-            if st_type is tuple:
-                if use_exact_match:
-                    return set(st) == set(pattern)
-                else:
-                    return set(pattern).issubset(set(st))
-            else:
-                return False
-        else:
-            if st_type is tuple:
-                if use_exact_match:
-                    return False
-                else:
-                    return pattern in st
-            else:
-                return pattern == st
-
     assert(type(seq) == list)
-    for s in seq:
-        s_type = type(s)
-        assert((s_type is str) or (s_type is tuple) or (s is None))
-
-    pattern_type = type(pattern)
-    assert((pattern_type is list) or (pattern_type is tuple) or (pattern_type is str))
-    pattern_len = 1
-    if pattern_type is tuple:
-        for p in pattern:
-            assert(type(p) is str)
-        pattern_list = [pattern]
-    elif pattern_type is list:
-        pattern_len = len(pattern)
-        for p in pattern:
-            assert((type(p) is str) or (type(p) is tuple))
-        pattern_list = pattern
-    else:  # pattern_type is str
-        pattern_list = [pattern]
-
-    seq_len = len(seq)
-
-    findind = [0] * seq_len
-    cumsum_out = [None] * seq_len
-    cumsum_curr = 0
-    # pattern_is_tuple = (pattern_type is tuple)
-    for i in range(seq_len - pattern_len + 1):
-        seqpart = seq[i: (i + pattern_len)]
-        if _is_match(seqpart, pattern_list, use_exact_match):  # , pattern_is_tuple):
-            findind[i] = 1
-            cumsum_curr += 1
-        cumsum_out[i] = cumsum_curr
-    # The last indices for which the pattern is too long will be counted as no match:
-    for i in range(seq_len - pattern_len + 1, seq_len):
-        findind[i] = 0
-        cumsum_out[i] = cumsum_curr
-
-    return findind, cumsum_out
+    symbols = SymbolTable()
+    codes = [symbols.code(s) for s in seq]
+    return find_and_cumsum_codes(codes, symbols.match_sets(pattern, use_exact_match))
 
 
 def find_and_cumsum_interval(seq, pattern, use_exact_match,
@@ -1288,16 +1242,53 @@ def find_and_cumsum_interval(seq, pattern, use_exact_match,
         find_and_cumsum_interval(['a','b','a','X','b','a','X','X'], 'a', True, 'X', True)
         returns [2, 1, 0], [2, 3, 3]
     """
-    ind_seq, _ = find_and_cumsum(seq, pattern, use_exact_match)
-    ind_int, _ = find_and_cumsum(seq, interval_pattern, interval_pattern_exact)
-    cnt = 0
-    out = list()
-    for i in range(len(ind_seq)):
-        if ind_int[i] == 1:
-            out.append(cnt)
-            cnt = 0
-        cnt += ind_seq[i]
-    return out, cumsum(out)
+    symbols = SymbolTable()
+    codes = [symbols.code(s) for s in seq]
+    return find_and_cumsum_interval_codes(codes, symbols.match_sets(pattern, use_exact_match),
+                                          symbols.match_sets(interval_pattern, interval_pattern_exact))
+
+
+def find_and_cumsum_codes(seq, match_sets):
+    '''
+    Same as find_and_cumsum, for seq a list (or NumPy array) of integer codes (see
+    symbols.SymbolTable) and the pattern given by match_sets, a list with the set of matching
+    codes for each pattern item (see SymbolTable.match_sets).
+    '''
+    findind = _find_codes(seq, match_sets)
+    return findind.tolist(), np.cumsum(findind).tolist()
+
+
+def find_and_cumsum_interval_codes(seq, match_sets, interval_match_sets):
+    """Same as find_and_cumsum_interval, for integer codes as in find_and_cumsum_codes."""
+    ind_seq = _find_codes(seq, match_sets)
+    ind_int = _find_codes(seq, interval_match_sets)
+
+    # The number of matches before each interval match, and the differences between them
+    n_before = np.concatenate(([0], np.cumsum(ind_seq)))[np.flatnonzero(ind_int)]
+    out = np.diff(n_before, prepend=0)
+    return out.tolist(), n_before.tolist()
+
+
+def _find_codes(seq, match_sets):
+    """
+    The findind of find_and_cumsum_codes, as a NumPy array: for each item in the pattern, the
+    positions in seq with a matching code are looked up in a boolean table indexed by code, and
+    the pattern matches at position i if item j matches at position i+j for each j.
+    """
+    seq = np.asarray(seq, dtype=np.int64)
+    seq_len = len(seq)
+    n_starts = seq_len - len(match_sets) + 1  # Positions where the pattern fits
+    is_match = np.zeros(seq_len, dtype=bool)
+    if n_starts <= 0:
+        return is_match.astype(np.int64)
+
+    n_codes = int(seq.max()) + 1
+    is_match[:n_starts] = True
+    for j, match_set in enumerate(match_sets):
+        is_match_code = np.zeros(n_codes, dtype=bool)
+        is_match_code[[code for code in match_set if code < n_codes]] = True
+        is_match[:n_starts] &= is_match_code[seq[j:j + n_starts]]
+    return is_match.astype(np.int64)
 
 
 def cumsum(arr):
@@ -0,0 +1,697 @@
+"""
+A vectorized simulation engine (parameter engine=vectorized), where all subjects of a run are
+simulated in lockstep. The mechanism state (v, w and vss) of all subjects is kept in NumPy arrays
+indexed by [subject, element, behavior] (or [subject, element, element] for vss), and support
+vectors, response draws and learning updates are computed for all subjects in one batched
+operation per step. Each subject has its own copy of the (compiled) world. In each step, the
+subjects are grouped by the stimulus and phase line their worlds are at, and the stimulus row
+and omit_learn of a group are computed once for all its subjects. The output of all subjects is
+written in batches from the state arrays, and put in the RunOutputSubject objects at the end of
+the simulation (see _OutputWriter).
+
+Each subject draws its random numbers from its own stream (see randomstreams.py), in the same
+order as in the reference engine in simulation.Run. The streams of all subjects are buffered in
+one array (UniformBuffers), so that the numbers for the responses of all subjects in a step are
+drawn at once. The response is drawn by summing up the support vector in the order of the feasible
+behaviors of the stimulus, as in Mechanism._get_response (see response_order). The two engines
+therefore make the same random choices for a given random_seed, and the results differ only by
+the rounding of the batched floating point operations (which may, rarely, change a response).
+"""
+import numpy as np
+
+import keywords as kw
+import mechanism
+from exceptions import InterruptedSimulation
+from output import History, RunOutput, Val
+from randomstreams import UniformBuffers, subject_seed
+
+
+def sample_responses(x_cumsum, uniforms, feasible=None):
+    """
+    Draw one response for each row of x_cumsum (the cumulative sums of support vectors), using
+    one uniform number in [0, 1) for each row. Returns, for each row, the first feasible index for
+    which q <= x_cumsum[index], where q = uniform * sum(x), as in Mechanism._get_response (where
+    the support vector only has the feasible behaviors). feasible is a boolean array like x_cumsum
+    (None if all indices are feasible).
+    """
+    q = uniforms * x_cumsum[:, -1]
+    found = (x_cumsum >= q[:, None])
+    if feasible is not None:
+        found &= feasible
+    else:
+        feasible = np.ones_like(found)
+    response = found.argmax(axis=1)
+
+    # If q is above the sum due to rounding, use the last feasible index
+    not_found = ~found.any(axis=1)
+    if not_found.any():
+        last_feasible = feasible.shape[1] - 1 - feasible[:, ::-1].argmax(axis=1)
+        response[not_found] = last_feasible[not_found]
+    return response
+
+
+class VectorizedMechanism():
+    """The state of a mechanism for a population of subjects."""
+
+    def __init__(self, mechanism_obj, n_subjects, uniforms):
+        self.mechanism_obj = mechanism_obj
+        self.uniforms = uniforms  # The UniformBuffers of the subjects
+        parameters = mechanism_obj.parameters
+
+        self.elements = list(parameters.get(kw.STIMULUS_ELEMENTS))
+        self.behaviors = list(parameters.get(kw.BEHAVIORS))
+        self.element_ind = {e: i for i, e in enumerate(self.elements)}
+        self.behavior_ind = {b: i for i, b in enumerate(self.behaviors)}
+        n_elements = len(self.elements)
+        n_behaviors = len(self.behaviors)
+        self.element_range = np.arange(n_elements)[None, :]
+
+        # Parameters, resolved once
+        self.alpha_v = self._element_behavior_array(parameters.get(kw.ALPHA_V))
+        self.beta = self._element_behavior_array(parameters.get(kw.BETA))
+        self.mu = self._element_behavior_array(parameters.get(kw.MU))
+        self.alpha_w = self._element_array(parameters.get(kw.ALPHA_W))
+        self.u = self._element_array(parameters.get(kw.U))
+        self._lambda = self._element_array(parameters.get(kw.LAMBDA))
+        self.alpha_vss = self._element_element_array(parameters.get(kw.ALPHA_VSS))
+        self.c = np.array([parameters.get(kw.BEHAVIOR_COST)[b] for b in self.behaviors], dtype=float)
+        self.discount = parameters.get(kw.DISCOUNT)
+        self.trace = mechanism_obj.trace
+        self.use_trace = mechanism_obj.use_trace
+
+        # req[e, b] is True if behavior b is a possible response to element e. None if all
+        # behaviors are possible responses to all elements.
+        if mechanism_obj.stimulus_req:
+            self.req = np.zeros((n_elements, n_behaviors), dtype=bool)
+            for element, element_behaviors in mechanism_obj.stimulus_req.items():
+                for behavior in element_behaviors:
+                    self.req[self.element_ind[element], self.behavior_ind[behavior]] = True
+        else:
+            self.req = None
+
+        # State
+        start_v = self._element_behavior_array(parameters.get(kw.START_V))
+        start_w = self._element_array(parameters.get(kw.START_W))
+        start_vss = self._element_element_array(parameters.get(kw.START_VSS))
+        self.v = np.tile(start_v, (n_subjects, 1, 1))
+        self.w = np.tile(start_w, (n_subjects, 1))
+        self.vss = np.tile(start_vss, (n_subjects, 1, 1))
+
+        self.has_prev = np.zeros(n_subjects, dtype=bool)
+        self.prev_stimulus = np.zeros((n_subjects, n_elements))
+        self.prev_present = np.zeros((n_subjects, n_elements), dtype=bool)
+        self.response = np.zeros(n_subjects, dtype=int)
+        if self.use_trace:
+            self.intensities = np.zeros((n_subjects, n_elements))
+            self.prev_intensities = np.zeros((n_subjects, n_elements))
+            self.trace_v_present = np.zeros((n_subjects, n_elements), dtype=bool)
+            # Whether or not each subject has learned for each behavior, see Mechanism._trace_floats
+            self.trace_learned = np.zeros((n_subjects, n_behaviors), dtype=bool)
+
+        if isinstance(mechanism_obj, mechanism.StimulusResponse):
+            self.learn = self._learn_sr
+        elif isinstance(mechanism_obj, mechanism.Enquist):
+            self.learn = self._learn_ga
+        elif isinstance(mechanism_obj, mechanism.EXP_SARSA):
+            self.learn = self._learn_es
+        elif isinstance(mechanism_obj, mechanism.Qlearning):
+            self.learn = self._learn_ql
+        elif isinstance(mechanism_obj, mechanism.ActorCritic):
+            self.learn = self._learn_ac
+        elif isinstance(mechanism_obj, mechanism.OriginalRescorlaWagner):
+            self.learn = self._learn_rw
+        else:
+            raise Exception(f"Internal error. Unknown mechanism {type(mechanism_obj)}.")
+        self.is_rw = isinstance(mechanism_obj, mechanism.OriginalRescorlaWagner)
+
+    def _element_behavior_array(self, values):
+        out = np.zeros((len(self.elements), len(self.behaviors)))
+        if values is not None:
+            for (element, behavior), value in values.items():
+                out[self.element_ind[element], self.behavior_ind[behavior]] = value
+        return out
+
+    def _element_element_array(self, values):
+        out = np.zeros((len(self.elements), len(self.elements)))
+        if values is not None:
+            for (element1, element2), value in values.items():
+                out[self.element_ind[element1], self.element_ind[element2]] = value
+        return out
+
+    def _element_array(self, values):
+        out = np.zeros(len(self.elements))
+        if values is not None:
+            for element, value in values.items():
+                out[self.element_ind[element]] = value
+        return out
+
+    def response_order(self, stimulus):
+        """
+        The behavior ids in the order in which Mechanism._get_response draws the response to
+        stimulus (a dict): the feasible behaviors first, in the order of
+        Mechanism._feasible_behaviors, and then the other behaviors.
+        """
+        element_ind = self.element_ind
+        feasible_behaviors = self.mechanism_obj._feasible_behaviors([(element_ind[e], 1) for e in stimulus])
+        other_behaviors = [b for b in range(len(self.behaviors)) if b not in feasible_behaviors]
+        return np.array(feasible_behaviors + other_behaviors)
+
+    def learn_and_respond(self, ix, stimulus, present, omit, order):
+        """
+        Learn and respond for the subjects ix (array of subject indices). stimulus is the
+        intensity of each element for each subject, present whether or not each element is in the
+        stimulus, omit whether or not to omit learning for each subject, and order the
+        response_order of the stimulus of each subject. Returns the response (index into
+        behaviors) of each subject (None for mechanisms without responses).
+        """
+        if self.is_rw:  # Never omit in this mechanism
+            learn = self.has_prev[ix]
+            if learn.any():
+                self.learn(ix[learn], stimulus[learn], present[learn])
+            self.prev_stimulus[ix] = stimulus
+            self.prev_present[ix] = present
+            self.has_prev[ix] = True
+            return None
+
+        if self.use_trace:
+            # As in Mechanism._decay_stimulus_intensities
+            intensities = self.intensities[ix] * self.trace
+            intensities[np.abs(intensities) < mechanism.TRACE_CUTOFF] = 0
+            self.intensities[ix] = intensities + stimulus
+
+        learn = self.has_prev[ix] & ~omit
+        if learn.any():
+            self.learn(ix[learn], stimulus[learn], present[learn])
+        if self.use_trace:
+            # As Mechanism._trace_floats, all elements are written the first time a subject learns
+            # for a response
+            first_learn = np.zeros(len(ix), dtype=bool)
+            learn_ix = ix[learn]
+            first_learn[learn] = ~self.trace_learned[learn_ix, self.response[learn_ix]]
+            self.trace_learned[learn_ix, self.response[learn_ix]] = True
+
+        response = self._get_response(ix, stimulus, present, order)
+
+        self.response[ix] = response
+        self.prev_stimulus[ix] = stimulus
+        self.prev_present[ix] = present
+        self.has_prev[ix] = True
+        if self.use_trace:
+            self.trace_v_present[ix] = (self.prev_intensities[ix] != 0) | first_learn[:, None]
+            self.prev_intensities[ix] = self.intensities[ix]
+        return response
+
+    def _feasible(self, present):
+        if self.req is None:
+            return np.ones((present.shape[0], len(self.behaviors)), dtype=bool)
+        return (present.astype(int) @ self.req.astype(int)) > 0
+
+    def _support_vector(self, ix, stimulus, present, internal_intensities=None, feasible=None):
+        """
+        The support vector of each subject, zero for the behaviors that are not feasible. feasible
+        is the _feasible(present) of the subjects, if already computed.
+        """
+        if internal_intensities is None:
+            intensities = stimulus
+            mu_weight = present.astype(float)
+        else:  # mu is added for all elements when using trace
+            intensities = internal_intensities
+            mu_weight = np.ones_like(intensities)
+        exponents = np.einsum('ne,neb->nb', intensities, self.beta * self.v[ix]) + mu_weight @ self.mu
+        if feasible is None:
+            feasible = self._feasible(present)
+        exponents = np.where(feasible, exponents, -np.inf)
+        max_exponent = exponents.max(axis=1, keepdims=True)
+        exponents -= np.where(max_exponent > 500, max_exponent, 0)  # As in Mechanism._support_vector
+        return np.exp(exponents)
+
+    def _get_response(self, ix, stimulus, present, order):
+        internal_intensities = self.intensities[ix] if self.use_trace else None
+        feasible = self._feasible(present)
+        x = self._support_vector(ix, stimulus, present, internal_intensities, feasible)
+        # Sum up the support vector in the same order as Mechanism._get_response
+        x = np.take_along_axis(x, order, axis=1)
+        feasible = np.take_along_axis(feasible, order, axis=1)
+        response = sample_responses(np.cumsum(x, axis=1), self.uniforms.take(ix), feasible)
+        return order[np.arange(len(ix)), response]
+
+    def _v_response(self, ix, response):
+        """v[(element, response)] for all elements, for each subject."""
+        return self.v[ix[:, None], self.element_range, response[:, None]]
+
+    def _add_v_response(self, ix, response, delta):
+        self.v[ix[:, None], self.element_range, response[:, None]] += delta
+
+    def _learn_sr(self, ix, stimulus, present):
+        response = self.response[ix]
+        if self.use_trace:
+            prev_intensities = self.prev_intensities[ix]
+        else:
+            prev_intensities = self.prev_stimulus[ix]
+        usum = stimulus @ self.u
+        vsum = (self._v_response(ix, response) * prev_intensities).sum(axis=1)
+        delta = self.alpha_v[:, response].T * (usum - vsum - self.c[response])[:, None] * prev_intensities
+        self._add_v_response(ix, response, delta)
+
+    def _learn_ga(self, ix, stimulus, present):
+        response = self.response[ix]
+        present = present.astype(float)
+        w = self.w[ix]
+        usum = present @ self.u
+        wsum = self.discount * (w * present).sum(axis=1)
+        if self.use_trace:
+            prev = self.prev_intensities[ix]
+        else:
+            prev = self.prev_present[ix].astype(float)
+        vsum_prev = (self._v_response(ix, response) * prev).sum(axis=1)
+        wsum_prev = (w * prev).sum(axis=1)
+        delta_v = self.alpha_v[:, response].T * (usum + wsum - self.c[response] - vsum_prev)[:, None] * prev
+        delta_w = self.alpha_w[None, :] * (usum + wsum - self.c[response] - wsum_prev)[:, None] * prev
+        self._add_v_response(ix, response, delta_v)
+        self.w[ix] += delta_w
+
+    def _check_no_trace(self):
+        if self.use_trace:
+            mechanism_name = self.mechanism_obj.parameters.get(kw.MECHANISM_NAME)
+            raise NotImplementedError(f"Trace not implemented in mechanism '{mechanism_name}'.")
+
+    def _learn_es(self, ix, stimulus, present):
+        self._check_no_trace()
+        response = self.response[ix]
+        prev = self.prev_present[ix].astype(float)
+        usum = present.astype(float) @ self.u
+        vsum_prev = (self._v_response(ix, response) * prev).sum(axis=1)
+
+        # Expected value of v for each element, with the probabilities of the behaviors
+        # responding to the element alone
+        v = self.v[ix]
+        exponents = self.beta * v + self.mu
+        if self.req is not None:
+            exponents = np.where(self.req, exponents, -np.inf)
+        exponents -= exponents.max(axis=2, keepdims=True)
+        x = np.exp(exponents)
+        p = x / x.sum(axis=2, keepdims=True)
+        expected_value = (p * v).sum(axis=2)
+        E = (expected_value * present).sum(axis=1)
+
+        delta = self.alpha_v[:, response].T * (usum + self.discount * E - self.c[response] - vsum_prev)[:, None] * prev
+        self._add_v_response(ix, response, delta)
+
+    def _learn_ql(self, ix, stimulus, present):
+        self._check_no_trace()
+        response = self.response[ix]
+        prev = self.prev_present[ix].astype(float)
+        usum = present.astype(float) @ self.u
+        vsum_prev = (self._v_response(ix, response) * prev).sum(axis=1)
+
+        v = self.v[ix]
+        if self.req is not None:
+            v = v * self.req
+        vsum_future = np.where(present, v.sum(axis=2), -np.inf)
+        maxvsum_future = vsum_future.max(axis=1)
+        maxvsum_future[~present.any(axis=1)] = 0
+
+        delta = usum + self.discount * maxvsum_future - self.c[response] - vsum_prev
+        delta = self.alpha_v[:, response].T * delta[:, None] * prev
+        self._add_v_response(ix, response, delta)
+
+    def _learn_ac(self, ix, stimulus, present):
+        self._check_no_trace()
+        response = self.response[ix]
+        prev_present = self.prev_present[ix]
+        prev = prev_present.astype(float)
+        w = self.w[ix]
+        wsum_prev = (w * prev).sum(axis=1)
+        usum = present.astype(float) @ self.u
+        wsum = (w * present).sum(axis=1)
+
+        # v
+        delta = usum + self.discount * wsum - self.c[response] - wsum_prev
+        x = self._support_vector(ix, self.prev_stimulus[ix], prev_present)
+        p = x[np.arange(len(ix)), response] / x.sum(axis=1)
+        delta_v = self.alpha_v[:, response].T * self.beta[:, response].T * (delta * (1 - p))[:, None] * prev
+        self._add_v_response(ix, response, delta_v)
+
+        # w
+        self.w[ix] += self.alpha_w[None, :] * delta[:, None] * prev
+
+    def _learn_rw(self, ix, stimulus, present):
+        # XXX Handle compound stimuli
+        assert (self.prev_present[ix].sum(axis=1) == 1).all()
+        assert (present.sum(axis=1) == 1).all()
+
+        s1 = self.prev_present[ix].argmax(axis=1)
+        s2 = present.argmax(axis=1)
+        target = np.zeros((len(ix), len(self.elements)))
+        target[np.arange(len(ix)), s2] = self._lambda[s2]
+        vss = self.vss[ix, s1, :]
+        self.vss[ix, s1, :] = vss + self.alpha_vss[s1, :] * (target - vss)
+
+
+class _ValLog():
+    """
+    The values written to one variable (v, w or vss) of all subjects: the subject index, the key
+    index, the step and the value of each write, as chunks of NumPy arrays in the order written.
+    """
+
+    def __init__(self):
+        self.chunks = list()
+
+    def write(self, subject_inds, keys, steps, values):
+        if len(subject_inds) > 0:
+            self.chunks.append((subject_inds, keys, steps, values))
+
+    def vals(self, n_keys):
+        """
+        A Val object with the writes of each subject and key, in the order written, as a dict keyed
+        by (subject index, key index) ordered by subject index and key index.
+        """
+        if not self.chunks:
+            return dict()
+        subject_inds, keys, steps, values = (np.concatenate(arrays) for arrays in zip(*self.chunks))
+        out = dict()
+        for ind, (steps_i, values_i) in _split(subject_inds * n_keys + keys, steps, values):
+            out[divmod(ind, n_keys)] = Val.from_arrays(values_i, steps_i)
+        return out
+
+
+def _split(inds, *arrays):
+    """
+    Split arrays by the value of inds (a NumPy array of ints, one for each element of the arrays),
+    keeping the order within each part. Yields the value and the parts of the arrays, in the order
+    of the values.
+    """
+    if len(inds) == 0:
+        return
+    order = np.argsort(inds, kind='stable')
+    inds = inds[order]
+    arrays = [array[order] for array in arrays]
+    bounds = (np.flatnonzero(np.diff(inds)) + 1).tolist()
+    starts, stops = [0] + bounds, bounds + [len(inds)]
+    for start, stop, ind in zip(starts, stops, inds[starts].tolist()):
+        yield ind, [array[start:stop] for array in arrays]
+
+
+class _OutputWriter():
+    """
+    Writes the output of all subjects in batches. In each step, the written v, w and vss (taken
+    from the state arrays of the VectorizedMechanism), the history and the phase line labels of
+    all stepped subjects are logged as NumPy arrays. When the simulation is done, finish puts them
+    in the Val and History objects of the RunOutputSubject objects, as written one by one in
+    simulation.Run.simulate_subject.
+    """
+
+    def __init__(self, vmech, out, run):
+        self.vmech = vmech
+        self.out = out
+        elements, behaviors = vmech.elements, vmech.behaviors
+        recording = run.recording
+        output_subjects = out.output_subjects
+
+        # Whether each subject writes each variable, and the history and phase line labels
+        self.has_v = np.array([run.has_v and s.records('v') for s in output_subjects], dtype=bool)
+        self.has_w = np.array([run.has_w and s.records('w') for s in output_subjects], dtype=bool)
+        self.has_vss = np.array([run.has_vss and s.records('vss') for s in output_subjects], dtype=bool)
+        self.has_history = np.array([s.recording is None or s.recording.history for s in output_subjects],
+                                    dtype=bool)
+
+        # The keys of each variable (as in RunOutputSubject.v, w and vss), and which are written
+        self.v_keys = [(e, b) for e in elements for b in behaviors]
+        self.w_keys = elements
+        self.vss_keys = [(e1, e2) for e1 in elements for e2 in elements]
+        self.v_written = np.array([recording is None or recording.records('v', key) for key in self.v_keys],
+                                  dtype=bool).reshape(len(elements), len(behaviors))
+        self.w_written = np.array([recording is None or recording.records('w', key) for key in self.w_keys],
+                                  dtype=bool)
+        self.vss_written = np.array([recording is None or recording.records('vss', key) for key in self.vss_keys],
+                                    dtype=bool).reshape(len(elements), len(elements))
+
+        self.v_log = _ValLog()
+        self.w_log = _ValLog()
+        self.vss_log = _ValLog()
+        self.history_log = list()
+        self.label_log = list()
+
+    def write_all(self, ix, steps):
+        """Write all v, w and vss of the subjects ix (array of subject indices) at steps."""
+        vmech = self.vmech
+        n_elements, n_behaviors = self.v_written.shape
+        sub, e, b = np.nonzero(self.has_v[ix, None, None] & self.v_written)
+        self.v_log.write(ix[sub], e * n_behaviors + b, steps[sub], vmech.v[ix[sub], e, b])
+        sub, e = np.nonzero(self.has_w[ix, None] & self.w_written)
+        self.w_log.write(ix[sub], e, steps[sub], vmech.w[ix[sub], e])
+        sub, e1, e2 = np.nonzero(self.has_vss[ix, None, None] & self.vss_written)
+        self.vss_log.write(ix[sub], e1 * n_elements + e2, steps[sub], vmech.vss[ix[sub], e1, e2])
+
+    def write_learned(self, ix, prev_present, prev_response, steps):
+        """
+        Write the v, w and vss that the subjects ix (array of subject indices) may have changed
+        when learning, at steps. prev_present is whether or not each element was in the previous
+        stimulus of each subject, and prev_response the previous response of each subject.
+        """
+        vmech = self.vmech
+        n_elements, n_behaviors = self.v_written.shape
+        if self.has_v[ix].any():
+            # With trace, v may have changed for all elements with an intensity in the previous
+            # internal intensities
+            elements = vmech.trace_v_present[ix] if vmech.use_trace else prev_present
+            sub, e = np.nonzero(elements & self.has_v[ix, None] & self.v_written[:, prev_response].T)
+            b = prev_response[sub]
+            self.v_log.write(ix[sub], e * n_behaviors + b, steps[sub], vmech.v[ix[sub], e, b])
+        if self.has_w[ix].any():
+            sub, e = np.nonzero(prev_present & self.has_w[ix, None] & self.w_written)
+            self.w_log.write(ix[sub], e, steps[sub], vmech.w[ix[sub], e])
+        if self.has_vss[ix].any():
+            # All vss[(prev_stimulus,*)] is set in OriginalRescorlaWagner.learn_and_respond
+            # XXX Handle compound stimuli
+            assert (prev_present[self.has_vss[ix]].sum(axis=1) == 1).all()
+            sub, e1, e2 = np.nonzero(prev_present[:, :, None] & self.has_vss[ix, None, None] & self.vss_written)
+            self.vss_log.write(ix[sub], e1 * n_elements + e2, steps[sub], vmech.vss[ix[sub], e1, e2])
+
+    def write_history(self, ix, stimulus_codes, response_codes):
+        """Write the stimulus and response codes of a step of the subjects ix to the history."""
+        written = self.has_history[ix]
+        self.history_log.append((ix[written], stimulus_codes[written], response_codes[written]))
+
+    def write_phase_line_labels(self, ix, codes, steps):
+        """Write the phase line label codes (a list) of each of the subjects ix at steps."""
+        written = self.has_history[ix]
+        ix, steps = ix[written], steps[written]
+        n_codes = len(codes)
+        self.label_log.append((np.repeat(ix, n_codes), np.tile(codes, len(ix)), np.repeat(steps, n_codes)))
+
+    def finish(self):
+        """Put the logged output in the RunOutputSubject objects."""
+        output_subjects = self.out.output_subjects
+        for variable, log, keys in (('v', self.v_log, self.v_keys), ('w', self.w_log, self.w_keys),
+                                    ('vss', self.vss_log, self.vss_keys)):
+            for (subject_ind, key_ind), val in log.vals(len(keys)).items():
+                getattr(output_subjects[subject_ind], variable)[keys[key_ind]] = val
+
+        if self.history_log:
+            subject_inds, stimulus_codes, response_codes = (np.concatenate(arrays) for arrays in zip(*self.history_log))
+            for subject_ind, (stimulus_codes_i, response_codes_i) in _split(subject_inds, stimulus_codes,
+                                                                           response_codes):
+                output_subjects[subject_ind].history_steps = History.from_codes(stimulus_codes_i, response_codes_i)
+
+        if self.label_log:
+            subject_inds, codes, steps = (np.concatenate(arrays) for arrays in zip(*self.label_log))
+            for subject_ind, (codes_i, steps_i) in _split(subject_inds, codes, steps):
+                output_subjects[subject_ind].phase_line_label_codes = codes_i.tolist()
+                output_subjects[subject_ind].phase_line_labels_steps = steps_i.tolist()
+
+
+class _Group():
+    """
+    The subjects that get the same stimulus at the same phase line in a step, and therefore
+    share the stimulus row and omit_learn.
+    """
+
+    def __init__(self, stimulus, phase_label, phase_line_label, preceeding_help_lines, omit_learn):
+        self.stimulus = stimulus
+        self.phase_label = phase_label
+        self.phase_line_label = phase_line_label
+        self.preceeding_help_lines = preceeding_help_lines
+        self.omit_learn = omit_learn
+        self.subject_inds = list()
+
+
+def simulate(run, random_seed, progress=None):
+    """
+    Simulate all subjects of the specified Run object in lockstep, with the random generators
+    derived from random_seed. Returns a RunOutput object.
+    """
+    n_subjects = run.n_subjects
+    mechanism_obj = run.mechanism_obj
+    symbols = run.symbols
+    stimulus_elements = list(mechanism_obj.parameters.get(kw.STIMULUS_ELEMENTS))
+    behaviors = list(mechanism_obj.parameters.get(kw.BEHAVIORS))
+    is_bind_off = (run.bind_trials == "off")
+
+    uniforms = UniformBuffers([subject_seed(random_seed, run.run_label, subject_ind)
+                               for subject_ind in range(n_subjects)])
+    vmech = VectorizedMechanism(mechanism_obj, n_subjects, uniforms)
+    out = RunOutput(n_subjects, mechanism_obj, symbols, run.recording)
+    output_subjects = out.output_subjects
+    writer = _OutputWriter(vmech, out, run)
+    has_history = writer.has_history.any()
+
+    # Each subject has its own copy of the (compiled) world
+    worlds = list()
+    for subject_ind in range(n_subjects):
+        world = run.compiled_world.copy()
+        world.set_random(uniforms.generator(subject_ind), (random_seed, run.run_label))
+        worlds.append(world)
+
+    # The step of each subject (as step in simulation.Run.simulate_subject), the codes of its last
+    # stimulus and response, the index (in phase_inds) of the phase of its last step, and its last
+    # response (for next_stimulus)
+    steps = np.ones(n_subjects, dtype=np.int64)
+    stimulus_codes = np.zeros(n_subjects, dtype=np.int64)
+    response_codes = np.zeros(n_subjects, dtype=np.int64)
+    subject_phase_inds = np.full(n_subjects, -1)
+    subject_responses = [None] * n_subjects
+    phase_inds = dict()
+    if vmech.is_rw:  # The response is None
+        behavior_codes = np.array([symbols.code(None) if has_history else 0])
+    else:
+        behavior_codes = np.array([symbols.code(behavior) for behavior in behaviors])
+
+    # Initialize output with start values
+    writer.write_all(np.arange(n_subjects), np.zeros(n_subjects, dtype=np.int64))
+
+    if progress:
+        if progress.get_n_runs() > 1:
+            progress.report1(f"{run.run_label}: Simulating {n_subjects} subjects")
+        else:
+            progress.report1(f"Simulating {n_subjects} subjects")
+        progress.reset2()
+        progress.report2("")
+    min_phase_ind = -1  # For phases progress
+
+    # The stimulus row, the present elements, the response order and the history code of each
+    # stimulus of the world, keyed by the id of the stimulus dict. The dicts are shared by the
+    # copies of the world, and do not change after they are first returned by next_stimulus.
+    rows = dict()
+
+    # The codes of the preceeding help lines and the phase line label of each phase line
+    label_codes = dict()
+
+    active = list(range(n_subjects))
+    while active:
+        if progress and progress.get_stop_clicked():
+            raise InterruptedSimulation()
+
+        # Step the world of each subject, and group the subjects that get the same stimulus at the
+        # same phase line
+        groups = dict()
+        done = list()
+        for subject_ind in active:
+            next_stimulus_out = worlds[subject_ind].next_stimulus(subject_responses[subject_ind])
+            stimulus, phase_label, phase_line_label, preceeding_help_lines, omit_learn = next_stimulus_out
+            if stimulus is None:
+                done.append(subject_ind)
+                continue
+
+            key = (id(stimulus), phase_label, phase_line_label, tuple(preceeding_help_lines), bool(omit_learn))
+            group = groups.get(key)
+            if group is None:
+                groups[key] = group = _Group(stimulus, phase_label, phase_line_label, key[3], key[4])
+            group.subject_inds.append(subject_ind)
+
+        if done:
+            # Write the last step to all variables
+            done = np.array(done)
+            last_steps = steps[done] - 1
+            writer.write_all(done, last_steps)
+            writer.write_history(done, stimulus_codes[done], response_codes[done])
+            for subject_ind, step in zip(done.tolist(), last_steps.tolist()):
+                output_subjects[subject_ind].write_step("last", step + 2)
+                if progress:
+                    progress.increment1()
+        if not groups:
+            break
+
+        sizes = [len(group.subject_inds) for group in groups.values()]
+        ix = np.array([subject_ind for group in groups.values() for subject_ind in group.subject_inds])
+
+        if progress:
+            phase_ind = min(worlds[subject_ind].curr_phaseind for subject_ind in ix.tolist())
+            if phase_ind != min_phase_ind:
+                phase_label = worlds[ix[0]].phases[phase_ind].label
+                progress.increment2(run.run_label)
+                progress.report2(f"Phase {phase_label}")
+                min_phase_ind = phase_ind
+
+        # Learn and respond for all stepped subjects at once, each group sharing one stimulus row
+        group_rows = list()
+        group_presents = list()
+        group_omits = list()
+        group_orders = list()
+        for group in groups.values():
+            stimulus_id = id(group.stimulus)
+            if stimulus_id not in rows:
+                row = np.zeros(len(stimulus_elements))
+                row_present = np.zeros(len(stimulus_elements), dtype=bool)
+                for element, intensity in group.stimulus.items():
+                    row[vmech.element_ind[element]] = intensity
+                    row_present[vmech.element_ind[element]] = True
+                stimulus_code = symbols.stimulus_code(group.stimulus) if has_history else 0
+                rows[stimulus_id] = (row, row_present, vmech.response_order(group.stimulus), stimulus_code)
+            row, row_present, order, _ = rows[stimulus_id]
+            group_rows.append(row)
+            group_presents.append(row_present)
+            group_orders.append(order)
+            # Remove when omit_learn using new_trial is no longer suppoerted
+            omit_learn_using_new_trial = run.omit_learn_using_new_trial(group.phase_line_label,
+                                                                        group.preceeding_help_lines, is_bind_off)
+            group_omits.append(group.omit_learn or omit_learn_using_new_trial)
+        stimulus_array = np.repeat(np.array(group_rows), sizes, axis=0)
+        present = np.repeat(np.array(group_presents), sizes, axis=0)
+        omit = np.repeat(np.array(group_omits), sizes)
+        order = np.repeat(np.array(group_orders), sizes, axis=0)
+
+        has_prev = vmech.has_prev[ix]
+        prev_present = vmech.prev_present[ix]
+        prev_response = vmech.response[ix]
+        responses = vmech.learn_and_respond(ix, stimulus_array, present, omit, order)
+
+        # Write the step of the subjects with a previous stimulus
+        stepped = ix[has_prev]
+        writer.write_learned(stepped, prev_present[has_prev], prev_response[has_prev], steps[stepped])
+        writer.write_history(stepped, stimulus_codes[stepped], response_codes[stepped])
+        start = 0
+        for group, size in zip(groups.values(), sizes):
+            group_ix = ix[start:start + size]
+            group_stepped = group_ix[has_prev[start:start + size]]
+            start += size
+
+            phase_label = group.phase_label
+            phase_ind = phase_inds.setdefault(phase_label, len(phase_inds))
+            for subject_ind in group_stepped[subject_phase_inds[group_stepped] != phase_ind].tolist():
+                step = int(steps[subject_ind])
+                output_subjects[subject_ind].write_step(phase_label, step + 1 if step > 1 else step)
+                subject_phase_inds[subject_ind] = phase_ind
+            steps[group_stepped] += 1
+
+            if has_history:
+                label_key = (group.phase_line_label, group.preceeding_help_lines)
+                codes = label_codes.get(label_key)
+                if codes is None:
+                    codes = [symbols.code(label) for label in group.preceeding_help_lines]
+                    codes.append(symbols.code(group.phase_line_label))
+                    label_codes[label_key] = codes
+                writer.write_phase_line_labels(group_ix, codes, steps[group_ix])
+                stimulus_codes[group_ix] = rows[id(group.stimulus)][3]
+
+        if responses is None:
+            response_codes[ix] = behavior_codes[0]
+        else:
+            response_codes[ix] = behavior_codes[responses]
+            for subject_ind, response in zip(ix.tolist(), responses.tolist()):
+                subject_responses[subject_ind] = behaviors[response]
+
+        active = ix.tolist()
+
+    writer.finish()
+    return out